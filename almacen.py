@@ -0,0 +1,198 @@
+"""
+Almacén en memoria de la flota para el camino sin DB (o cuando la consulta SQL falla).
+
+En lugar de filtrar con máscaras booleanas el DataFrame completo en cada petición (una copia
+por filtro) y reordenarlo por ORD, AlmacenFlota se construye una vez por versión de datos:
+
+- el DataFrame se ordena por ORD una sola vez y las columnas con valores repetidos se guardan
+  como category (códigos enteros);
+- por cada división, (división, brigada) y (división, brigada, unidad) guarda el arreglo de
+  posiciones de sus filas, ya en orden de ORD;
+- placa, búsqueda de texto y rangos se evalúan solo sobre las posiciones candidatas.
+
+Filtrar y paginar es entonces cortar arreglos de posiciones (searchsorted para los cursores) y
+solo se materializan las filas de la página pedida.
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils import (Vehiculo, cargar_datos, categorizar, version_datos_vigente, normalizar_placa, terminos_busqueda,
+                   patron_termino, texto_busqueda_serie, valores_numericos, COLUMNAS_DB, COLUMNAS_CATEGORICAS, RANGOS, EXCEL_FILE)
+from journal import firma_journal
+
+try:
+    from flask import current_app
+except Exception:
+    current_app = None
+
+NIVELES = ('DIVISION', 'BRIGADA', 'UNIDAD')
+# Además de COLUMNAS_CATEGORICAS, el almacén codifica las columnas de los índices por nivel y
+# cualquier otra cuyos valores distintos no pasen de esta fracción de las filas
+COLUMNAS_CODIFICADAS = list(dict.fromkeys(COLUMNAS_CATEGORICAS + ['BRIGADA', 'UNIDAD']))
+MAX_FRACCION_DISTINTOS = 0.5
+_VACIO = np.empty(0, dtype=np.int64)
+
+_ALMACEN = {'clave': None, 'almacen': None}
+_GUARDA = threading.Lock()
+
+
+class AlmacenFlota:
+    """Vista de solo lectura de la flota, ordenada por ORD, con índices de posiciones por nivel."""
+
+    def __init__(self, df, clave=None):
+        self.clave = clave
+        if 'ORD' in df.columns:
+            ords = pd.to_numeric(df['ORD'], errors='coerce').to_numpy(dtype=float)
+        else:
+            ords = np.arange(len(df), dtype=float)
+        # argsort estable: los ORD no numéricos (NaN) quedan al final
+        orden = np.argsort(ords, kind='stable')
+        self.df = categorizar(df.iloc[orden].reset_index(drop=True))
+        for col in self.df.columns:
+            if col == 'ORD' or isinstance(self.df[col].dtype, pd.CategoricalDtype):
+                continue
+            if col in COLUMNAS_CODIFICADAS or self.df[col].nunique() <= MAX_FRACCION_DISTINTOS * len(self.df):
+                self.df[col] = self.df[col].astype(str).astype('category')
+        self.ords = ords[orden]
+        self._todas = np.arange(len(self.df), dtype=np.int64)
+
+        niveles = [c for c in NIVELES if c in self.df.columns]
+        self._niveles = niveles
+        # profundidad -> {clave: posiciones}; groupby.indices entrega las posiciones en orden creciente
+        self._indices = {}
+        for n in range(1, len(niveles) + 1):
+            grupos = self.df.groupby(niveles[:n], observed=True, sort=False).indices
+            self._indices[n] = {(k if isinstance(k, tuple) else (k,)): v.astype(np.int64) for k, v in grupos.items()}
+        self._placas = self.df['PLACAS'].astype(str).to_numpy() if 'PLACAS' in self.df.columns else None
+        # Derivados que solo se calculan si alguna petición los usa
+        self._texto = None
+        self._numeros = {}
+
+    def __len__(self):
+        return len(self.df)
+
+    def _por_codigo(self, pos, col, valor):
+        """Posiciones de pos cuya columna category col vale valor (comparando códigos)."""
+        columna = self.df[col]
+        categorias = columna.cat.categories
+        if valor not in categorias:
+            return _VACIO
+        codigos = columna.cat.codes.to_numpy()
+        return pos[codigos[pos] == categorias.get_loc(valor)]
+
+    def posiciones(self, division=None, brigada=None, unidad=None, placa=None, q=None, rangos=None):
+        """Posiciones (en orden de ORD) de las filas que cumplen los mismos filtros que filtrar_df."""
+        valores = dict(zip(NIVELES, (division, brigada, unidad)))
+        # Prefijo más largo de niveles indicados que tiene índice (división, división+brigada, las tres)
+        prefijo = []
+        for col in self._niveles:
+            if not valores[col]:
+                break
+            prefijo.append(valores[col])
+        pos = self._indices[len(prefijo)].get(tuple(prefijo), _VACIO) if prefijo else self._todas
+        for col in self._niveles[len(prefijo):]:
+            if valores[col]:
+                pos = self._por_codigo(pos, col, valores[col])
+
+        if placa and self._placas is not None and len(pos):
+            placa_norm = normalizar_placa(placa.strip())
+            pos = pos[pd.Series(self._placas[pos]).str.contains(placa_norm, regex=False).to_numpy()]
+        terminos = terminos_busqueda(q) if q else []
+        if terminos and len(pos):
+            texto = self._texto_busqueda()
+            for termino in terminos:
+                pos = pos[texto[pos].str.contains(patron_termino(termino), regex=True).to_numpy()]
+        for nombre, minimo, maximo in rangos or ():
+            numeros = self._numeros_de(RANGOS[nombre])
+            if numeros is None:
+                continue
+            valores_pos = numeros[pos]
+            mascara = np.ones(len(pos), dtype=bool)
+            if minimo is not None:
+                mascara &= valores_pos >= minimo
+            if maximo is not None:
+                mascara &= valores_pos <= maximo
+            pos = pos[mascara]
+        return pos
+
+    def _texto_busqueda(self):
+        if self._texto is None:
+            campos = {col: campo for col, campo in COLUMNAS_DB.items() if col in self.df.columns}
+            texto = texto_busqueda_serie(self.df[list(campos)].astype(str).rename(columns=campos))
+            self._texto = texto.reset_index(drop=True) if isinstance(texto, pd.Series) else pd.Series([''] * len(self))
+        return self._texto
+
+    def _numeros_de(self, campo):
+        if campo not in self._numeros:
+            col = {c: f for f, c in COLUMNAS_DB.items()}.get(campo)
+            self._numeros[campo] = (valores_numericos(self.df[col]).to_numpy()
+                                    if col in self.df.columns else None)
+        return self._numeros[campo]
+
+    def contar(self, **filtros):
+        return int(len(self.posiciones(**filtros)))
+
+    def pagina(self, limit=None, offset=None, despues_de=None, antes_de=None, **filtros):
+        """
+        (DataFrame de la página, total de filas que cumplen los filtros). despues_de / antes_de
+        paginan por ORD como query_vehiculos; la página siempre sale en orden ascendente.
+        """
+        pos = self.posiciones(**filtros)
+        total = int(len(pos))
+        if despues_de is not None:
+            pos = pos[np.searchsorted(self.ords[pos], int(despues_de), side='right'):]
+        if antes_de is not None:
+            pos = pos[:np.searchsorted(self.ords[pos], int(antes_de), side='left')]
+            if limit is not None:
+                pos = pos[max(len(pos) - limit, 0):]
+                limit = None
+        if offset:
+            pos = pos[offset:]
+        if limit is not None:
+            pos = pos[:limit]
+        return self.df.iloc[pos], total
+
+    def bloques(self, tamano, **filtros):
+        """Genera DataFrames de hasta `tamano` filas, en orden de ORD, con las filas que cumplen los filtros."""
+        pos = self.posiciones(**filtros)
+        for inicio in range(0, len(pos), tamano):
+            yield self.df.iloc[pos[inicio:inicio + tamano]]
+
+    def memoria(self):
+        """Bytes aproximados del almacén (DataFrame, ORD e índices de posiciones)."""
+        indices = sum(v.nbytes for nivel in self._indices.values() for v in nivel.values())
+        return int(self.df.memory_usage(deep=True).sum() + self.ords.nbytes + self._todas.nbytes + indices)
+
+
+def clave_datos():
+    """
+    Versión de los datos que devuelve cargar_datos(): la versión de la DB si está configurada y
+    responde; si no, tamaño/mtime del Excel y firma de su journal.
+    """
+    try:
+        if Vehiculo is not None and current_app and current_app.config.get('SQLALCHEMY_DATABASE_URI'):
+            return ('db', version_datos_vigente())
+    except Exception:
+        pass
+    excel_file = os.environ.get('EXCEL_FILE', EXCEL_FILE)
+    try:
+        st = os.stat(excel_file)
+        return ('excel', st.st_size, st.st_mtime_ns, firma_journal(excel_file))
+    except OSError:
+        return ('excel', None)
+
+
+def obtener_almacen():
+    """AlmacenFlota de la versión vigente; se reconstruye (una vez por proceso) cuando cambia."""
+    clave = clave_datos()
+    almacen = _ALMACEN['almacen']
+    if almacen is not None and _ALMACEN['clave'] == clave:
+        return almacen
+    with _GUARDA:
+        if _ALMACEN['almacen'] is None or _ALMACEN['clave'] != clave:
+            _ALMACEN['almacen'] = AlmacenFlota(cargar_datos(), clave)
+            _ALMACEN['clave'] = clave
+        return _ALMACEN['almacen']
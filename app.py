@@ -1,9 +1,7 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, send_file, session, jsonify, stream_with_context
 import os
-import threading
-import pandas as pd
-import re
-import io
+import json
+import hashlib
 
 # Import seguro de load_dotenv (puede faltar python-dotenv)
 try:
@@ -12,11 +10,27 @@ except Exception:
     def load_dotenv():
         print('Aviso: python-dotenv no está instalado. Las variables de entorno no se cargarán desde .env. Instala python-dotenv si quieres cargar .env automáticamente.')
 
-# Añadir invalidate_db_cache al importar utils
-from utils import cargar_datos, limpiar_nans, obtener_opciones, filtrar_vehiculos, COLUMNAS, get_divisiones_db, get_brigadas_db, get_unidades_db, invalidate_db_cache, query_vehiculos, count_vehiculos
-
-
-def create_app():
+# orjson es opcional: si está instalado, /api/vehiculos serializa con él (varias veces más rápido)
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+from utils import (estadisticas_cache, codificar_cursor, decodificar_cursor, total_vehiculos, guardar_total,
+                   filas_vehiculos, rangos_de_argumentos)
+from filtros import obtener_indice_filtros
+from exportacion import exportar, formato_disponible, FORMATOS
+from edicion import aplicar_cambios, iniciar_compactador, MAX_CAMBIOS_LOTE
+from cache_exportaciones import obtener_exportacion, iniciar_regenerador, avisar_cambio_datos, estadisticas_exportaciones
+from conexiones import opciones_engine, estadisticas_pool
+from resumen import consultar_resumen
+from cambios import feed_cambios, TokenVencido, LIMITE_CAMBIOS
+from historial import historial_vehiculo, vehiculo_en, flota_en, parsear_instante, LIMITE_HISTORIAL, MAX_LIMITE_HISTORIAL
+
+
+def create_app(cargar_filtros=True):
+    """Crea la aplicación. Los scripts de arranque (init_db.py, run_import.py) usan
+    cargar_filtros=False: no sirven páginas y no necesitan consultar los filtros."""
     load_dotenv()
     app = Flask(__name__)
     app.secret_key = os.environ.get('APP_SECRET_KEY', 'mi_clave0705')
@@ -29,6 +43,15 @@ def create_app():
         # Fallback: usar sqlite local para pruebas si no hay DATABASE_URL
         app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///transportes.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Pool por worker, pre-ping, reciclado y statement_timeout (variables DB_* de conexiones.py)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opciones_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    # Segundos entre comprobaciones de versión del hilo que regenera la caché de exportaciones
+    app.config['EXPORT_REGENERAR_INTERVALO'] = float(os.environ.get('EXPORT_REGENERAR_INTERVALO', 30))
+    # Espera tras un aviso de cambio antes de regenerar, para agrupar ediciones seguidas
+    app.config['EXPORT_REGENERAR_RETRASO'] = float(os.environ.get('EXPORT_REGENERAR_RETRASO', 5))
+    # Compactación del journal de ediciones del Excel: revisión periódica y espera tras una edición
+    app.config['EXCEL_COMPACTAR_INTERVALO'] = float(os.environ.get('EXCEL_COMPACTAR_INTERVALO', 300))
+    app.config['EXCEL_COMPACTAR_RETRASO'] = float(os.environ.get('EXCEL_COMPACTAR_RETRASO', 5))
 
     # Importar modelos/DB solo en tiempo de ejecución para evitar errores si falta la dependencia
     try:
@@ -45,44 +68,37 @@ def create_app():
     LOGIN_USER = os.getenv("LOGIN_USER", "javier76")
     LOGIN_PASS = os.getenv("LOGIN_PASS", "mecanico76")
 
-    # Crear un semáforo global para operaciones de escritura
-    excel_lock = threading.Lock()
-
-    # Variables globales para divisiones, brigadas y unidades
+    # Variables globales para divisiones, brigadas y unidades (derivadas del índice de filtros)
     divisiones_global = []
     brigadas_global = {}
     unidades_global = {}
+    indice_filtros = None
 
     def inicializar_filtros():
-        nonlocal divisiones_global, brigadas_global, unidades_global
+        nonlocal divisiones_global, brigadas_global, unidades_global, indice_filtros
         try:
-            # Intentar inicializar con consultas rápidas a la BD (no leer todo Excel)
-            try:
-                divisiones_global = get_divisiones_db()
-                for division in divisiones_global:
-                    brigadas = get_brigadas_db(division)
-                    brigadas_global[division] = brigadas
-                    for brigada in brigadas:
-                        unidades = get_unidades_db(division, brigada)
-                        unidades_global[(division, brigada)] = unidades
+            # Una sola consulta agrupada construye el árbol completo con conteos por nodo
+            indice = obtener_indice_filtros()
+            if indice is indice_filtros:
                 return
-            except Exception as e:
-                print(f'Advertencia: no se pudo inicializar filtros usando consultas rápidas: {e}')
-            # Fallback: leer DataFrame completo si las consultas rápidas fallan
-            df = cargar_datos()
-            divisiones_global, _, _ = obtener_opciones(df)
-            for division in divisiones_global:
-                brigadas = obtener_opciones(df, division=division)[1]
-                brigadas_global[division] = brigadas
-                for brigada in brigadas:
-                    unidades = obtener_opciones(df, division=division, brigada=brigada)[2]
-                    unidades_global[(division, brigada)] = unidades
+            indice_filtros = indice
+            divisiones_global = indice.divisiones()
+            brigadas_global = indice.brigadas_global()
+            unidades_global = indice.unidades_global()
         except Exception as e:
             print(f"Error al inicializar filtros: {e}")
 
     # Inicializar filtros al arrancar
-    with app.app_context():
-        inicializar_filtros()
+    if cargar_filtros:
+        with app.app_context():
+            inicializar_filtros()
+        # Hilo de regeneración de exportaciones (EXPORT_REGENERAR=0 lo desactiva)
+        if os.environ.get('EXPORT_REGENERAR', '1') != '0':
+            iniciar_regenerador(app)
+        # Hilo que vuelca el journal de ediciones al Excel (EXCEL_COMPACTAR=0 lo desactiva)
+        if os.environ.get('EXCEL_COMPACTAR', '1') != '0':
+            iniciar_compactador(EXCEL_FILE, app.config['EXCEL_COMPACTAR_INTERVALO'],
+                                app.config['EXCEL_COMPACTAR_RETRASO'])
 
 
     @app.route('/')
@@ -94,6 +110,8 @@ def create_app():
             unidad_filtro = request.args.get('unidad', '')
             placa_filtro = request.args.get('placa', '')
 
+            # Refrescar los filtros si una edición o importación cambió la versión de datos
+            inicializar_filtros()
             brigadas = brigadas_global.get(division_filtro, [])
             unidades = unidades_global.get((division_filtro, brigada_filtro), [])
 
@@ -112,28 +130,274 @@ def create_app():
             print(f"Error al cargar la página principal: {e}")
             return "Error interno del servidor", 500
 
+    def respuesta_json(payload):
+        """Respuesta JSON serializada con orjson si está disponible; si no, con jsonify."""
+        if orjson is None:
+            return jsonify(payload)
+        return app.response_class(orjson.dumps(payload), mimetype='application/json')
+
     # API para paginación / búsqueda (devuelve JSON)
+    # Paginación por cursor (keyset sobre ORD): ?cursor=<next|prev de la respuesta anterior>.
+    # Se mantiene ?page=N (offset) por compatibilidad. Con q (orden por relevancia) los cursores
+    # guardan un offset, porque el orden ya no es por ORD.
     @app.route('/api/vehiculos')
     def api_vehiculos():
         try:
-            page = int(request.args.get('page', 1))
-            per_page = int(request.args.get('per_page', 50))
+            max_per_page = app.config.get('API_MAX_PER_PAGE', 200)
+            per_page = min(max(int(request.args.get('per_page', 50)), 1), max_per_page)
             division = request.args.get('division') or None
             brigada = request.args.get('brigada') or None
             unidad = request.args.get('unidad') or None
             placa = request.args.get('placa') or None
+            q = request.args.get('q') or None
+            # Rangos sobre las columnas numéricas: ano_min, ano_max, valor_comercial_min, ...
+            rangos = rangos_de_argumentos(request.args)
+            filtros = dict(division=division, brigada=brigada, unidad=unidad, placa=placa, q=q, rangos=rangos)
+
+            cursor = request.args.get('cursor')
+            page = None
+            if cursor:
+                # Solo se aceptan las claves que genera esta API, con su tipo: 'off' (entero >= 0)
+                # o 'k' (ORD entero) con 'd' ('n' siguiente, 'p' anterior)
+                crudo = decodificar_cursor(cursor)
+                try:
+                    if crudo.get('off') is not None:
+                        posicion = {'off': int(crudo['off'])}
+                        if posicion['off'] < 0:
+                            raise ValueError
+                    elif crudo.get('k') is not None:
+                        posicion = {'k': int(crudo['k']), 'd': crudo.get('d', 'n')}
+                        if posicion['d'] not in ('n', 'p'):
+                            raise ValueError
+                    else:
+                        raise ValueError
+                except (ValueError, TypeError):
+                    raise ValueError('cursor inválido')
+            elif 'page' in request.args:
+                page = max(int(request.args.get('page', 1)), 1)
+                posicion = {'off': (page - 1) * per_page}
+            else:
+                posicion = {}
+        except ValueError as e:
+            return jsonify({'error': f'parámetro inválido: {e}'}), 400
 
-            offset = (page - 1) * per_page
-            df_page = query_vehiculos(division=division, brigada=brigada, unidad=unidad, placa=placa, limit=per_page, offset=offset)
-            total = count_vehiculos(division=division, brigada=brigada, unidad=unidad, placa=placa)
-
-            records = df_page.to_dict(orient='records')
-            return jsonify({'total': total, 'page': page, 'per_page': per_page, 'vehicles': records})
+        try:
+            # Se pide una fila extra para saber si hay más en la dirección de avance
+            # Páginas por offset y primera página por cursor: filas y total en una sola consulta
+            # (COUNT(*) OVER ()). Páginas siguientes por cursor: total desde el LRU de totales.
+            total = None
+            if q or 'off' in posicion:
+                offset = int(posicion.get('off', 0))
+                filas, total = filas_vehiculos(**filtros, limit=per_page + 1, offset=offset, con_total=True)
+                hay_mas = len(filas) > per_page
+                filas = filas[:per_page]
+                siguiente = codificar_cursor({'off': offset + per_page}) if hay_mas else None
+                anterior = codificar_cursor({'off': max(offset - per_page, 0)}) if offset > 0 else None
+            elif posicion.get('d') == 'p':
+                filas = filas_vehiculos(**filtros, limit=per_page + 1, antes_de=posicion.get('k'))
+                hay_mas = len(filas) > per_page
+                filas = filas[-per_page:] if hay_mas else filas
+                ords = [f['ORD'] for f in filas if 'ORD' in f]
+                siguiente = codificar_cursor({'k': int(ords[-1]), 'd': 'n'}) if ords else None
+                anterior = codificar_cursor({'k': int(ords[0]), 'd': 'p'}) if hay_mas and ords else None
+            elif posicion.get('k') is None:
+                filas, total = filas_vehiculos(**filtros, limit=per_page + 1, con_total=True)
+                hay_mas = len(filas) > per_page
+                filas = filas[:per_page]
+                ords = [f['ORD'] for f in filas if 'ORD' in f]
+                siguiente = codificar_cursor({'k': int(ords[-1]), 'd': 'n'}) if hay_mas and ords else None
+                anterior = None
+            else:
+                despues_de = posicion.get('k')
+                filas = filas_vehiculos(**filtros, limit=per_page + 1, despues_de=despues_de)
+                hay_mas = len(filas) > per_page
+                filas = filas[:per_page]
+                ords = [f['ORD'] for f in filas if 'ORD' in f]
+                siguiente = codificar_cursor({'k': int(ords[-1]), 'd': 'n'}) if hay_mas and ords else None
+                anterior = codificar_cursor({'k': int(ords[0]), 'd': 'p'}) if ords else None
+
+            if total is None:
+                total = total_vehiculos(**filtros)
+            else:
+                guardar_total(total, **filtros)
+            respuesta = {'total': total, 'per_page': per_page, 'vehicles': filas, 'next': siguiente, 'prev': anterior}
+            if page is not None:
+                respuesta['page'] = page
+            return respuesta_json(respuesta)
         except Exception as e:
             print(f'Error en API /api/vehiculos: {e}')
             return jsonify({'error': 'error interno'}), 500
 
 
+    # API de opciones de filtro en cascada (división -> brigada -> unidad) con conteos.
+    # Se sirve desde el índice en memoria con ETag fuerte para que el navegador/CDN responda 304.
+    def respuesta_cacheable(payload):
+        cuerpo = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        resp = app.response_class(cuerpo, mimetype='application/json')
+        resp.set_etag(hashlib.sha1(cuerpo).hexdigest())
+        resp.headers['Cache-Control'] = f"public, max-age={app.config.get('FILTROS_CACHE_MAX_AGE', 60)}"
+        return resp.make_conditional(request)
+
+    def opciones_con_conteo(valores, contar):
+        return [{'valor': v, 'cantidad': contar(v)} for v in valores]
+
+    @app.route('/api/filtros/divisiones')
+    def api_filtros_divisiones():
+        try:
+            indice = obtener_indice_filtros()
+            return respuesta_cacheable({
+                'total': indice.conteo(),
+                'opciones': opciones_con_conteo(indice.divisiones(), indice.conteo)
+            })
+        except Exception as e:
+            print(f'Error en API /api/filtros/divisiones: {e}')
+            return jsonify({'error': 'error interno'}), 500
+
+    @app.route('/api/filtros/brigadas')
+    def api_filtros_brigadas():
+        division = request.args.get('division', '')
+        try:
+            indice = obtener_indice_filtros()
+            return respuesta_cacheable({
+                'division': division,
+                'total': indice.conteo(division),
+                'opciones': opciones_con_conteo(indice.brigadas(division), lambda b: indice.conteo(division, b))
+            })
+        except Exception as e:
+            print(f'Error en API /api/filtros/brigadas: {e}')
+            return jsonify({'error': 'error interno'}), 500
+
+    @app.route('/api/filtros/unidades')
+    def api_filtros_unidades():
+        division = request.args.get('division', '')
+        brigada = request.args.get('brigada', '')
+        try:
+            indice = obtener_indice_filtros()
+            return respuesta_cacheable({
+                'division': division,
+                'brigada': brigada,
+                'total': indice.conteo(division, brigada),
+                'opciones': opciones_con_conteo(
+                    indice.unidades(division, brigada), lambda u: indice.conteo(division, brigada, u)
+                )
+            })
+        except Exception as e:
+            print(f'Error en API /api/filtros/unidades: {e}')
+            return jsonify({'error': 'error interno'}), 500
+
+
+    # Resumen de la flota para tableros: /api/resumen?por=condicion&nivel=brigada&division=...
+    # Sale de la tabla resumen_flota (O(grupos)); mismo ETag/304 que las opciones de filtro.
+    @app.route('/api/resumen')
+    def api_resumen():
+        por = request.args.get('por', 'condicion')
+        nivel = request.args.get('nivel', 'division')
+        filtros = {n: request.args.get(n) or None for n in ('division', 'brigada', 'unidad')}
+        try:
+            grupos = consultar_resumen(por, nivel, **filtros)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            print(f'Error en API /api/resumen: {e}')
+            return jsonify({'error': 'error interno'}), 500
+        return respuesta_cacheable(dict(por=por, nivel=nivel, filtros={k: v for k, v in filtros.items() if v},
+                                        grupos=grupos))
+
+
+    # Historial de un vehículo (más reciente primero, paginado con ?cursor=<next>) y, con
+    # ?en=<fecha ISO 8601>, su estado en ese instante. Requiere la base de datos.
+    @app.route('/api/vehiculos/<int:ord_val>/historial')
+    def api_historial_vehiculo(ord_val):
+        if models_db is None:
+            return jsonify({'error': 'el historial requiere la base de datos'}), 503
+        try:
+            limit = min(max(int(request.args.get('limit', LIMITE_HISTORIAL)), 1), MAX_LIMITE_HISTORIAL)
+            antes = None
+            if request.args.get('cursor'):
+                posicion = decodificar_cursor(request.args['cursor'])
+                antes = (parsear_instante(posicion['t']), int(posicion['id']))
+            en = parsear_instante(request.args['en']) if request.args.get('en') else None
+        except (ValueError, KeyError, TypeError) as e:
+            return jsonify({'error': f'parámetro inválido: {e}'}), 400
+        try:
+            cambios = historial_vehiculo(ord_val, limit=limit + 1, antes=antes)
+            respuesta = {'ord': ord_val, 'cambios': cambios[:limit], 'next': None}
+            if len(cambios) > limit:
+                ultimo = cambios[limit - 1]
+                respuesta['next'] = codificar_cursor({'t': ultimo['changed_at'], 'id': ultimo['id']})
+            if en is not None:
+                respuesta['en'] = en.isoformat()
+                respuesta['vehiculo'] = vehiculo_en(ord_val, en)
+            return respuesta_json(respuesta)
+        except Exception as e:
+            print(f'Error en API /api/vehiculos/{ord_val}/historial: {e}')
+            return jsonify({'error': 'error interno'}), 500
+
+    # Flota tal como estaba en un instante: /api/historial?en=<fecha ISO 8601>&division=...
+    # Paginada por ORD con el mismo cursor que /api/vehiculos (?cursor=<next>, limit por página).
+    @app.route('/api/historial')
+    def api_historial_flota():
+        if models_db is None:
+            return jsonify({'error': 'el historial requiere la base de datos'}), 503
+        filtros = {n: request.args.get(n) or None for n in ('division', 'brigada', 'unidad')}
+        try:
+            en = parsear_instante(request.args['en'])
+            limit = min(max(int(request.args.get('limit', LIMITE_HISTORIAL)), 1), MAX_LIMITE_HISTORIAL)
+            despues_de = None
+            if request.args.get('cursor'):
+                posicion = decodificar_cursor(request.args['cursor'])
+                if posicion.get('d', 'n') != 'n':
+                    raise ValueError('cursor inválido')
+                despues_de = int(posicion['k'])
+        except (ValueError, KeyError, TypeError) as e:
+            return jsonify({'error': f'parámetro inválido: {e}'}), 400
+        try:
+            vehiculos = flota_en(en, **filtros, limit=limit + 1, despues_de=despues_de)
+        except Exception as e:
+            print(f'Error en API /api/historial: {e}')
+            return jsonify({'error': 'error interno'}), 500
+        siguiente = None
+        if len(vehiculos) > limit:
+            vehiculos = vehiculos[:limit]
+            siguiente = codificar_cursor({'k': int(vehiculos[-1]['ORD']), 'd': 'n'})
+        return respuesta_json({'en': en.isoformat(), 'per_page': limit, 'vehicles': vehiculos, 'next': siguiente})
+
+
+    # Feed de cambios para sincronización incremental: /api/cambios?since=<next de la respuesta
+    # anterior>. Sin since entrega toda la flota; 'eliminados' trae los ORD borrados por importaciones.
+    @app.route('/api/cambios')
+    def api_cambios():
+        if models_db is None:
+            return jsonify({'error': 'el feed de cambios requiere la base de datos'}), 503
+        try:
+            limit = int(request.args.get('limit', LIMITE_CAMBIOS))
+            respuesta = feed_cambios(request.args.get('since') or None, limit=limit)
+        except ValueError as e:
+            return jsonify({'error': f'parámetro inválido: {e}'}), 400
+        except TokenVencido:
+            return jsonify({'error': 'token vencido: vuelva a sincronizar sin since'}), 410
+        except Exception as e:
+            print(f'Error en API /api/cambios: {e}')
+            return jsonify({'error': 'error interno'}), 500
+        return respuesta_json(respuesta)
+
+
+    # Métricas internas para dimensionar cachés (por worker)
+    @app.route('/api/metricas')
+    def api_metricas():
+        # Expone detalles internos del worker (pid, cachés, pool): solo con sesión iniciada
+        if not session.get('logged_in'):
+            return jsonify({'error': 'requiere iniciar sesión'}), 401
+        metricas = {'pid': os.getpid(), 'cache': estadisticas_cache(),
+                    'exportaciones': estadisticas_exportaciones()}
+        if models_db is not None:
+            try:
+                metricas['pool'] = estadisticas_pool(models_db.engine)
+            except Exception as e:
+                metricas['pool'] = {'error': str(e)}
+        return jsonify(metricas)
+
+
     @app.route('/login', methods=['GET', 'POST'])
     def login():
         if request.method == 'POST':
@@ -151,26 +415,47 @@ def create_app():
     def download_excel():
         if not session.get('logged_in'):
             return redirect(url_for('login'))
-        # Usar query_vehiculos para obtener todos los registros desde la BD (rápido)
-        df = query_vehiculos()
-        # Asegurar orden por ORD al exportar
+        # Exportación en streaming con los mismos filtros que /api/vehiculos:
+        # ?format=xlsx (por defecto) | csv | ndjson | parquet
+        formato = (request.args.get('format') or 'xlsx').lower()
+        if formato not in FORMATOS:
+            return f"Formato no soportado: {formato}. Use uno de: {', '.join(FORMATOS)}", 400
+        if not formato_disponible(formato):
+            return f"El formato {formato} requiere pyarrow, que no está instalado en el servidor", 501
+        filtros = {
+            'division': request.args.get('division') or None,
+            'brigada': request.args.get('brigada') or None,
+            'unidad': request.args.get('unidad') or None,
+            'placa': request.args.get('placa') or None,
+            'q': request.args.get('q') or None,
+        }
+        try:
+            filtros['rangos'] = rangos_de_argumentos(request.args)
+        except ValueError as e:
+            return f"Parámetro inválido: {e}", 400
+        extension, mimetype = FORMATOS[formato]
+        # Caché en disco por (formato, filtros, versión de datos): si no cambió nada desde la
+        # última descarga es un envío de archivo, con 304 si el navegador ya tiene ese ETag
         try:
-            if 'ORD' in df.columns:
-                df['ORD_SORT'] = pd.to_numeric(df['ORD'], errors='coerce')
-                df = df.sort_values(by=['ORD_SORT']).drop(columns=['ORD_SORT'])
+            ruta, clave = obtener_exportacion(formato, **filtros)
+            resp = send_file(ruta, mimetype=mimetype, as_attachment=True,
+                             download_name=f'transportes_actualizado.{extension}', etag=clave, conditional=True)
+            resp.headers['Cache-Control'] = 'private, no-cache'
+            return resp
         except Exception as e:
-            print(f'Advertencia al ordenar antes de exportar: {e}')
-
-        # Escribir el Excel en memoria y enviarlo (evita I/O en disco)
+            print(f'Advertencia: caché de exportaciones no disponible ({e}); se genera directamente')
         try:
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False)
-            output.seek(0)
-            return send_file(output, as_attachment=True, download_name='transportes_actualizado.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+            cuerpo, tamano = exportar(formato, **filtros)
         except Exception as e:
-            print(f'Error al generar Excel en memoria: {e}')
+            print(f'Error al generar la exportación ({formato}): {e}')
             return "Error generando el archivo", 500
+        headers = {'Content-Disposition': f'attachment; filename=transportes_actualizado.{extension}'}
+        if tamano is None:
+            # CSV/NDJSON: el generador consulta la DB mientras se envía, necesita el contexto
+            cuerpo = stream_with_context(cuerpo)
+        else:
+            headers['Content-Length'] = str(tamano)
+        return app.response_class(cuerpo, mimetype=mimetype, headers=headers)
 
 
     @app.route('/logout')
@@ -185,56 +470,73 @@ def create_app():
         nueva_condicion = request.form.get('condicion')
         nuevo_estado = request.form.get('estado')
         nueva_observacion = request.form.get('observacion', '')
+        # Versión de la fila que vio el formulario (concurrencia optimista)
+        version = request.form.get('version')
 
         if not ord_id:
             return redirect(url_for('index'))
 
-        with excel_lock:
-            try:
-                # Intentar actualizar en la DB
-                try:
-                    veh = ModelVehiculo.query.filter_by(ord=int(ord_id)).first() if ModelVehiculo is not None else None
-                except Exception:
-                    veh = None
-                if veh:
-                    if nueva_condicion is not None:
-                        veh.condicion = nueva_condicion
-                    if nuevo_estado is not None:
-                        veh.estado = nuevo_estado
-                    veh.observacion = nueva_observacion or ''
-                    # Usar session del modelo si está disponible
-                    if models_db is not None:
-                        models_db.session.commit()
-                        # Invalidar caché para que próximas lecturas reflejen el cambio
-                        try:
-                            invalidate_db_cache()
-                        except Exception:
-                            pass
-                else:
-                    # Si no existe en la DB, actualizar el Excel (compatibilidad)
-                    df = cargar_datos()
-                    registro_especifico = df['ORD'] == int(ord_id)
-                    if registro_especifico.any():
-                        if nueva_condicion is not None:
-                            df.loc[registro_especifico, 'CONDICION'] = nueva_condicion
-                        if nuevo_estado is not None:
-                            df.loc[registro_especifico, 'ESTADO'] = nuevo_estado
-                        df.loc[registro_especifico, 'OBSERVACION'] = nueva_observacion or ''
-                        df.to_excel(EXCEL_FILE, index=False)
-                        # invalidar caché local por si la app usa Excel como fuente alternativa
-                        try:
-                            invalidate_db_cache()
-                        except Exception:
-                            pass
-            except Exception as e:
-                print(f"Error al guardar los cambios: {e}")
-                return "Error interno del servidor", 500
+        cambio = {'ord': ord_id, 'observacion': nueva_observacion or '', 'version': version}
+        if nueva_condicion is not None:
+            cambio['condicion'] = nueva_condicion
+        if nuevo_estado is not None:
+            cambio['estado'] = nuevo_estado
+        try:
+            # Actualiza en la DB o, si el ORD no está allí, en el Excel (compatibilidad)
+            resultado = aplicar_cambios([cambio], excel_file=EXCEL_FILE)[0]
+        except Exception as e:
+            print(f"Error al guardar los cambios: {e}")
+            return "Error interno del servidor", 500
+        if resultado['resultado'] == 'conflicto':
+            return "El vehículo fue modificado por otro usuario; recargue la página e intente de nuevo", 409
 
+        # Regenerar en segundo plano las exportaciones afectadas por el cambio
+        avisar_cambio_datos()
         return redirect(url_for('index'))
 
+
+    # Edición por lotes: JSON con una lista de {ord, condicion?, estado?, observacion?, version?}
+    # (o {"cambios": [...]}). Todo en una transacción y una sola invalidación de cachés.
+    # Con version (la VERSION leída de /api/vehiculos) el cambio se rechaza si la fila cambió.
+    @app.route('/api/vehiculos/batch', methods=['POST'])
+    def api_vehiculos_batch():
+        cuerpo = request.get_json(silent=True)
+        cambios = cuerpo.get('cambios') if isinstance(cuerpo, dict) else cuerpo
+        if not isinstance(cambios, list):
+            return jsonify({'error': 'se esperaba una lista de cambios'}), 400
+        maximo = app.config.get('API_MAX_BATCH', MAX_CAMBIOS_LOTE)
+        if len(cambios) > maximo:
+            return jsonify({'error': f'el lote admite como máximo {maximo} cambios'}), 400
+        try:
+            resultados = aplicar_cambios(cambios, excel_file=EXCEL_FILE)
+        except Exception as e:
+            print(f'Error en API /api/vehiculos/batch: {e}')
+            return jsonify({'error': 'error interno'}), 500
+        resumen = {r: sum(1 for x in resultados if x['resultado'] == r)
+                   for r in ('actualizado', 'conflicto', 'no_encontrado', 'invalido')}
+        if resumen['actualizado']:
+            avisar_cambio_datos()
+        return jsonify({
+            'actualizados': resumen['actualizado'],
+            'conflictos': resumen['conflicto'],
+            'no_encontrados': resumen['no_encontrado'],
+            'invalidos': resumen['invalido'],
+            'resultados': resultados,
+        })
+
     return app
 
-app = create_app()
+
+def __getattr__(name):
+    # Instancia global creada bajo demanda (gunicorn app:app): importar create_app desde los
+    # scripts de arranque no debe crear e inicializar una segunda aplicación.
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == '__main__':
+    app = create_app()
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
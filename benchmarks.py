@@ -0,0 +1,302 @@
+"""
+Mediciones de rendimiento contra la base configurada en DATABASE_URL (o transportes.db).
+
+    python benchmarks.py api_vehiculos --repeticiones 500
+    python benchmarks.py exportacion
+    DB_POOL_SIZE=2 python benchmarks.py pool --hilos 16
+
+api_vehiculos imprime p50/p99 en milisegundos; exportacion, el throughput de cada formato de
+/download; pool, la latencia con varios hilos concurrentes y las esperas por una conexión libre.
+No es parte del arranque de la app.
+"""
+from app import create_app
+import argparse
+import json
+import statistics
+import time
+
+
+def medir(func, repeticiones, calentamiento=5):
+    """Ejecuta func repetidas veces y devuelve (p50, p99) en milisegundos."""
+    for _ in range(calentamiento):
+        func()
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        func()
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    cuantiles = statistics.quantiles(tiempos, n=100)
+    return cuantiles[49], cuantiles[98]
+
+
+def imprimir(nombre, p50, p99):
+    print(f'  {nombre:<40} p50={p50:8.3f} ms   p99={p99:8.3f} ms')
+
+
+def bench_api_vehiculos(app, args):
+    """Página de /api/vehiculos: DataFrame + jsonify frente a tuplas + orjson."""
+    from flask import jsonify
+    from utils import query_vehiculos, filas_vehiculos
+    try:
+        import orjson
+    except Exception:
+        orjson = None
+
+    casos = {
+        'primera página': dict(limit=args.por_pagina + 1, con_total=True),
+        'página por cursor': dict(limit=args.por_pagina + 1, despues_de=args.por_pagina * 10),
+        'placa': dict(placa='PE', limit=args.por_pagina + 1, con_total=True),
+    }
+    with app.test_request_context():
+        for nombre, filtros in casos.items():
+            def con_pandas():
+                resultado = query_vehiculos(**filtros)
+                df = resultado[0] if isinstance(resultado, tuple) else resultado
+                return jsonify({'vehicles': df.to_dict(orient='records')}).get_data()
+
+            def sin_pandas():
+                resultado = filas_vehiculos(**filtros)
+                filas = resultado[0] if isinstance(resultado, tuple) else resultado
+                if orjson is not None:
+                    return orjson.dumps({'vehicles': filas})
+                return json.dumps({'vehicles': filas}).encode('utf-8')
+
+            print(f'{nombre}:')
+            imprimir('pandas (read_sql_query + jsonify)', *medir(con_pandas, args.repeticiones))
+            serializador = 'orjson' if orjson is not None else 'json'
+            imprimir(f'tuplas ({serializador})', *medir(sin_pandas, args.repeticiones))
+
+
+def bench_exportacion(app, args):
+    """Throughput de /download por formato (filas/s y MB/s), toda la flota y una división."""
+    from exportacion import FORMATOS, exportar, formato_disponible
+    from utils import count_vehiculos, query_vehiculos
+
+    primera = query_vehiculos(limit=1)
+    division = primera['DIVISION'].iloc[0] if not primera.empty else None
+    casos = {'toda la flota': {}, f'división {division}': {'division': division}}
+    for nombre, filtros in casos.items():
+        filas = count_vehiculos(**filtros)
+        print(f'{nombre} ({filas} filas):')
+        for formato in FORMATOS:
+            if not formato_disponible(formato):
+                print(f'  {formato:<8} (no disponible: falta pyarrow)')
+                continue
+            tiempos = []
+            for _ in range(args.repeticiones_export):
+                t0 = time.perf_counter()
+                cuerpo, _ = exportar(formato, **filtros)
+                tamano = sum(len(trozo) for trozo in cuerpo)
+                tiempos.append(time.perf_counter() - t0)
+            segundos = statistics.median(tiempos)
+            print(f'  {formato:<8} {segundos * 1000:9.1f} ms   {filas / segundos:12.0f} filas/s   '
+                  f'{tamano / segundos / 1e6:8.2f} MB/s   ({tamano / 1e6:.2f} MB)')
+
+
+def bench_pool(app, args):
+    """Páginas de /api/vehiculos desde varios hilos: latencia y esperas del pool de conexiones."""
+    import threading
+    from utils import filas_vehiculos
+    from models import db
+    from conexiones import estadisticas_pool
+
+    tiempos = []
+    guarda = threading.Lock()
+
+    def cliente():
+        with app.app_context():
+            propios = []
+            for _ in range(args.repeticiones // args.hilos or 1):
+                t0 = time.perf_counter()
+                filas_vehiculos(limit=args.por_pagina + 1, con_total=True)
+                propios.append((time.perf_counter() - t0) * 1000)
+            with guarda:
+                tiempos.extend(propios)
+
+    antes = estadisticas_pool(db.engine)
+    hilos = [threading.Thread(target=cliente) for _ in range(args.hilos)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    despues = estadisticas_pool(db.engine)
+    cuantiles = statistics.quantiles(tiempos, n=100)
+    imprimir(f'{args.hilos} hilos, pool {despues.get("tamano")}', cuantiles[49], cuantiles[98])
+    esperas = despues['esperas'] - antes['esperas']
+    espera_ms = despues['espera_total_ms'] - antes['espera_total_ms']
+    print(f'  esperas del pool: {esperas} de {despues["checkouts"] - antes["checkouts"]} obtenciones, '
+          f'{espera_ms:.1f} ms en total, máximo {despues["espera_max_ms"]:.1f} ms')
+
+
+def bench_resumen(app, args):
+    """/api/resumen desde resumen_flota frente a leer toda la tabla y agrupar con pandas."""
+    from resumen import consultar_resumen, _agregar_df, COLUMNAS_RESUMEN
+    from utils import query_vehiculos, COLUMNAS_DB
+
+    def con_pandas():
+        df = query_vehiculos().rename(columns={c: campo for c, campo in COLUMNAS_DB.items() if campo in COLUMNAS_RESUMEN})
+        return _agregar_df(df)
+
+    for nivel in ('division', 'unidad'):
+        print(f'condición por {nivel}:')
+        imprimir('resumen_flota (GROUP BY sobre grupos)', *medir(lambda: consultar_resumen('condicion', nivel),
+                                                                 args.repeticiones))
+        imprimir('tabla completa + pandas', *medir(con_pandas, max(args.repeticiones // 10, 5)))
+
+
+def bench_almacen(app, args):
+    """
+    Camino sin DB: máscaras sobre el DataFrame completo y reordenado por petición (como antes)
+    frente a AlmacenFlota. Usa los datos de cargar_datos(); memoria del DataFrame object frente
+    al almacén.
+    """
+    import pandas as pd
+    from almacen import AlmacenFlota
+    from utils import cargar_datos, filtrar_df
+
+    datos = cargar_datos().astype(object)
+    t0 = time.perf_counter()
+    almacen = AlmacenFlota(datos)
+    construccion = (time.perf_counter() - t0) * 1000
+    print(f'  {len(datos)} filas; construcción del almacén {construccion:.1f} ms')
+    print(f'  memoria: DataFrame object {datos.memory_usage(deep=True).sum() / 1e6:.1f} MB, '
+          f'almacén {almacen.memoria() / 1e6:.1f} MB')
+
+    def anterior(limit, offset=0, despues_de=None, **filtros):
+        df = filtrar_df(datos, **filtros)
+        total = len(df)
+        if despues_de is not None:
+            df = df[pd.to_numeric(df['ORD'], errors='coerce') > despues_de]
+        df = df.iloc[offset:offset + limit].copy()
+        df['ORD_SORT'] = pd.to_numeric(df['ORD'], errors='coerce')
+        return df.sort_values(by=['ORD_SORT']).drop(columns=['ORD_SORT']), total
+
+    primera = almacen.df.iloc[len(almacen) // 2]
+    division, brigada = primera['DIVISION'], primera['BRIGADA']
+    mitad = int(almacen.ords[len(almacen) // 2])
+    casos = {
+        'primera página': dict(),
+        'página por cursor': dict(despues_de=mitad),
+        'división': dict(division=division),
+        'división+brigada, offset': dict(division=division, brigada=brigada, offset=args.por_pagina * 3),
+        'placa': dict(placa='PE'),
+    }
+    for nombre, filtros in casos.items():
+        print(f'{nombre}:')
+        imprimir('máscaras + orden por petición', *medir(lambda: anterior(args.por_pagina, **filtros),
+                                                         max(args.repeticiones // 10, 5)))
+        imprimir('AlmacenFlota', *medir(lambda: almacen.pagina(limit=args.por_pagina, **filtros), args.repeticiones))
+
+
+def bench_historial(app, args):
+    """
+    Consultas del historial con --filas-historial cambios sintéticos agregados a vehiculo_cambios
+    (repartidos en los últimos cinco años; se borran al terminar): historial de un ORD y estado
+    de un vehículo y de una división en un instante.
+    """
+    import random
+    from datetime import datetime, timedelta
+    from sqlalchemy import text
+    from models import db
+    from historial import historial_vehiculo, vehiculo_en, flota_en, insertar_historial
+
+    with db.engine.connect() as conn:
+        ords = [r[0] for r in conn.execute(text('SELECT ord FROM vehiculos'))]
+        division = conn.execute(text("SELECT division FROM vehiculos WHERE division <> '' LIMIT 1")).scalar()
+        id_previo = conn.execute(text('SELECT COALESCE(MAX(id), 0) FROM vehiculo_cambios')).scalar()
+    if not ords:
+        print('  sin vehículos')
+        return
+    ahora = datetime.utcnow()
+    rnd = random.Random(0)
+    t0 = time.perf_counter()
+    with db.engine.begin() as conn:
+        for inicio in range(0, args.filas_historial, 100_000):
+            insertar_historial(conn, [
+                {'ord': rnd.choice(ords), 'changed_at': ahora - timedelta(days=1, seconds=rnd.randrange(5 * 365 * 86400)),
+                 'tipo': 'edicion', 'campo': 'observacion', 'valor_anterior': 'a', 'valor_nuevo': 'b', 'version': None}
+                for _ in range(min(100_000, args.filas_historial - inicio))
+            ])
+    print(f'  {args.filas_historial} cambios sintéticos insertados en {time.perf_counter() - t0:.1f} s')
+    try:
+        ord_val = rnd.choice(ords)
+        hace_una_hora = ahora - timedelta(hours=1)
+        hace_un_ano = ahora - timedelta(days=365)
+        imprimir('historial de un ORD (50)', *medir(lambda: historial_vehiculo(ord_val, limit=50), args.repeticiones))
+        imprimir('vehículo hace una hora', *medir(lambda: vehiculo_en(ord_val, hace_una_hora), args.repeticiones))
+        imprimir('vehículo hace un año', *medir(lambda: vehiculo_en(ord_val, hace_un_ano), args.repeticiones))
+        imprimir('división hace una hora (100)', *medir(lambda: flota_en(hace_una_hora, division=division),
+                                                        max(args.repeticiones // 10, 5)))
+        imprimir('flota hace un año (100)', *medir(lambda: flota_en(hace_un_ano), max(args.repeticiones // 10, 5)))
+    finally:
+        with db.engine.begin() as conn:
+            conn.execute(text('DELETE FROM vehiculo_cambios WHERE id > :id'), {'id': id_previo})
+
+
+def bench_cambios(app, args):
+    """
+    Sincronización de un cliente tras unas pocas ediciones (agrega un punto a la observación de
+    10 vehículos): /api/cambios?since=<token> frente a volver a pedir todas las páginas de
+    /api/vehiculos para detectar los cambios.
+    """
+    from cambios import feed_cambios
+    from edicion import aplicar_cambios
+    from utils import filas_vehiculos
+
+    token = None
+    while True:
+        respuesta = feed_cambios(token, limit=5000)
+        token = respuesta['next']
+        if not respuesta['hay_mas']:
+            break
+    filas = filas_vehiculos(limit=10)
+    aplicar_cambios([{'ord': f['ORD'], 'observacion': (f['OBSERVACION'] or '')[:500] + '.'} for f in filas])
+
+    def todas_las_paginas():
+        despues_de, total = None, 0
+        while True:
+            pagina = filas_vehiculos(limit=args.por_pagina, despues_de=despues_de)
+            total += len(pagina)
+            if len(pagina) < args.por_pagina:
+                return total
+            despues_de = pagina[-1]['ORD']
+
+    print(f'  {len(filas)} vehículos editados; páginas de {args.por_pagina}')
+    imprimir('feed desde el último token', *medir(lambda: feed_cambios(token), args.repeticiones))
+    imprimir('todas las páginas de /api/vehiculos', *medir(todas_las_paginas, max(args.repeticiones // 20, 5)))
+
+
+BENCHMARKS = {
+    'api_vehiculos': bench_api_vehiculos,
+    'exportacion': bench_exportacion,
+    'pool': bench_pool,
+    'resumen': bench_resumen,
+    'almacen': bench_almacen,
+    'historial': bench_historial,
+    'cambios': bench_cambios,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks de los caminos calientes de la app.')
+    parser.add_argument('nombre', nargs='*',
+                        help=f"Benchmarks a ejecutar: {', '.join(BENCHMARKS)} (por defecto: todos)")
+    parser.add_argument('--repeticiones', type=int, default=200)
+    parser.add_argument('--por-pagina', type=int, default=50)
+    parser.add_argument('--repeticiones-export', type=int, default=3)
+    parser.add_argument('--hilos', type=int, default=8)
+    parser.add_argument('--filas-historial', type=int, default=1_000_000)
+    args = parser.parse_args()
+    for nombre in args.nombre:
+        if nombre not in BENCHMARKS:
+            parser.error(f'benchmark desconocido: {nombre}')
+
+    app = create_app(cargar_filtros=False)
+    with app.app_context():
+        for nombre in args.nombre or list(BENCHMARKS):
+            print(f'== {nombre} ==')
+            BENCHMARKS[nombre](app, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""
+Caché en disco de las exportaciones de /download.
+
+Cada archivo se identifica por (formato, filtros, versión de datos): mientras la versión no
+cambie, una descarga repetida es un envío de archivo con ETag (304 si el navegador ya lo tiene)
+en lugar de regenerar el libro. El nombre empieza por la versión (v<version>_<clave>.<ext>), así
+los archivos de versiones anteriores se reconocen y se borran primero; después se expulsan los
+menos usados (por mtime, que se renueva en cada acierto) hasta quedar bajo EXPORT_CACHE_MAX_MB.
+
+RegeneradorExportaciones es un hilo por proceso que, cuando cambia la versión (aviso inmediato
+de editar_vehiculo o, para importaciones hechas desde otro proceso, al consultar la versión cada
+EXPORT_REGENERAR_INTERVALO segundos), vuelve a generar en segundo plano la exportación completa
+en xlsx y las últimas exportaciones pedidas. Tras cada aviso espera EXPORT_REGENERAR_RETRASO
+segundos para agrupar las ediciones seguidas. Cada archivo se genera bajo un bloqueo de archivo
+(fcntl) propio, compartido por los workers: el primero lo escribe y los demás lo encuentran
+hecho, sin esperar por exportaciones de otras claves.
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from utils import models_db, SNAPSHOT_DIR, EXCEL_FILE, huella_archivo, version_datos_vigente
+from exportacion import FORMATOS, escribir_archivo
+from journal import firma_journal
+
+# fcntl solo existe en POSIX; en otros sistemas la generación se coordina solo entre hilos
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', os.path.join(SNAPSHOT_DIR, 'exportaciones'))
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_MB', '256')) * 1024 * 1024
+# Los archivos usados en los últimos segundos no se expulsan (pueden estar enviándose)
+PROTECCION_RECIENTES = 60
+# Exportaciones pedidas recientemente que se regeneran tras un cambio (además de la completa en xlsx)
+MAX_SOLICITADAS = 4
+EXPORTACION_POR_DEFECTO = ('xlsx', ())
+
+_SOLICITADAS = OrderedDict()
+_SOLICITADAS_GUARDA = threading.Lock()
+_CANDADOS = {}
+_CANDADOS_GUARDA = threading.Lock()
+_STATS = {'hits': 0, 'misses': 0, 'regeneradas': 0, 'expulsadas': 0}
+
+
+def version_exportacion():
+    """Versión de datos para las claves: datos_version con DB; huella del Excel y de su journal sin ella."""
+    if models_db is not None:
+        try:
+            return str(version_datos_vigente())
+        except Exception as e:
+            print(f'Advertencia: no se pudo leer la versión de datos para la caché de exportaciones: {e}')
+    try:
+        huella = huella_archivo(EXCEL_FILE, con_hash=False)
+        journal = firma_journal(EXCEL_FILE)
+        sufijo = f"-j{journal[0]}-{journal[1]}" if journal else ''
+        return f"x{huella['tamano']}-{int(huella['mtime'])}{sufijo}"
+    except OSError:
+        return 'x0'
+
+
+def _filtros_normalizados(filtros):
+    return tuple(sorted((k, v) for k, v in filtros.items() if v))
+
+
+def clave_exportacion(formato, filtros, version):
+    """Clave estable (también usada como ETag) de una exportación."""
+    crudo = json.dumps([formato, _filtros_normalizados(filtros), version], ensure_ascii=False)
+    return hashlib.sha1(crudo.encode('utf-8')).hexdigest()[:24]
+
+
+def ruta_exportacion(formato, clave, version):
+    return os.path.join(EXPORT_CACHE_DIR, f'v{version}_{clave}.{FORMATOS[formato][0]}')
+
+
+def _candado(clave):
+    with _CANDADOS_GUARDA:
+        return _CANDADOS.setdefault(clave, threading.Lock())
+
+
+def _soltar_candado(clave):
+    with _CANDADOS_GUARDA:
+        _CANDADOS.pop(clave, None)
+
+
+@contextmanager
+def bloqueo_generacion(ruta):
+    """
+    Bloqueo exclusivo entre procesos (archivo <ruta>.lock con fcntl.flock) para generar un
+    archivo de la caché. Es por clave: solo esperan entre sí las descargas de la misma
+    exportación. El archivo de bloqueo se borra al terminar, antes de soltarlo.
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    ruta_candado = f'{ruta}.lock'
+    with open(ruta_candado, 'a') as candado:
+        fcntl.flock(candado.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            try:
+                os.remove(ruta_candado)
+            except OSError:
+                pass
+            fcntl.flock(candado.fileno(), fcntl.LOCK_UN)
+
+
+def _archivos_cache():
+    """Exportaciones de la caché, sin temporales ni archivos de bloqueo."""
+    return [ruta for ruta in glob.glob(os.path.join(EXPORT_CACHE_DIR, 'v*_*.*'))
+            if not ruta.endswith(('.tmp', '.lock'))]
+
+
+def _recordar_solicitud(formato, filtros):
+    clave = (formato, _filtros_normalizados(filtros))
+    with _SOLICITADAS_GUARDA:
+        _SOLICITADAS[clave] = None
+        _SOLICITADAS.move_to_end(clave)
+        while len(_SOLICITADAS) > MAX_SOLICITADAS:
+            _SOLICITADAS.popitem(last=False)
+
+
+def exportaciones_solicitadas():
+    """Copia de las últimas exportaciones pedidas (formato, filtros), de la más antigua a la más reciente."""
+    with _SOLICITADAS_GUARDA:
+        return list(_SOLICITADAS)
+
+
+def obtener_exportacion(formato, recordar=True, **filtros):
+    """
+    Devuelve (ruta, clave) de la exportación vigente, generándola si no está en la caché.
+    El archivo se escribe con otro nombre y se renombra al final (os.replace), así otro hilo
+    o proceso nunca ve un archivo a medias. recordar=False no la anota entre las solicitadas
+    (lo usa el regenerador).
+    """
+    if recordar:
+        _recordar_solicitud(formato, filtros)
+    version = version_exportacion()
+    clave = clave_exportacion(formato, filtros, version)
+    ruta = ruta_exportacion(formato, clave, version)
+    if os.path.exists(ruta):
+        _STATS['hits'] += 1
+        os.utime(ruta)
+        return ruta, clave
+    try:
+        # Entre hilos, un candado por clave; entre procesos, su archivo de bloqueo. Después de
+        # tomarlos se vuelve a mirar: quien esperaba encuentra el archivo ya escrito.
+        with _candado(clave), bloqueo_generacion(ruta):
+            if os.path.exists(ruta):
+                _STATS['hits'] += 1
+                return ruta, clave
+            _STATS['misses'] += 1
+            os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+            temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                escribir_archivo(formato, temporal, **filtros)
+                os.replace(temporal, ruta)
+            finally:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+    finally:
+        # El candado solo hace falta mientras el archivo no existe
+        _soltar_candado(clave)
+    expulsar(version)
+    return ruta, clave
+
+
+def expulsar(version_vigente, max_bytes=None):
+    """Borra las exportaciones de versiones anteriores y luego las menos usadas hasta max_bytes."""
+    max_bytes = EXPORT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    ahora = time.time()
+    archivos = []
+    for ruta in _archivos_cache():
+        try:
+            st = os.stat(ruta)
+        except OSError:
+            continue
+        vigente = os.path.basename(ruta).startswith(f'v{version_vigente}_')
+        archivos.append((vigente, st.st_mtime, st.st_size, ruta))
+    total = sum(a[2] for a in archivos)
+    # Primero las de otras versiones, luego de la más antigua a la más reciente
+    for vigente, mtime, tamano, ruta in sorted(archivos):
+        if vigente and total <= max_bytes:
+            break
+        if ahora - mtime < PROTECCION_RECIENTES:
+            continue
+        try:
+            os.remove(ruta)
+            total -= tamano
+            _STATS['expulsadas'] += 1
+        except OSError:
+            pass
+
+
+def estadisticas_exportaciones():
+    archivos = _archivos_cache()
+    return dict(_STATS, archivos=len(archivos),
+                bytes=sum(os.path.getsize(a) for a in archivos if os.path.exists(a)))
+
+
+class RegeneradorExportaciones(threading.Thread):
+    """Hilo que regenera en segundo plano las exportaciones cuando cambia la versión de datos."""
+
+    def __init__(self, app, intervalo, retraso=5):
+        super().__init__(name='regenerador-exportaciones', daemon=True)
+        self.app = app
+        self.intervalo = intervalo
+        self.retraso = retraso
+        self._aviso = threading.Event()
+        self._version = None
+
+    def avisar(self):
+        self._aviso.set()
+
+    def run(self):
+        while True:
+            if self._aviso.wait(self.intervalo):
+                # Agrupa los avisos seguidos (un lote de ediciones, el arranque de varios workers)
+                time.sleep(self.retraso)
+            self._aviso.clear()
+            try:
+                with self.app.app_context():
+                    self.regenerar()
+            except Exception as e:
+                print(f'Advertencia: falló la regeneración de exportaciones: {e}')
+
+    def regenerar(self):
+        version = version_exportacion()
+        if version == self._version:
+            return
+        pendientes = [EXPORTACION_POR_DEFECTO] + [s for s in exportaciones_solicitadas()
+                                                  if s != EXPORTACION_POR_DEFECTO]
+        for formato, filtros in pendientes:
+            generadas = _STATS['misses']
+            obtener_exportacion(formato, recordar=False, **dict(filtros))
+            _STATS['regeneradas'] += _STATS['misses'] - generadas
+        self._version = version
+
+
+_REGENERADOR = {'hilo': None}
+
+
+def iniciar_regenerador(app):
+    """Arranca el hilo de regeneración de este proceso (una sola vez)."""
+    if _REGENERADOR['hilo'] is None:
+        hilo = RegeneradorExportaciones(app, app.config.get('EXPORT_REGENERAR_INTERVALO', 30),
+                                        app.config.get('EXPORT_REGENERAR_RETRASO', 5))
+        hilo.start()
+        _REGENERADOR['hilo'] = hilo
+        hilo.avisar()
+    return _REGENERADOR['hilo']
+
+
+def avisar_cambio_datos():
+    """Pide al hilo de regeneración (si está activo) que revise la versión ya, sin esperar al intervalo."""
+    if _REGENERADOR['hilo'] is not None:
+        _REGENERADOR['hilo'].avisar()
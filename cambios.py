@@ -0,0 +1,140 @@
+"""
+Feed de cambios para la sincronización incremental de clientes (/api/cambios?since=<token>).
+
+Cada transacción que escribe en vehiculos (edición o importación) incrementa la versión de datos
+(datos_version) dentro de la misma transacción y la guarda en cambio_seq de las filas que
+escribe. La fila de datos_version queda bloqueada hasta el commit, así que las escrituras toman
+números en el orden en que se confirman: si una versión es visible, también lo son todas las
+anteriores, y la versión confirmada es la marca hasta la que el feed puede leer sin saltarse
+nada. Las ediciones la toman al final, con sus filas ya bloqueadas, para no esperarse entre sí
+más que ese último tramo; las importaciones, al principio, tras bloquear la tabla (importacion.py).
+Por eso el feed se basa en cambio_seq y no en updated_at (relojes de distintos workers, varias
+filas con el mismo instante).
+
+Los vehículos que una importación elimina dejan una marca en vehiculo_bajas con el cambio_seq
+de la baja. El token es la posición (cambio_seq, ord) del último cambio entregado; el cliente
+aplica 'vehicles' (altas y modificaciones) y 'eliminados' (bajas) y vuelve a pedir con 'next'.
+Sin token se entrega la flota completa, que es la sincronización inicial.
+"""
+from utils import models_db, codificar_cursor, decodificar_cursor, sentencia, SQL_SELECT_API, CLAVES_API
+
+try:
+    from sqlalchemy import text, bindparam
+except Exception:
+    text = None
+    bindparam = None
+
+LIMITE_CAMBIOS = 500
+MAX_LIMITE_CAMBIOS = 5000
+TAMANO_LOTE = 1000
+# ORD anterior a cualquier otro: posición "antes de todas las filas de un cambio_seq"
+_ORD_MINIMO = -(2 ** 31)
+
+SQL_FEED_VEHICULOS = (
+    SQL_SELECT_API + ", cambio_seq, updated_at FROM vehiculos "
+    "WHERE cambio_seq >= :seq AND (cambio_seq > :seq OR ord > :ord) AND cambio_seq <= :hasta "
+    "ORDER BY cambio_seq, ord LIMIT :limit"
+)
+SQL_FEED_BAJAS = (
+    "SELECT ord, cambio_seq, eliminado_en FROM vehiculo_bajas "
+    "WHERE cambio_seq >= :seq AND (cambio_seq > :seq OR ord > :ord) AND cambio_seq <= :hasta "
+    "ORDER BY cambio_seq, ord LIMIT :limit"
+)
+
+
+class TokenVencido(Exception):
+    """El token es posterior a la versión actual de los datos (p. ej. la base se recreó)."""
+
+
+def codificar_token(seq, ord_val=None):
+    """Token opaco de la posición: después de (seq, ord_val), o de todo seq si ord_val es None."""
+    posicion = {'s': int(seq)}
+    if ord_val is not None:
+        posicion['o'] = int(ord_val)
+    return codificar_cursor(posicion)
+
+
+def decodificar_token(token):
+    """(seq, ord) de un token de codificar_token. ValueError si no es válido."""
+    posicion = decodificar_cursor(token)
+    try:
+        seq = int(posicion['s'])
+        ord_val = int(posicion['o']) if posicion.get('o') is not None else None
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('token inválido')
+    return seq, ord_val
+
+
+def registrar_bajas(conn, ords, seq, ahora):
+    """Marca como eliminados los ORD indicados con el cambio_seq de la importación que los borra."""
+    filas = [{'ord': int(o), 'cambio_seq': seq, 'eliminado_en': ahora} for o in ords]
+    if not filas:
+        return 0
+    if conn.dialect.name in ('postgresql', 'sqlite'):
+        sql = ("INSERT INTO vehiculo_bajas (ord, cambio_seq, eliminado_en) VALUES (:ord, :cambio_seq, :eliminado_en) "
+               "ON CONFLICT (ord) DO UPDATE SET cambio_seq = excluded.cambio_seq, eliminado_en = excluded.eliminado_en")
+        for inicio in range(0, len(filas), TAMANO_LOTE):
+            conn.execute(sentencia(sql), filas[inicio:inicio + TAMANO_LOTE])
+    else:
+        quitar_bajas(conn, [f['ord'] for f in filas])
+        for inicio in range(0, len(filas), TAMANO_LOTE):
+            conn.execute(sentencia(
+                'INSERT INTO vehiculo_bajas (ord, cambio_seq, eliminado_en) VALUES (:ord, :cambio_seq, :eliminado_en)'
+            ), filas[inicio:inicio + TAMANO_LOTE])
+    return len(filas)
+
+
+def quitar_bajas(conn, ords=None):
+    """Borra las marcas de baja de los ORD indicados o, sin ords, de todos los que vuelven a existir."""
+    if ords is None:
+        conn.execute(sentencia('DELETE FROM vehiculo_bajas WHERE ord IN (SELECT ord FROM vehiculos)'))
+        return
+    consulta = text('DELETE FROM vehiculo_bajas WHERE ord IN :ords').bindparams(bindparam('ords', expanding=True))
+    ords = [int(o) for o in ords]
+    for inicio in range(0, len(ords), TAMANO_LOTE):
+        conn.execute(consulta, {'ords': ords[inicio:inicio + TAMANO_LOTE]})
+
+
+def _fecha(valor):
+    return valor.isoformat() if hasattr(valor, 'isoformat') else (valor or '')
+
+
+def feed_cambios(since=None, limit=LIMITE_CAMBIOS):
+    """
+    Cambios posteriores al token since (None: toda la flota), hasta limit entre modificaciones y
+    bajas, en orden de (cambio_seq, ord). Devuelve {'vehicles', 'eliminados', 'next', 'hay_mas'}.
+    Lanza ValueError si el token no es válido y TokenVencido si es de una versión que no existe.
+    """
+    seq, ord_val = decodificar_token(since) if since else (0, None)
+    seq_token = seq
+    if ord_val is None:
+        # Después de todo seq (con token) o desde el principio, incluido seq 0 (sin token)
+        seq, ord_val = (seq + 1 if since else seq), _ORD_MINIMO
+    limit = min(max(int(limit), 1), MAX_LIMITE_CAMBIOS)
+
+    with models_db.engine.connect() as conn:
+        # Versión confirmada al empezar: todo lo que tiene cambio_seq <= hasta ya es visible
+        hasta = int(conn.execute(sentencia('SELECT version FROM datos_version WHERE id = 1')).scalar() or 0)
+        if seq_token > hasta:
+            raise TokenVencido()
+        params = {'seq': seq, 'ord': ord_val, 'hasta': hasta, 'limit': limit + 1}
+        filas = conn.execute(sentencia(SQL_FEED_VEHICULOS), params).all()
+        bajas = conn.execute(sentencia(SQL_FEED_BAJAS), params).all()
+
+    # Mezcla de ambas listas por (cambio_seq, ord); el ORD de una fila viva no tiene marca de baja
+    claves = CLAVES_API + ('SEQ', 'UPDATED_AT')
+    eventos = sorted([(f[-2], f[0], 'v', f) for f in filas] + [(b[1], b[0], 'b', b) for b in bajas],
+                     key=lambda e: (e[0], e[1]))
+    hay_mas = len(eventos) > limit
+    eventos = eventos[:limit]
+
+    vehiculos, eliminados = [], []
+    for _, _, tipo, fila in eventos:
+        if tipo == 'v':
+            registro = {k: ('' if v is None else v) for k, v in zip(claves, fila)}
+            registro['UPDATED_AT'] = _fecha(fila[-1])
+            vehiculos.append(registro)
+        else:
+            eliminados.append({'ORD': fila[0], 'SEQ': fila[1], 'ELIMINADO_EN': _fecha(fila[2])})
+    siguiente = codificar_token(eventos[-1][0], eventos[-1][1]) if hay_mas else codificar_token(hasta)
+    return {'vehicles': vehiculos, 'eliminados': eliminados, 'next': siguiente, 'hay_mas': hay_mas}
@@ -0,0 +1,88 @@
+"""
+Opciones del engine de SQLAlchemy y métricas del pool de conexiones.
+
+Cada worker de gunicorn tiene su propio engine y su propio pool: con N workers la base recibe
+hasta N * (DB_POOL_SIZE + DB_MAX_OVERFLOW) conexiones. Las opciones se leen del entorno:
+
+    DB_POOL_SIZE            conexiones persistentes por worker (5)
+    DB_MAX_OVERFLOW         conexiones extra temporales por worker (10)
+    DB_POOL_TIMEOUT         segundos de espera por una conexión libre antes de fallar (30)
+    DB_POOL_RECYCLE         segundos tras los que se reabre una conexión (1800; -1 nunca)
+    DB_POOL_PRE_PING        1/0: comprobar la conexión antes de entregarla (1)
+    DB_STATEMENT_TIMEOUT_MS statement_timeout de PostgreSQL en milisegundos (0 = sin límite)
+
+PoolMedido es el QueuePool de SQLAlchemy contando cuántas veces y cuánto tiempo se esperó
+para obtener una conexión, lo que muestra la saturación del pool en /api/metricas.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy.pool import QueuePool
+
+_STATS = {'checkouts': 0, 'esperas': 0, 'espera_total_ms': 0.0, 'espera_max_ms': 0.0, 'agotados': 0}
+_STATS_GUARDA = threading.Lock()
+# Una obtención que tarda más que esto cuenta como espera (pool lleno o conexión nueva)
+UMBRAL_ESPERA_MS = 1.0
+
+
+def _entero(nombre, por_defecto):
+    try:
+        return int(os.environ.get(nombre, por_defecto))
+    except ValueError:
+        print(f'Advertencia: {nombre} no es un entero; se usa {por_defecto}')
+        return por_defecto
+
+
+class PoolMedido(QueuePool):
+    """QueuePool que mide el tiempo de obtención de cada conexión."""
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            conexion = super()._do_get()
+        except Exception:
+            with _STATS_GUARDA:
+                _STATS['agotados'] += 1
+            raise
+        ms = (time.perf_counter() - t0) * 1000
+        with _STATS_GUARDA:
+            _STATS['checkouts'] += 1
+            if ms >= UMBRAL_ESPERA_MS:
+                _STATS['esperas'] += 1
+                _STATS['espera_total_ms'] += ms
+                _STATS['espera_max_ms'] = max(_STATS['espera_max_ms'], ms)
+        return conexion
+
+
+def opciones_engine(database_url):
+    """SQLALCHEMY_ENGINE_OPTIONS para la URL dada, según las variables de entorno."""
+    opciones = {
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') != '0',
+        'pool_recycle': _entero('DB_POOL_RECYCLE', 1800),
+    }
+    # SQLite en memoria usa su propio pool de una conexión por hilo: no admite tamaño
+    if database_url.startswith('sqlite') and (':memory:' in database_url or database_url.rstrip('/') == 'sqlite:'):
+        return opciones
+    opciones.update({
+        'poolclass': PoolMedido,
+        'pool_size': _entero('DB_POOL_SIZE', 5),
+        'max_overflow': _entero('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _entero('DB_POOL_TIMEOUT', 30),
+    })
+    timeout = _entero('DB_STATEMENT_TIMEOUT_MS', 0)
+    if timeout > 0 and database_url.startswith('postgres'):
+        opciones['connect_args'] = {'options': f'-c statement_timeout={timeout}'}
+    return opciones
+
+
+def estadisticas_pool(engine):
+    """Estado del pool de este worker (tamaño, en uso, desborde) y esperas acumuladas."""
+    with _STATS_GUARDA:
+        datos = dict(_STATS)
+    datos['espera_media_ms'] = datos['espera_total_ms'] / datos['esperas'] if datos['esperas'] else 0.0
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        datos.update(tamano=pool.size(), en_uso=pool.checkedout(), libres=pool.checkedin(),
+                     desborde=pool.overflow(), timeout=pool.timeout())
+    return datos
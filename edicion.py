@@ -0,0 +1,425 @@
+"""
+Edición de condición, estado y observación de vehículos, de uno en uno o por lotes.
+
+aplicar_cambios() valida la lista de cambios, actualiza en una sola transacción todos los ORD
+que están en la base de datos (UPDATE ... FROM (VALUES ...) en PostgreSQL, executemany en los
+demás motores), registra los restantes para el Excel (compatibilidad con el modo sin DB), e
+invalida las cachés una vez por lote. Devuelve un resultado por cambio.
+
+Concurrencia: cada fila tiene una columna version. Un cambio que trae la versión que leyó el
+cliente solo se aplica si sigue siendo la actual (si no, resultado 'conflicto'); las filas se
+leen con SELECT ... FOR UPDATE en PostgreSQL, y en SQLite la transacción de escritura ya es
+exclusiva. Así las ediciones de ORD distintos se validan en paralelo en todos los workers y
+nunca se pisa una edición ajena. Justo antes de los UPDATE (con las filas ya bloqueadas) el lote
+toma la siguiente versión de datos (cambio_seq, ver cambios.py): solo ese último tramo hasta el
+commit se hace de a un lote, lo que da al feed de cambios el mismo orden que los commits. El Excel no tiene versiones: su
+lectura-modificación-escritura se hace bajo un bloqueo de archivo (fcntl) compartido por todos
+los procesos.
+
+En la misma transacción de la DB se actualiza el resumen materializado (resumen.py) con la
+diferencia entre las filas antes y después del lote, y se agrega al historial (historial.py) una
+fila por cada campo que cambió.
+
+Las ediciones del Excel no reescriben el libro: se anexan al journal (journal.py), que
+cargar_datos() aplica al leer, y CompactadorJournal las vuelca al .xlsx en segundo plano.
+"""
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from utils import (models_db, invalidate_db_cache, incrementar_version_datos, guardar_snapshot_excel, huella_archivo, leer_excel_con_snapshot,
+                   normalizar_columna, EXCEL_FILE)
+from journal import registrar_cambios, leer_journal, aplicar_overlay, descartar_journal, firma_journal
+from resumen import actualizar_resumen, COLUMNAS_RESUMEN
+from historial import registrar_ediciones
+
+try:
+    from sqlalchemy import text, bindparam
+except Exception:
+    text = None
+    bindparam = None
+
+# fcntl solo existe en POSIX; en otros sistemas el bloqueo del Excel es solo entre hilos
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Campo de la tabla vehiculos -> columna del Excel
+CAMPOS_EDITABLES = {'condicion': 'CONDICION', 'estado': 'ESTADO', 'observacion': 'OBSERVACION'}
+MAX_CAMBIOS_LOTE = 1000
+# Filas por sentencia UPDATE ... FROM (VALUES ...) y por consulta IN (...)
+TAMANO_LOTE_SQL = 500
+HOJA_EXCEL = 'DETALLE'
+
+_CANDADO_EXCEL_LOCAL = threading.Lock()
+
+
+@contextmanager
+def bloqueo_excel(excel_file=EXCEL_FILE):
+    """Bloqueo exclusivo entre procesos (archivo <excel>.lock con fcntl.flock) para editar el Excel."""
+    with _CANDADO_EXCEL_LOCAL:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.abspath(excel_file) + '.lock', 'a') as candado:
+            fcntl.flock(candado.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(candado.fileno(), fcntl.LOCK_UN)
+
+
+def _longitudes():
+    try:
+        from models import Vehiculo
+        return {c: Vehiculo.__table__.c[c].type.length for c in CAMPOS_EDITABLES}
+    except Exception:
+        return {}
+
+
+def validar_cambios(cambios):
+    """
+    Normaliza los cambios ({ord, condicion?, estado?, observacion?, version?}). Devuelve
+    (validos, resultados): validos son (indice, ord, {campo: valor}, version esperada o None)
+    y resultados tiene ya el error de los inválidos.
+    """
+    longitudes = _longitudes()
+    validos = []
+    resultados = [None] * len(cambios)
+    vistos = set()
+    for i, cambio in enumerate(cambios):
+        if not isinstance(cambio, dict):
+            resultados[i] = {'indice': i, 'ord': None, 'resultado': 'invalido', 'error': 'el cambio debe ser un objeto'}
+            continue
+        try:
+            ord_val = int(cambio.get('ord'))
+        except (TypeError, ValueError):
+            resultados[i] = {'indice': i, 'ord': cambio.get('ord'), 'resultado': 'invalido', 'error': 'ORD vacío o no numérico'}
+            continue
+        campos = {c: ('' if cambio[c] is None else str(cambio[c])) for c in CAMPOS_EDITABLES if c in cambio}
+        error = None
+        try:
+            version = None if cambio.get('version') in (None, '') else int(cambio['version'])
+        except (TypeError, ValueError):
+            version, error = None, 'version no numérica'
+        if error is None:
+            if not campos:
+                error = 'sin campos para actualizar (condicion, estado, observacion)'
+            elif ord_val in vistos:
+                error = 'ORD repetido en el lote'
+            else:
+                for campo, valor in campos.items():
+                    if longitudes.get(campo) and len(valor) > longitudes[campo]:
+                        error = f'{campo} excede {longitudes[campo]} caracteres'
+                        break
+        if error:
+            resultados[i] = {'indice': i, 'ord': ord_val, 'resultado': 'invalido', 'error': error}
+            continue
+        vistos.add(ord_val)
+        validos.append((i, ord_val, campos, version))
+    return validos, resultados
+
+
+def _filas_actuales(conn, ords):
+    """
+    ORD -> fila actual (version, COLUMNAS_RESUMEN y campos editables) de las filas indicadas,
+    bloqueándolas hasta el fin de la transacción. Con ellas se actualiza el resumen con la
+    diferencia y se registran los valores anteriores en el historial.
+    """
+    columnas = list(dict.fromkeys(COLUMNAS_RESUMEN + tuple(CAMPOS_EDITABLES)))
+    sql = f"SELECT ord, version, {', '.join(columnas)} FROM vehiculos WHERE ord IN :ords"
+    if conn.dialect.name == 'postgresql':
+        # Siempre en el mismo orden, para que dos lotes con ORD en común no se interbloqueen
+        sql += ' ORDER BY ord FOR UPDATE'
+    consulta = text(sql).bindparams(bindparam('ords', expanding=True))
+    filas = {}
+    for inicio in range(0, len(ords), TAMANO_LOTE_SQL):
+        for fila in conn.execute(consulta, {'ords': ords[inicio:inicio + TAMANO_LOTE_SQL]}).mappings():
+            filas[fila['ord']] = dict(fila)
+    return filas
+
+
+def _actualizar_db(conn, grupo, campos, ahora, versiones, seq):
+    """
+    Actualiza un grupo de cambios que tocan los mismos campos, incrementa su versión y les asigna
+    el cambio_seq del lote. Cada UPDATE exige además la versión leída en esta transacción;
+    devuelve las filas modificadas.
+    """
+    modificadas = 0
+    if conn.dialect.name == 'postgresql':
+        for inicio in range(0, len(grupo), TAMANO_LOTE_SQL):
+            parte = grupo[inicio:inicio + TAMANO_LOTE_SQL]
+            params = {'ahora': ahora, 'seq': seq}
+            filas = []
+            for j, (_, ord_val, valores, _) in enumerate(parte):
+                params[f'o{j}'] = ord_val
+                params[f'vl{j}'] = versiones[ord_val]
+                nombres = [f':o{j}', f':vl{j}']
+                for campo in campos:
+                    params[f'{campo}{j}'] = valores[campo]
+                    nombres.append(f':{campo}{j}')
+                filas.append(f"({', '.join(nombres)})")
+            asignaciones = ', '.join(f'{c} = c.{c}' for c in campos)
+            modificadas += conn.execute(text(
+                f"UPDATE vehiculos AS v SET {asignaciones}, version = v.version + 1, updated_at = :ahora, "
+                f"cambio_seq = :seq "
+                f"FROM (VALUES {', '.join(filas)}) AS c(ord, version_leida, {', '.join(campos)}) "
+                f"WHERE v.ord = c.ord AND v.version = c.version_leida"
+            ), params).rowcount
+    else:
+        asignaciones = ', '.join(f'{c} = :{c}' for c in campos)
+        modificadas += conn.execute(
+            text(f'UPDATE vehiculos SET {asignaciones}, version = version + 1, updated_at = :ahora, '
+                 f'cambio_seq = :seq WHERE ord = :ord AND version = :version_leida'),
+            [dict(valores, ord=ord_val, version_leida=versiones[ord_val], ahora=ahora, seq=seq)
+             for _, ord_val, valores, _ in grupo]
+        ).rowcount
+    return modificadas
+
+
+class EscrituraConcurrente(Exception):
+    """Otra transacción modificó una fila entre la lectura de versiones y el UPDATE."""
+
+
+class ConsultaDBFallida(Exception):
+    """No se pudo consultar qué ORD están en la DB (p. ej. la tabla vehiculos no existe todavía).
+    Es el único error de la DB con el que los cambios se registran en el Excel: no se escribió nada."""
+
+
+def aplicar_cambios_db(validos, intentos=3):
+    """
+    Aplica en una transacción los cambios cuyo ORD existe en la DB y cuya versión esperada (si
+    se indicó) coincide con la actual. Devuelve (actualizados, conflictos): ORD -> nueva versión
+    y ORD -> versión actual. Si otra escritura se cuela entre la lectura y el UPDATE (posible en
+    SQLite, donde la lectura no bloquea), se deshace el lote y se reintenta con las versiones nuevas.
+    Devuelve también la versión de datos tomada por el lote (None si no actualizó nada).
+    Si falla la consulta de los ORD lanza ConsultaDBFallida; cualquier otro error (bloqueos,
+    statement_timeout, fallo del commit) se propaga tal cual.
+    """
+    ords = [c[1] for c in validos]
+    for intento in range(intentos):
+        ahora = datetime.utcnow()
+        actualizados = {}
+        conflictos = {}
+        try:
+            with models_db.engine.begin() as conn:
+                try:
+                    filas = _filas_actuales(conn, ords)
+                except Exception as e:
+                    raise ConsultaDBFallida(str(e)) from e
+                versiones = {ord_val: fila['version'] for ord_val, fila in filas.items()}
+                grupos = {}
+                for cambio in validos:
+                    _, ord_val, valores, esperada = cambio
+                    if ord_val not in versiones:
+                        continue
+                    if esperada is not None and esperada != versiones[ord_val]:
+                        conflictos[ord_val] = versiones[ord_val]
+                        continue
+                    actualizados[ord_val] = versiones[ord_val] + 1
+                    grupos.setdefault(tuple(sorted(valores)), []).append(cambio)
+                # Resumen materializado e historial: diferencia entre las filas antes y después del lote
+                editados = [c for c in validos if c[1] in actualizados]
+                antes = [filas[c[1]] for c in editados]
+                despues = [dict(filas[c[1]], **c[2]) for c in editados]
+                actualizar_resumen(conn, antes, despues)
+                registrar_ediciones(conn, antes, despues, actualizados, ahora)
+                # Al final, la secuencia del feed de cambios (la versión de datos): su fila queda
+                # bloqueada solo desde aquí hasta el commit, y lo único que falta es escribir las
+                # filas ya bloqueadas, así que los lotes de ORD distintos no se esperan entre sí
+                seq = incrementar_version_datos(conn) if grupos else None
+                for campos, grupo in grupos.items():
+                    if _actualizar_db(conn, grupo, list(campos), ahora, versiones, seq) != len(grupo):
+                        raise EscrituraConcurrente()
+            return actualizados, conflictos, seq
+        except EscrituraConcurrente:
+            if intento == intentos - 1:
+                raise
+    return {}, {}, None
+
+
+_ORDS_EXCEL = {'firma': None, 'ords': frozenset()}
+
+
+def _ords_excel(excel_file):
+    """ORD presentes en el Excel; se recalculan solo si el archivo cambió (tamaño/mtime)."""
+    st = os.stat(excel_file)
+    firma = (st.st_size, st.st_mtime_ns)
+    if _ORDS_EXCEL['firma'] != firma:
+        df = leer_excel_con_snapshot(excel_file)
+        ords = pd.to_numeric(df['ORD'], errors='coerce').dropna() if 'ORD' in df.columns else pd.Series([], dtype=float)
+        _ORDS_EXCEL['ords'] = frozenset(int(o) for o in ords)
+        _ORDS_EXCEL['firma'] = firma
+    return _ORDS_EXCEL['ords']
+
+
+def aplicar_cambios_excel(validos, excel_file=EXCEL_FILE):
+    """
+    Registra los cambios de ORD presentes en el Excel en el journal (una línea por cambio, un solo
+    anexado). El libro no se reescribe aquí: lo hace compactar_journal() en segundo plano.
+    Devuelve los ORD actualizados.
+    """
+    ords = _ords_excel(excel_file)
+    entradas = [
+        (ord_val, {CAMPOS_EDITABLES[campo]: valor for campo, valor in valores.items()})
+        for _, ord_val, valores, _ in validos if ord_val in ords
+    ]
+    registrar_cambios(excel_file, entradas)
+    if entradas:
+        avisar_compactador()
+    return {ord_val for ord_val, _ in entradas}
+
+
+def ruta_respaldo(excel_file):
+    """Copia del libro anterior a la última compactación: <nombre>.bak.xlsx."""
+    base, extension = os.path.splitext(excel_file)
+    return f'{base}.bak{extension or ".xlsx"}'
+
+
+def compactar_journal(excel_file=EXCEL_FILE):
+    """
+    Vuelca el journal al libro en una sola escritura: abre el .xlsx con openpyxl (conserva la hoja
+    DETALLE y las demás), escribe las celdas editadas, lo guarda con otro nombre y lo reemplaza
+    (os.replace). Luego guarda el snapshot de la nueva versión y borra el journal.
+    openpyxl descarta al guardar lo que no soporta (validación de datos, segmentaciones, macros...):
+    antes de reemplazarlo se copia el libro anterior a <nombre>.bak.xlsx.
+    Devuelve el número de vehículos actualizados en el libro.
+    """
+    with bloqueo_excel(excel_file):
+        cambios = leer_journal(excel_file)
+        if not cambios:
+            return 0
+        libro = load_workbook(excel_file)
+        hoja = libro[HOJA_EXCEL] if HOJA_EXCEL in libro.sheetnames else libro.active
+        columnas = {normalizar_columna(c.value): c.column for c in hoja[1] if c.value is not None}
+        if 'ORD' not in columnas:
+            print(f'Advertencia: la hoja {hoja.title} no tiene columna ORD; no se compacta el journal')
+            return 0
+        filas = {}
+        for (celda,) in hoja.iter_rows(min_row=2, min_col=columnas['ORD'], max_col=columnas['ORD']):
+            try:
+                filas.setdefault(int(float(celda.value)), celda.row)
+            except (TypeError, ValueError):
+                continue
+        aplicados = 0
+        for ord_val, campos in cambios.items():
+            fila = filas.get(ord_val)
+            if fila is None:
+                continue
+            for columna, valor in campos.items():
+                if columna in columnas:
+                    hoja.cell(row=fila, column=columnas[columna], value=valor)
+            aplicados += 1
+
+        # Snapshot de la nueva versión a partir del actual + journal (evita re-parsear el .xlsx)
+        df = aplicar_overlay(leer_excel_con_snapshot(excel_file), cambios)
+        temporal = f'{excel_file}.{os.getpid()}.tmp.xlsx'
+        try:
+            libro.save(temporal)
+            shutil.copy2(excel_file, ruta_respaldo(excel_file))
+            os.replace(temporal, excel_file)
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+        guardar_snapshot_excel(huella_archivo(excel_file), df)
+        descartar_journal(excel_file)
+    print(f'Journal compactado en {excel_file}: {aplicados} vehículos')
+    return aplicados
+
+
+class CompactadorJournal(threading.Thread):
+    """
+    Hilo que compacta el journal del Excel: tras un aviso espera `retraso` segundos para agrupar
+    las ediciones seguidas en una sola escritura, y además revisa cada `intervalo` segundos
+    (ediciones hechas por otros procesos).
+    """
+
+    def __init__(self, excel_file, intervalo, retraso):
+        super().__init__(name='compactador-journal', daemon=True)
+        self.excel_file = excel_file
+        self.intervalo = intervalo
+        self.retraso = retraso
+        self._aviso = threading.Event()
+
+    def avisar(self):
+        self._aviso.set()
+
+    def run(self):
+        while True:
+            if self._aviso.wait(self.intervalo):
+                time.sleep(self.retraso)
+            self._aviso.clear()
+            try:
+                if firma_journal(self.excel_file) is not None:
+                    compactar_journal(self.excel_file)
+            except Exception as e:
+                print(f'Advertencia: no se pudo compactar el journal del Excel: {e}')
+
+
+_COMPACTADOR = {'hilo': None}
+
+
+def iniciar_compactador(excel_file, intervalo=300, retraso=5):
+    """Arranca el hilo de compactación de este proceso (una sola vez)."""
+    if _COMPACTADOR['hilo'] is None:
+        hilo = CompactadorJournal(excel_file, intervalo, retraso)
+        hilo.start()
+        _COMPACTADOR['hilo'] = hilo
+    return _COMPACTADOR['hilo']
+
+
+def avisar_compactador():
+    if _COMPACTADOR['hilo'] is not None:
+        _COMPACTADOR['hilo'].avisar()
+
+
+def aplicar_cambios(cambios, excel_file=EXCEL_FILE):
+    """
+    Aplica una lista de cambios y devuelve un resultado por cambio, en el mismo orden:
+    {'indice', 'ord', 'resultado': 'actualizado' | 'conflicto' | 'no_encontrado' | 'invalido', ...}.
+    'actualizado' trae la nueva 'version' (si vino de la DB); 'conflicto', la 'version_actual'.
+    Los ORD que no están en la DB (o todos, si no hay DB o no se pudo consultar) se registran en
+    el journal del Excel, bajo bloqueo_excel(). Un error al escribir en la DB se propaga: esos
+    cambios no se desvían al Excel, donde se saltarían el control de versión.
+    """
+    validos, resultados = validar_cambios(cambios)
+    actualizados = {}
+    conflictos = {}
+    pendientes = validos
+    seq = None
+    if validos and models_db is not None:
+        try:
+            actualizados, conflictos, seq = aplicar_cambios_db(validos)
+            pendientes = [c for c in validos if c[1] not in actualizados and c[1] not in conflictos]
+        except ConsultaDBFallida as e:
+            print(f'Advertencia: no se pudo consultar la DB ({e}); los cambios se registran en el Excel')
+    if pendientes:
+        with bloqueo_excel(excel_file):
+            for ord_val in aplicar_cambios_excel(pendientes, excel_file):
+                actualizados[ord_val] = None
+
+    for i, ord_val, _, _ in validos:
+        if ord_val in actualizados:
+            resultados[i] = {'indice': i, 'ord': ord_val, 'resultado': 'actualizado'}
+            if actualizados[ord_val] is not None:
+                resultados[i]['version'] = actualizados[ord_val]
+        elif ord_val in conflictos:
+            resultados[i] = {'indice': i, 'ord': ord_val, 'resultado': 'conflicto',
+                             'version_actual': conflictos[ord_val],
+                             'error': 'el vehículo fue modificado por otro usuario'}
+        else:
+            resultados[i] = {'indice': i, 'ord': ord_val, 'resultado': 'no_encontrado'}
+    if actualizados:
+        # Una sola invalidación por lote; si escribió en la DB, la versión ya se incrementó en su transacción
+        try:
+            invalidate_db_cache(seq)
+        except Exception:
+            pass
+    return resultados
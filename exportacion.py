@@ -0,0 +1,207 @@
+"""
+Exportación de la flota (xlsx, csv, ndjson, parquet) sin materializar la tabla en memoria.
+
+Las filas se leen ordenadas por ord en SQL con un cursor del lado del servidor (stream_results:
+cursor con nombre en PostgreSQL; en SQLite el cursor ya entrega las filas bajo demanda) en
+bloques de TAMANO_BLOQUE, con los mismos filtros que query_vehiculos. La memoria pico no
+depende del número de filas.
+
+CSV y NDJSON se envían a medida que se leen los bloques. Un .xlsx es un zip cuyo directorio
+central se escribe al final, y un .parquet lleva su índice de grupos de filas en el pie: ambos
+se arman en un archivo temporal (openpyxl write_only / ParquetWriter por bloques) y luego se
+envían en trozos de TAMANO_TROZO (el temporal se borra en cuanto se abre para enviarlo).
+"""
+import csv
+import io
+import json
+import os
+import tempfile
+
+from openpyxl import Workbook
+
+from utils import models_db, COLUMNAS, SQL_SELECT_FILAS, CLAVES_FILA, filtros_sql, desde_sql, sentencia
+
+# orjson y pyarrow son opcionales: sin orjson el NDJSON usa json; sin pyarrow no hay parquet
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except Exception:
+    pa = None
+    pq = None
+
+TAMANO_BLOQUE = 2000
+TAMANO_TROZO = 64 * 1024
+HOJA_EXPORTACION = 'DETALLE'
+MIMETYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# formato -> (extensión, mimetype)
+FORMATOS = {
+    'xlsx': ('xlsx', MIMETYPE_XLSX),
+    'csv': ('csv', 'text/csv'),
+    'ndjson': ('ndjson', 'application/x-ndjson'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def formato_disponible(formato):
+    """Indica si el formato se puede generar con las dependencias instaladas."""
+    if formato == 'parquet':
+        return pq is not None
+    return formato in FORMATOS
+
+
+def iterar_bloques(division=None, brigada=None, unidad=None, placa=None, q=None, rangos=None,
+                   tamano_bloque=TAMANO_BLOQUE):
+    """
+    Genera bloques (listas de tuplas en el orden de CLAVES_FILA) con las filas que cumplen los
+    filtros, ordenadas por ORD. Sin DB recorre por bloques el almacén en memoria (almacen.py).
+    """
+    if models_db is not None:
+        entregadas = 0
+        try:
+            dialecto = str(models_db.engine.url.get_backend_name()).lower()
+            where, params = filtros_sql(division, brigada, unidad, placa, dialecto=dialecto, q=q, rangos=rangos)
+            sql = SQL_SELECT_FILAS + desde_sql(q, dialecto=dialecto) + where + " ORDER BY ord"
+            with models_db.engine.connect() as conn:
+                resultado = conn.execution_options(stream_results=True, yield_per=tamano_bloque).execute(
+                    sentencia(sql), params
+                )
+                for bloque in resultado.partitions(tamano_bloque):
+                    entregadas += len(bloque)
+                    yield bloque
+            return
+        except Exception as e:
+            # A mitad de la exportación no se puede cambiar de fuente: se propaga el error
+            if entregadas:
+                raise
+            print(f'Advertencia: no se pudo exportar desde la DB ({e}); se usa el Excel')
+
+    from almacen import obtener_almacen
+    for df in obtener_almacen().bloques(tamano_bloque, division=division, brigada=brigada, unidad=unidad,
+                                        placa=placa, q=q, rangos=rangos):
+        df = df.reindex(columns=list(CLAVES_FILA)).fillna('')
+        yield list(df.itertuples(index=False, name=None))
+
+
+def iterar_filas(**filtros):
+    """Las filas de iterar_bloques una a una."""
+    for bloque in iterar_bloques(**filtros):
+        yield from bloque
+
+
+def escribir_xlsx(destino, filas):
+    """Escribe las filas (tuplas en el orden de COLUMNAS) en un libro write_only. Devuelve el nº de filas."""
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet(HOJA_EXPORTACION)
+    hoja.append(COLUMNAS)
+    n = 0
+    for fila in filas:
+        hoja.append(['' if v is None else v for v in fila])
+        n += 1
+    libro.save(destino)
+    return n
+
+
+def escribir_parquet(destino, bloques):
+    """Escribe cada bloque como un grupo de filas de parquet (ORD entero, el resto texto)."""
+    esquema = pa.schema([(c, pa.int64() if c == 'ORD' else pa.string()) for c in CLAVES_FILA])
+    n = 0
+    with pq.ParquetWriter(destino, esquema) as escritor:
+        for bloque in bloques:
+            columnas = [
+                [None if v == '' else v for v in valores] if c == 'ORD' else
+                ['' if v is None else str(v) for v in valores]
+                for c, valores in zip(CLAVES_FILA, zip(*bloque))
+            ]
+            escritor.write_table(pa.Table.from_arrays(columnas, schema=esquema))
+            n += len(bloque)
+    return n
+
+
+def escribir_archivo(formato, destino, **filtros):
+    """Escribe la exportación completa en destino, en cualquiera de los FORMATOS."""
+    if formato == 'xlsx':
+        escribir_xlsx(destino, iterar_filas(**filtros))
+    elif formato == 'parquet':
+        escribir_parquet(destino, iterar_bloques(**filtros))
+    else:
+        trozos = csv_en_trozos(**filtros) if formato == 'csv' else ndjson_en_trozos(**filtros)
+        with open(destino, 'wb') as f:
+            for trozo in trozos:
+                f.write(trozo)
+
+
+def generar_temporal(formato, **filtros):
+    """Genera la exportación en un archivo temporal y devuelve su ruta."""
+    fd, ruta = tempfile.mkstemp(suffix=f'.{FORMATOS[formato][0]}', prefix='exportacion_')
+    os.close(fd)
+    try:
+        escribir_archivo(formato, ruta, **filtros)
+    except Exception:
+        os.remove(ruta)
+        raise
+    return ruta
+
+
+def csv_en_trozos(**filtros):
+    """Genera el CSV (con cabecera) en trozos de bytes, uno por bloque de filas."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(COLUMNAS)
+    for bloque in iterar_bloques(**filtros):
+        escritor.writerows(('' if v is None else v for v in fila) for fila in bloque)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    resto = buffer.getvalue()
+    if resto:
+        yield resto.encode('utf-8')
+
+
+def ndjson_en_trozos(**filtros):
+    """Genera un objeto JSON por línea (claves de COLUMNAS), en trozos de bytes por bloque."""
+    for bloque in iterar_bloques(**filtros):
+        registros = ({k: ('' if v is None else v) for k, v in zip(CLAVES_FILA, fila)} for fila in bloque)
+        if orjson is not None:
+            yield b''.join(orjson.dumps(r) + b'\n' for r in registros)
+        else:
+            yield ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in registros).encode('utf-8')
+
+
+def exportar(formato, **filtros):
+    """
+    Devuelve (cuerpo, tamaño) para la respuesta de /download. Los formatos con archivo temporal
+    (xlsx, parquet) se generan aquí y tamaño es su longitud; csv y ndjson devuelven un generador
+    que lee la DB a medida que se consume (tamaño None).
+    """
+    if formato == 'csv':
+        return csv_en_trozos(**filtros), None
+    if formato == 'ndjson':
+        return ndjson_en_trozos(**filtros), None
+    ruta = generar_temporal(formato, **filtros)
+    tamano = os.path.getsize(ruta)
+    return enviar_y_borrar(ruta), tamano
+
+
+def enviar_y_borrar(ruta, tamano_trozo=TAMANO_TROZO):
+    """
+    Abre el archivo, lo borra del disco (el contenido sigue accesible por el descriptor abierto
+    hasta cerrarlo) y devuelve un generador que lo envía en trozos. Así el temporal no queda
+    huérfano aunque la descarga se corte o la respuesta nunca se consuma.
+    """
+    f = open(ruta, 'rb')
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+    def trozos():
+        with f:
+            for trozo in iter(lambda: f.read(tamano_trozo), b''):
+                yield trozo
+    return trozos()
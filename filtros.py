@@ -0,0 +1,124 @@
+"""
+Índice jerárquico de filtros división -> brigada -> unidad con conteo de vehículos por nodo.
+
+Se construye con una sola consulta agrupada (en lugar de un DISTINCT por división y por
+brigada) y se guarda en memoria asociado a la versión de datos: cuando una edición o una
+importación incrementa la versión, la siguiente llamada a obtener_indice_filtros() lo recarga.
+"""
+from utils import models_db, cargar_datos, version_datos_vigente
+from almacen import clave_datos
+
+try:
+    from sqlalchemy import text
+except Exception:
+    text = None
+
+SQL_INDICE = """
+    SELECT division, brigada, unidad, COUNT(*) AS cantidad
+    FROM vehiculos
+    GROUP BY division, brigada, unidad
+"""
+
+_INDICE = {'indice': None, 'version': None}
+
+
+class IndiceFiltros:
+    """Árbol compacto de opciones de filtro. Las claves vacías cuentan en los totales pero no
+    se ofrecen como opción (igual que los DISTINCT ... <> '' anteriores)."""
+
+    def __init__(self, filas, version=None):
+        self.version = version
+        self.total_vehiculos = 0
+        # division -> [total, {brigada -> [total, {unidad -> total}]}]
+        self._arbol = {}
+        for division, brigada, unidad, cantidad in filas:
+            division, brigada, unidad = division or '', brigada or '', unidad or ''
+            cantidad = int(cantidad)
+            self.total_vehiculos += cantidad
+            nodo_div = self._arbol.setdefault(division, [0, {}])
+            nodo_div[0] += cantidad
+            nodo_brig = nodo_div[1].setdefault(brigada, [0, {}])
+            nodo_brig[0] += cantidad
+            nodo_brig[1][unidad] = nodo_brig[1].get(unidad, 0) + cantidad
+
+        # Listas ordenadas precalculadas para servir las opciones sin ordenar en cada petición
+        self._divisiones = sorted(d for d in self._arbol if d)
+        self._brigadas = {d: sorted(b for b in nodo[1] if b) for d, nodo in self._arbol.items()}
+        self._unidades = {
+            (d, b): sorted(u for u in nodo_b[1] if u)
+            for d, nodo in self._arbol.items()
+            for b, nodo_b in nodo[1].items()
+        }
+
+    def divisiones(self):
+        return self._divisiones
+
+    def brigadas(self, division):
+        return self._brigadas.get(division, [])
+
+    def unidades(self, division, brigada):
+        return self._unidades.get((division, brigada), [])
+
+    def conteo(self, division=None, brigada=None, unidad=None):
+        """Vehículos bajo el nodo indicado (sin argumentos: toda la flota)."""
+        if not division:
+            return self.total_vehiculos
+        nodo_div = self._arbol.get(division)
+        if nodo_div is None:
+            return 0
+        if not brigada:
+            return nodo_div[0]
+        nodo_brig = nodo_div[1].get(brigada)
+        if nodo_brig is None:
+            return 0
+        if not unidad:
+            return nodo_brig[0]
+        return nodo_brig[1].get(unidad, 0)
+
+    def brigadas_global(self):
+        """Diccionario division -> brigadas, con la forma de brigadas_global en app.py."""
+        return {d: self.brigadas(d) for d in self._divisiones}
+
+    def unidades_global(self):
+        """Diccionario (division, brigada) -> unidades, con la forma de unidades_global en app.py."""
+        return {k: v for k, v in self._unidades.items() if k[0] and k[1]}
+
+
+def indice_desde_db():
+    with models_db.engine.connect() as conn:
+        return IndiceFiltros(conn.execute(text(SQL_INDICE)).all())
+
+
+def indice_desde_df(df):
+    columnas = ['DIVISION', 'BRIGADA', 'UNIDAD']
+    if df.empty or not all(c in df.columns for c in columnas):
+        return IndiceFiltros([])
+    # observed=True: con columnas category no se generan combinaciones sin vehículos
+    grupos = df.fillna('').groupby(columnas, observed=True).size()
+    return IndiceFiltros((d, b, u, n) for (d, b, u), n in grupos.items())
+
+
+def obtener_indice_filtros():
+    """
+    Devuelve el índice de filtros vigente. Con DB se reutiliza mientras la versión de datos no
+    cambie; sin DB se construye a partir de cargar_datos() (snapshot del Excel) y se reutiliza
+    mientras no cambien el Excel ni su journal (almacen.clave_datos()).
+    """
+    if models_db is not None:
+        try:
+            version = version_datos_vigente()
+            if _INDICE['indice'] is None or _INDICE['version'] != version:
+                indice = indice_desde_db()
+                indice.version = version
+                _INDICE['indice'] = indice
+                _INDICE['version'] = version
+            return _INDICE['indice']
+        except Exception as e:
+            print(f'Advertencia: no se pudo construir el índice de filtros desde la DB: {e}')
+    clave = clave_datos()
+    if _INDICE['indice'] is None or _INDICE['version'] != clave:
+        indice = indice_desde_df(cargar_datos())
+        indice.version = clave
+        _INDICE['indice'] = indice
+        _INDICE['version'] = clave
+    return _INDICE['indice']
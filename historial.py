@@ -0,0 +1,285 @@
+"""
+Historial de cambios de los vehículos (tabla vehiculo_cambios, models.VehiculoCambio).
+
+Cada escritura en vehiculos agrega filas al historial en su misma transacción; nunca se
+actualizan ni se borran:
+
+- edición (aplicar_cambios_db): una fila por campo cuyo valor cambió, con el valor anterior, el
+  nuevo y la versión resultante de la fila;
+- importación (importar_dataframe / sincronizar_dataframe): una fila por campo cambiado
+  ('importacion'), una fila 'alta' por vehículo nuevo y, por vehículo eliminado, una fila 'baja'
+  por cada campo no vacío con el valor que tenía seguida de la marca de la baja (campo NULL).
+
+Consultas:
+
+- historial_vehiculo(): cambios de un ORD, del más reciente al más antiguo (índice (ord, changed_at));
+- vehiculo_en() / flota_en(): estado en un instante pasado. De cada (ord, campo) basta el primer
+  cambio posterior al instante (su valor_anterior es el que tenía); sin cambios, vale el actual.
+  flota_en() pagina por ORD y solo consulta los cambios de los ORD de cada página, así que el
+  costo depende de esos vehículos y no del tamaño total del historial.
+
+Las ediciones del Excel (modo sin DB) no pasan por aquí: su registro es el journal (journal.py).
+"""
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from utils import models_db, COLUMNAS_DB, sentencia
+
+try:
+    from sqlalchemy import text, bindparam, select, and_, or_, func, DateTime
+    from models import VehiculoCambio
+except Exception:
+    text = bindparam = select = and_ = or_ = func = DateTime = None
+    VehiculoCambio = None
+
+# Campos de vehiculos que se historian (todo el contenido del Excel salvo la clave ORD)
+CAMPOS_HISTORIAL = [campo for campo in COLUMNAS_DB.values() if campo != 'ord']
+EXCEL_POR_CAMPO = {campo: col for col, campo in COLUMNAS_DB.items()}
+TIPOS = ('edicion', 'importacion', 'alta', 'baja')
+LIMITE_HISTORIAL = 100
+MAX_LIMITE_HISTORIAL = 1000
+TAMANO_LOTE = 1000
+# ORD anterior a cualquier otro (primera página de flota_en)
+_ORD_MINIMO = -(2 ** 31)
+
+
+def parsear_instante(valor):
+    """Fecha/hora ISO 8601 -> datetime UTC sin zona (como changed_at). ValueError si no es válida."""
+    texto = str(valor).strip()
+    # fromisoformat de Python 3.10 (runtime.txt) no acepta el sufijo Z
+    if texto[-1:] in ('Z', 'z'):
+        texto = texto[:-1] + '+00:00'
+    try:
+        instante = datetime.fromisoformat(texto)
+    except ValueError:
+        raise ValueError(f'fecha inválida: {valor!r} (se espera ISO 8601, p. ej. 2025-01-31T12:00:00Z)')
+    if instante.tzinfo is not None:
+        instante = instante.astimezone(timezone.utc).replace(tzinfo=None)
+    return instante
+
+
+def _texto(valor):
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)):
+        return ''
+    return str(valor)
+
+
+def insertar_historial(conn, filas):
+    """Agrega las filas (dicts con las columnas de vehiculo_cambios salvo id) por lotes."""
+    tabla = VehiculoCambio.__table__
+    for inicio in range(0, len(filas), TAMANO_LOTE):
+        conn.execute(tabla.insert(), filas[inicio:inicio + TAMANO_LOTE])
+    return len(filas)
+
+
+def registrar_ediciones(conn, antes, despues, versiones, ahora):
+    """
+    Historial de un lote de ediciones: antes y despues son listas paralelas de dicts (ord y campos)
+    con la fila previa y la editada; versiones, ORD -> versión tras el cambio.
+    """
+    filas = []
+    for viejo, nuevo in zip(antes, despues):
+        ord_val = viejo['ord']
+        for campo in CAMPOS_HISTORIAL:
+            if campo not in nuevo or _texto(viejo.get(campo)) == _texto(nuevo[campo]):
+                continue
+            filas.append({'ord': ord_val, 'changed_at': ahora, 'tipo': 'edicion', 'campo': campo,
+                          'valor_anterior': _texto(viejo.get(campo)), 'valor_nuevo': _texto(nuevo[campo]),
+                          'version': versiones.get(ord_val)})
+    return insertar_historial(conn, filas)
+
+
+def leer_filas(conn, ords=None):
+    """DataFrame (ord + CAMPOS_HISTORIAL, texto) de las filas actuales de vehiculos; todas si ords es None."""
+    sql = f"SELECT ord, {', '.join(CAMPOS_HISTORIAL)} FROM vehiculos"
+    columnas = ['ord'] + CAMPOS_HISTORIAL
+    if ords is None:
+        partes = [conn.execute(sentencia(sql)).all()]
+    else:
+        consulta = text(sql + ' WHERE ord IN :ords').bindparams(bindparam('ords', expanding=True))
+        ords = [int(o) for o in ords]
+        partes = [conn.execute(consulta, {'ords': ords[i:i + TAMANO_LOTE]}).all()
+                  for i in range(0, len(ords), TAMANO_LOTE)]
+    df = pd.DataFrame([f for parte in partes for f in parte], columns=columnas)
+    return df.set_index('ord')
+
+
+def registrar_historial_importacion(conn, antes, despues, ahora, eliminados=()):
+    """
+    Historial de una importación. antes: DataFrame indexado por ord con las filas previas de los
+    vehículos afectados (leer_filas); despues: registros preparados (columna ord y campos) que se
+    escriben; eliminados: ORD que se borran. Las diferencias se calculan por columna, sin recorrer
+    las filas en Python.
+    """
+    filas = []
+    despues = despues.drop_duplicates('ord', keep='last').set_index('ord') if len(despues) else despues
+    nuevos = [o for o in getattr(despues, 'index', []) if o not in antes.index]
+    comunes = antes.index.intersection(getattr(despues, 'index', pd.Index([])))
+    for campo in CAMPOS_HISTORIAL:
+        if not len(comunes) or campo not in despues.columns:
+            continue
+        viejo = antes.loc[comunes, campo].map(_texto)
+        nuevo = despues.loc[comunes, campo].map(_texto)
+        distintos = viejo != nuevo
+        for ord_val, anterior, valor in zip(comunes[distintos.to_numpy()], viejo[distintos], nuevo[distintos]):
+            filas.append({'ord': int(ord_val), 'changed_at': ahora, 'tipo': 'importacion', 'campo': campo,
+                          'valor_anterior': anterior, 'valor_nuevo': valor, 'version': None})
+    filas.extend({'ord': int(o), 'changed_at': ahora, 'tipo': 'alta', 'campo': None,
+                  'valor_anterior': None, 'valor_nuevo': None, 'version': None} for o in nuevos)
+    for ord_val in eliminados:
+        if ord_val in antes.index:
+            fila = antes.loc[ord_val]
+            filas.extend({'ord': int(ord_val), 'changed_at': ahora, 'tipo': 'baja', 'campo': campo,
+                          'valor_anterior': _texto(fila[campo]), 'valor_nuevo': None, 'version': None}
+                         for campo in CAMPOS_HISTORIAL if _texto(fila[campo]))
+        # La marca de la baja va después de sus campos: los que no se registraron estaban vacíos
+        filas.append({'ord': int(ord_val), 'changed_at': ahora, 'tipo': 'baja', 'campo': None,
+                      'valor_anterior': None, 'valor_nuevo': None, 'version': None})
+    return insertar_historial(conn, filas)
+
+
+def _cambio_dict(fila):
+    # Claves str simples: los nombres de columna de SQLAlchemy son una subclase que orjson no acepta
+    cambio = {str(k): v for k, v in fila.items()}
+    if isinstance(cambio['changed_at'], datetime):
+        cambio['changed_at'] = cambio['changed_at'].isoformat()
+    return cambio
+
+
+def historial_vehiculo(ord_val, limit=LIMITE_HISTORIAL, antes=None):
+    """
+    Cambios de un vehículo, del más reciente al más antiguo. antes = (changed_at, id) del último
+    cambio ya devuelto pagina hacia atrás (keyset: los cambios de una misma edición comparten
+    changed_at y se desempatan por id).
+    """
+    c = VehiculoCambio.__table__.c
+    consulta = select(c.id, c.changed_at, c.tipo, c.campo, c.valor_anterior, c.valor_nuevo, c.version).where(
+        c.ord == int(ord_val))
+    if antes is not None:
+        consulta = consulta.where(or_(c.changed_at < antes[0], and_(c.changed_at == antes[0], c.id < int(antes[1]))))
+    consulta = consulta.order_by(c.changed_at.desc(), c.id.desc()).limit(int(limit))
+    with models_db.engine.connect() as conn:
+        return [_cambio_dict(f) for f in conn.execute(consulta).mappings()]
+
+
+def _primeros_cambios(conn, instante, ords):
+    """
+    (ord, campo) -> (tipo, valor_anterior, changed_at, id) del primer cambio posterior al instante
+    de cada campo de los ORD indicados; campo None es la primera marca de alta o baja. Solo se
+    leen los cambios de esos ORD posteriores al instante (índice (ord, changed_at)): DISTINCT ON
+    en PostgreSQL, ROW_NUMBER() en los demás motores.
+    """
+    c = VehiculoCambio.__table__.c
+    columnas = (c.ord, c.campo, c.tipo, c.valor_anterior, c.changed_at, c.id)
+    primeros = {}
+    for inicio in range(0, len(ords), TAMANO_LOTE):
+        condicion = and_(c.ord.in_(ords[inicio:inicio + TAMANO_LOTE]), c.changed_at > instante)
+        if conn.dialect.name == 'postgresql':
+            consulta = (select(*columnas).where(condicion).distinct(c.ord, c.campo)
+                        .order_by(c.ord, c.campo, c.changed_at, c.id))
+        else:
+            numero = func.row_number().over(partition_by=(c.ord, c.campo), order_by=(c.changed_at, c.id))
+            numerados = select(*columnas, numero.label('n')).where(condicion).subquery()
+            consulta = select(*(numerados.c[col.name] for col in columnas)).where(numerados.c.n == 1)
+        for fila in conn.execute(consulta):
+            primeros[(fila[0], fila[1])] = tuple(fila[2:])
+    return primeros
+
+
+def _estado_en(ords, actuales, primeros):
+    """
+    ORD -> campos en el instante de los ORD indicados que existían entonces. actuales: ORD -> dict
+    de la fila actual; primeros: _primeros_cambios(). Si la primera marca posterior es un alta, el
+    vehículo no existía; si es una baja, los campos sin un cambio anterior a ella estaban vacíos
+    (la baja solo registra los no vacíos); si no hay marca, cada campo vale el valor_anterior de su
+    primer cambio posterior o, si no cambió, el actual.
+    """
+    estado = {}
+    for ord_val in ords:
+        marca = primeros.get((ord_val, None))
+        if marca is None and ord_val not in actuales:
+            continue
+        if marca is not None and marca[0] == 'alta':
+            continue
+        campos = {}
+        for campo in CAMPOS_HISTORIAL:
+            cambio = primeros.get((ord_val, campo))
+            if marca is not None and (cambio is None or (cambio[2], cambio[3]) > (marca[2], marca[3])):
+                campos[campo] = ''
+            elif cambio is not None:
+                campos[campo] = cambio[1] or ''
+            else:
+                campos[campo] = actuales[ord_val][campo]
+        estado[ord_val] = campos
+    return estado
+
+
+def _filas_por_ord(conn, ords):
+    actuales = leer_filas(conn, ords)
+    return dict(zip(actuales.index, actuales.to_dict(orient='records')))
+
+
+def _candidatos(conn, instante, filtros, despues_de, limit):
+    """
+    Siguientes ORD (mayores que despues_de) que pudieron cumplir los filtros en el instante: los
+    que los cumplen hoy y los que después del instante tienen una marca de alta o baja o un
+    cambio en un campo filtrado (índice (campo, changed_at, ord)).
+    """
+    condicion = 'campo IS NULL' + (' OR campo IN :campos' if filtros else '')
+    sql = (
+        'SELECT ord FROM vehiculos WHERE ord > :k' + ''.join(f' AND {n} = :{n}' for n in filtros) +
+        f' UNION SELECT ord FROM vehiculo_cambios WHERE changed_at > :t AND ord > :k AND ({condicion})'
+        ' ORDER BY ord LIMIT :limit'
+    )
+    parametros = [bindparam('t', type_=DateTime)]
+    if filtros:
+        parametros.append(bindparam('campos', expanding=True))
+    consulta = text(sql).bindparams(*parametros)
+    valores = dict(filtros, t=instante, k=despues_de, limit=limit, campos=list(filtros))
+    return [int(f[0]) for f in conn.execute(consulta, valores)]
+
+
+def _como_vehiculo(ord_val, campos):
+    """Dict con las columnas del Excel, como las filas de /api/vehiculos."""
+    fila = {'ORD': int(ord_val)}
+    fila.update({EXCEL_POR_CAMPO[c]: _texto(campos.get(c)) for c in CAMPOS_HISTORIAL})
+    return fila
+
+
+def vehiculo_en(ord_val, instante):
+    """Estado de un vehículo en el instante (datetime UTC), o None si no existía."""
+    ord_val = int(ord_val)
+    with models_db.engine.connect() as conn:
+        estado = _estado_en([ord_val], _filas_por_ord(conn, [ord_val]),
+                            _primeros_cambios(conn, instante, [ord_val]))
+    if ord_val not in estado:
+        return None
+    return _como_vehiculo(ord_val, estado[ord_val])
+
+
+def flota_en(instante, division=None, brigada=None, unidad=None, limit=LIMITE_HISTORIAL, despues_de=None):
+    """
+    Hasta limit vehículos (dicts como los de /api/vehiculos, ordenados por ORD y con ORD mayor que
+    despues_de) tal como estaban en el instante, filtrados por división / brigada / unidad con los
+    valores de ese momento. Los ORD candidatos se recorren por lotes (keyset sobre ORD); cada lote
+    lee solo sus propios cambios posteriores al instante.
+    """
+    filtros = {n: v for n, v in (('division', division), ('brigada', brigada), ('unidad', unidad)) if v}
+    lote = min(max(int(limit) * 2, 100), TAMANO_LOTE)
+    posicion = _ORD_MINIMO if despues_de is None else int(despues_de)
+    vehiculos = []
+    with models_db.engine.connect() as conn:
+        while len(vehiculos) < limit:
+            ords = _candidatos(conn, instante, filtros, posicion, lote)
+            if not ords:
+                break
+            estado = _estado_en(ords, _filas_por_ord(conn, ords), _primeros_cambios(conn, instante, ords))
+            for ord_val in ords:
+                campos = estado.get(ord_val)
+                if campos is not None and all(_texto(campos.get(n)) == v for n, v in filtros.items()):
+                    vehiculos.append(_como_vehiculo(ord_val, campos))
+            posicion = ords[-1]
+            if len(ords) < lote:
+                break
+    return vehiculos[:limit]
@@ -0,0 +1,357 @@
+"""
+Importación masiva de la hoja DETALLE a la tabla vehiculos.
+
+En lugar de construir un objeto Vehiculo por fila (df.iterrows + session.add), el DataFrame
+normalizado se transforma en una sola pasada vectorizada a las columnas de la tabla y se carga
+con la vía masiva del motor: COPY en PostgreSQL y executemany por lotes en SQLite u otros.
+Las filas inválidas no abortan la carga: se acumulan en el reporte de errores.
+
+sincronizar_dataframe() es la alternativa incremental a borrar y recargar: compara un hash del
+contenido de cada fila contra el guardado en la tabla (clave ORD) y solo emite los INSERT/UPDATE
+(como INSERT ... ON CONFLICT (ord) DO UPDATE) y DELETE necesarios.
+
+Ambas recalculan el resumen materializado de la flota (resumen.py) y registran en el historial
+(historial.py) los campos cambiados, las altas y las bajas, en la misma transacción. Las filas
+escritas reciben el cambio_seq de la importación y los ORD eliminados quedan como bajas del feed
+de cambios (cambios.py).
+
+El manifiesto (tabla importaciones) guarda la huella del último Excel importado con éxito para
+que el arranque pueda omitir la lectura del .xlsx cuando el archivo no cambió.
+"""
+import csv
+import io
+import time
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import select, text
+
+from utils import (COLUMNAS_DB, COLUMNAS_NUMERICAS, COLUMNAS_ENTERAS, invalidate_db_cache, incrementar_version_datos,
+                   huella_archivo, normalizar_placas, texto_busqueda_serie)
+from texto import valores_numericos
+from resumen import reconstruir_resumen
+from historial import leer_filas, registrar_historial_importacion
+from cambios import registrar_bajas, quitar_bajas
+
+TAMANO_LOTE = 1000
+
+
+class _SinCambios(Exception):
+    """La sincronización no tiene nada que escribir: se deshace la transacción (y su versión)."""
+
+
+def bloquear_para_importar(conn):
+    """
+    Toma al principio de la transacción los bloqueos de una importación: en PostgreSQL la tabla
+    vehiculos en modo EXCLUSIVE (las lecturas siguen, las ediciones esperan a que termine) y
+    luego la versión de datos, que es el cambio_seq de todo lo que escribe. Así lo que la
+    importación lee para comparar no cambia hasta su commit, y como ninguna edición puede tener
+    filas bloqueadas mientras tanto, no hay interbloqueo con ellas (que toman la versión al final).
+    En SQLite incrementar la versión ya toma el bloqueo de escritura de la base.
+    """
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('LOCK TABLE vehiculos IN EXCLUSIVE MODE'))
+    return incrementar_version_datos(conn)
+
+
+class ReporteImportacion:
+    """Resultado de una importación: filas cargadas, errores por fila y tiempos."""
+
+    def __init__(self, total=0):
+        self.total = total
+        self.importados = 0
+        self.eliminados = 0
+        self.actualizados = 0
+        self.sin_cambios = 0
+        self.errores = []
+        self.segundos = 0.0
+
+    @property
+    def filas_por_segundo(self):
+        return self.importados / self.segundos if self.segundos > 0 else 0.0
+
+    def agregar_error(self, fila, ord_val, motivo):
+        self.errores.append({'fila': fila, 'ord': ord_val, 'motivo': motivo})
+
+    def to_dict(self):
+        return {
+            'total': self.total,
+            'importados': self.importados,
+            'actualizados': self.actualizados,
+            'eliminados': self.eliminados,
+            'sin_cambios': self.sin_cambios,
+            'errores': len(self.errores),
+            'segundos': round(self.segundos, 3),
+            'filas_por_segundo': round(self.filas_por_segundo, 1),
+        }
+
+    def __str__(self):
+        if self.actualizados or self.sin_cambios:
+            return (f'{self.importados} insertados, {self.actualizados} actualizados, '
+                    f'{self.eliminados} eliminados, {self.sin_cambios} sin cambios, '
+                    f'{len(self.errores)} errores en {self.segundos:.2f}s')
+        return (f'{self.importados} registros importados, {len(self.errores)} errores '
+                f'en {self.segundos:.2f}s ({self.filas_por_segundo:.0f} filas/s)')
+
+
+def _longitudes_maximas(tabla):
+    """Longitud máxima de cada columna String de la tabla (None si no tiene límite)."""
+    return {c.name: getattr(c.type, 'length', None) for c in tabla.columns}
+
+
+def _campos_contenido():
+    """Columnas de la tabla que provienen del Excel, excepto la clave ORD."""
+    return [campo for campo in COLUMNAS_DB.values() if campo != 'ord']
+
+
+def hash_filas(datos):
+    """Hash (hex de 64 bits) del contenido de cada fila, calculado de forma vectorizada."""
+    hashes = pd.util.hash_pandas_object(datos[_campos_contenido()], index=False)
+    return hashes.map('{:016x}'.format)
+
+
+def columna_numerica(serie, entera=False):
+    """Serie de texto -> números (objeto, con None donde el texto no es un número) para cargar en la DB."""
+    numeros = valores_numericos(serie)
+    if entera:
+        numeros = numeros.round().astype('Int64')
+    return numeros.astype(object).where(numeros.notna(), None)
+
+
+def preparar_registros(df, tabla, reporte):
+    """
+    Convierte el DataFrame normalizado (columnas de COLUMNAS) en un DataFrame con las columnas
+    de la tabla vehiculos. Valida ORD y longitudes de forma vectorizada y registra en el reporte
+    las filas descartadas. Devuelve solo las filas válidas.
+    """
+    df = df.fillna('')
+    # Número de fila en Excel (encabezado en la fila 1)
+    filas = pd.Series(range(2, len(df) + 2), index=df.index)
+
+    ord_raw = df['ORD'].astype(str).str.strip()
+    ord_num = pd.to_numeric(ord_raw, errors='coerce')
+    validos = ord_num.notna() & (ord_num % 1 == 0)
+    for idx in df.index[~validos]:
+        reporte.agregar_error(int(filas[idx]), ord_raw[idx], 'ORD vacío o no numérico')
+
+    duplicados = validos & ord_num.duplicated(keep='first')
+    for idx in df.index[duplicados]:
+        reporte.agregar_error(int(filas[idx]), ord_raw[idx], 'ORD duplicado en el Excel')
+    validos &= ~duplicados
+
+    datos = pd.DataFrame(index=df.index)
+    for col, campo in COLUMNAS_DB.items():
+        if campo == 'ord':
+            continue
+        datos[campo] = df[col].astype(str) if col in df.columns else ''
+    datos['hash_fila'] = hash_filas(datos)
+    datos['placas_norm'] = normalizar_placas(datos['placas'])
+    datos['busqueda'] = texto_busqueda_serie(datos)
+    for campo, columna in COLUMNAS_NUMERICAS.items():
+        datos[columna] = columna_numerica(datos[campo], columna in COLUMNAS_ENTERAS)
+    datos.insert(0, 'ord', ord_num.where(validos, 0).astype('int64'))
+
+    # Valores que no caben en la columna: se descarta la fila en lugar de fallar toda la carga
+    for campo, maximo in _longitudes_maximas(tabla).items():
+        if not maximo or campo not in datos.columns or campo == 'ord':
+            continue
+        largos = validos & (datos[campo].str.len() > maximo)
+        for idx in df.index[largos]:
+            reporte.agregar_error(int(filas[idx]), ord_raw[idx], f'{campo} excede {maximo} caracteres')
+        validos &= ~largos
+
+    return datos[validos].assign(updated_at=datetime.utcnow())
+
+
+def _copy_postgres(conn, tabla, datos):
+    """Carga con COPY ... FROM STDIN (formato CSV) usando la conexión DBAPI de psycopg2."""
+    buf = io.StringIO()
+    # QUOTE_NONNUMERIC: las cadenas vacías viajan como "" (texto vacío) y no como NULL
+    datos.to_csv(buf, index=False, header=False, quoting=csv.QUOTE_NONNUMERIC)
+    buf.seek(0)
+    columnas = ', '.join(datos.columns)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY {tabla.name} ({columnas}) FROM STDIN WITH (FORMAT csv)', buf)
+    finally:
+        cursor.close()
+
+
+def _insert_por_lotes(conn, tabla, datos):
+    """Carga con executemany en lotes de TAMANO_LOTE filas."""
+    registros = datos.to_dict(orient='records')
+    for inicio in range(0, len(registros), TAMANO_LOTE):
+        conn.execute(tabla.insert(), registros[inicio:inicio + TAMANO_LOTE])
+
+
+def cargar_masivo(conn, tabla, datos):
+    """Inserta el DataFrame preparado en la tabla usando la vía masiva del motor de la conexión."""
+    if datos.empty:
+        return
+    if conn.dialect.name == 'postgresql':
+        _copy_postgres(conn, tabla, datos)
+    else:
+        _insert_por_lotes(conn, tabla, datos)
+
+
+def importar_dataframe(df, force=False):
+    """
+    Importa el DataFrame normalizado de la hoja DETALLE en la tabla vehiculos.
+    Si force=True, vacía la tabla antes (en la misma transacción que la carga).
+    Sin force, las filas cuyo ORD ya existe se reportan como error y no se insertan.
+    Devuelve un ReporteImportacion.
+    """
+    from models import Vehiculo, db
+    tabla = Vehiculo.__table__
+    reporte = ReporteImportacion(total=len(df))
+    inicio = time.perf_counter()
+
+    datos = preparar_registros(df, tabla, reporte)
+
+    with db.engine.begin() as conn:
+        ahora = datetime.utcnow()
+        seq = bloquear_para_importar(conn)
+        if force:
+            # Historial: se compara la tabla que se reemplaza con la que se carga
+            antes = leer_filas(conn)
+            reporte.eliminados = conn.execute(tabla.delete()).rowcount
+            eliminados = sorted(set(antes.index) - set(datos['ord']))
+        else:
+            existentes = {r[0] for r in conn.execute(select(tabla.c.ord))}
+            repetidos = datos['ord'].isin(existentes)
+            for idx, ord_val in datos.loc[repetidos, 'ord'].items():
+                reporte.agregar_error(int(idx) + 2, int(ord_val), 'ORD ya existe en la base de datos')
+            datos = datos[~repetidos]
+            antes, eliminados = leer_filas(conn, []), []
+
+        datos = datos.assign(cambio_seq=seq)
+        cargar_masivo(conn, tabla, datos)
+        reporte.importados = len(datos)
+        reconstruir_resumen(conn)
+        registrar_historial_importacion(conn, antes, datos, ahora, eliminados)
+        quitar_bajas(conn)
+        registrar_bajas(conn, eliminados, seq, ahora)
+
+    reporte.segundos = time.perf_counter() - inicio
+    invalidate_db_cache(seq)
+    return reporte
+
+
+def _upsert(conn, tabla, registros):
+    """INSERT ... ON CONFLICT (ord) DO UPDATE por lotes (PostgreSQL y SQLite)."""
+    if conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif conn.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        # Otros motores: borrar e insertar las filas afectadas
+        ords = [r['ord'] for r in registros]
+        for inicio in range(0, len(ords), TAMANO_LOTE):
+            conn.execute(tabla.delete().where(tabla.c.ord.in_(ords[inicio:inicio + TAMANO_LOTE])))
+        for inicio in range(0, len(registros), TAMANO_LOTE):
+            conn.execute(tabla.insert(), registros[inicio:inicio + TAMANO_LOTE])
+        return
+
+    stmt = insert(tabla)
+    columnas = [c for c in registros[0] if c != 'ord']
+    set_ = {c: stmt.excluded[c] for c in columnas}
+    # Una fila reescrita por la importación invalida las ediciones basadas en la versión anterior
+    set_['version'] = tabla.c.version + 1
+    stmt = stmt.on_conflict_do_update(index_elements=['ord'], set_=set_)
+    for inicio in range(0, len(registros), TAMANO_LOTE):
+        conn.execute(stmt, registros[inicio:inicio + TAMANO_LOTE])
+
+
+def sincronizar_dataframe(df):
+    """
+    Sincroniza la tabla vehiculos con el DataFrame normalizado de la hoja DETALLE.
+    Compara hash_fila por ORD y solo escribe las filas nuevas o cuyo contenido en el Excel cambió;
+    borra las filas cuyo ORD ya no aparece en el Excel. Como el hash es del contenido de origen,
+    las ediciones hechas en la aplicación se conservan mientras esa fila del Excel no cambie.
+    Devuelve un ReporteImportacion.
+    """
+    from models import Vehiculo, db
+    tabla = Vehiculo.__table__
+    reporte = ReporteImportacion(total=len(df))
+    inicio = time.perf_counter()
+
+    datos = preparar_registros(df, tabla, reporte)
+    # ORD presentes en el Excel aunque su fila haya sido descartada: no se deben borrar
+    ords_excel = set(pd.to_numeric(df['ORD'], errors='coerce').dropna().astype('int64'))
+
+    try:
+        with db.engine.begin() as conn:
+            # Bloqueos antes de leer los hashes y las filas actuales: lo que se compara es lo que
+            # se va a reescribir (una edición confirmada en medio quedaría fuera del historial)
+            seq = bloquear_para_importar(conn)
+            actuales = dict(conn.execute(select(tabla.c.ord, tabla.c.hash_fila)).all())
+
+            hash_actual = datos['ord'].map(actuales)
+            nuevos = ~datos['ord'].isin(list(actuales))
+            cambiados = ~nuevos & (hash_actual != datos['hash_fila'])
+            reporte.importados = int(nuevos.sum())
+            reporte.actualizados = int(cambiados.sum())
+            reporte.sin_cambios = len(datos) - reporte.importados - reporte.actualizados
+
+            pendientes = datos[nuevos | cambiados]
+            eliminar = sorted(o for o in actuales if o not in ords_excel)
+            if pendientes.empty and not eliminar:
+                raise _SinCambios()
+            # Filas previas de lo que se reescribe o se borra, para el historial
+            antes = leer_filas(conn, list(pendientes.loc[cambiados[nuevos | cambiados], 'ord']) + eliminar)
+            pendientes = pendientes.assign(cambio_seq=seq)
+            if not pendientes.empty:
+                _upsert(conn, tabla, pendientes.to_dict(orient='records'))
+
+            for inicio_lote in range(0, len(eliminar), TAMANO_LOTE):
+                lote = eliminar[inicio_lote:inicio_lote + TAMANO_LOTE]
+                reporte.eliminados += conn.execute(tabla.delete().where(tabla.c.ord.in_(lote))).rowcount
+
+            ahora = datetime.utcnow()
+            reconstruir_resumen(conn)
+            registrar_historial_importacion(conn, antes, pendientes, ahora, eliminar)
+            quitar_bajas(conn)
+            registrar_bajas(conn, eliminar, seq, ahora)
+    except _SinCambios:
+        reporte.segundos = time.perf_counter() - inicio
+        return reporte
+
+    reporte.segundos = time.perf_counter() - inicio
+    invalidate_db_cache(seq)
+    return reporte
+
+
+def excel_sin_cambios(excel_file):
+    """
+    True si el Excel coincide con la última importación registrada en el manifiesto.
+    Compara primero tamaño y mtime (sin leer el archivo); si el mtime cambió pero el tamaño no
+    (p. ej. tras un checkout en el deploy), compara el SHA-256 y actualiza el mtime registrado.
+    """
+    from models import ImportacionExcel, db
+    huella = huella_archivo(excel_file, con_hash=False)
+    ultima = (ImportacionExcel.query
+              .filter_by(archivo=huella['archivo'])
+              .order_by(ImportacionExcel.id.desc())
+              .first())
+    if ultima is None or ultima.tamano != huella['tamano']:
+        return False
+    if ultima.mtime == huella['mtime']:
+        return True
+    if ultima.sha256 != huella_archivo(excel_file)['sha256']:
+        return False
+    ultima.mtime = huella['mtime']
+    db.session.commit()
+    return True
+
+
+def registrar_importacion(huella, reporte):
+    """Agrega al manifiesto la huella del Excel importado y el resumen del reporte."""
+    from models import ImportacionExcel, db
+    db.session.add(ImportacionExcel(
+        archivo=huella['archivo'],
+        tamano=huella['tamano'],
+        mtime=huella['mtime'],
+        sha256=huella['sha256'],
+        resultado=str(reporte)[:256],
+    ))
+    db.session.commit()
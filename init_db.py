@@ -1,7 +1,8 @@
 import os
 from urllib.parse import urlparse
 from app import create_app
-from utils import cargar_datos, limpiar_nans
+from utils import guardar_excel_en_db
+from migraciones import aplicar_migraciones
 
 
 def init_db(app):
@@ -42,6 +43,7 @@ def init_db(app):
         if models_db is not None:
             try:
                 models_db.create_all()
+                aplicar_migraciones(models_db.engine)
             except Exception as e:
                 # Mostrar mensaje claro y, si hay un problema con Postgres, intentar fallback a sqlite
                 print('Error al conectar a la base de datos al crear tablas:', e)
@@ -54,6 +56,7 @@ def init_db(app):
                 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///transportes2025.sqlite'
                 try:
                     models_db.create_all()
+                    aplicar_migraciones(models_db.engine)
                     print('Tablas creadas en sqlite local.')
                 except Exception as e2:
                     print('No se pudo crear tablas en sqlite:', e2)
@@ -68,70 +71,15 @@ def init_db(app):
                 print('Instala las dependencias: pip install Flask-SQLAlchemy psycopg2-binary python-dotenv')
                 return
 
-            print(f'Encontrado {EXCEL_FILE}, poblando la base de datos desde la hoja DETALLE...')
-            
-            # Leer específicamente la hoja DETALLE
-            import pandas as pd
-            df = pd.read_excel(EXCEL_FILE, sheet_name='DETALLE', header=0, dtype={'MATRICULA 2025': str})
-            
-            # Normalizar columnas
-            from utils import normalizar_columna
-            df.columns = [normalizar_columna(c) for c in df.columns]
-            df = limpiar_nans(df)
-            
-            print(f'Columnas detectadas: {list(df.columns)}')
-            print(f'Total de registros a importar: {len(df)}')
-            
-            # Evitar duplicados por ORD
-            for _, row in df.iterrows():
-                try:
-                    ord_val = int(row.get('ORD')) if row.get('ORD') not in (None, '') else None
-                except Exception:
-                    ord_val = None
-                if ord_val is None:
-                    continue
-                existing = ModelVehiculo.query.filter_by(ord=ord_val).first()
-                if existing:
-                    continue
-                
-                # Guardar todos los campos como string (excepto ORD que es Integer)
-                v = ModelVehiculo(
-                    ord=ord_val,
-                    clase_tipo=str(row.get('CLASE / TIPO', '')),
-                    marca=str(row.get('MARCA', '')),
-                    modelo=str(row.get('MODELO', '')),
-                    chasis=str(row.get('CHASIS', '')),
-                    motor=str(row.get('MOTOR', '')),
-                    ano=str(row.get('ANO', '')),
-                    registro=str(row.get('REGISTRO', '')),
-                    placas=str(row.get('PLACAS', '')),
-                    color=str(row.get('COLOR', '')),
-                    tonelaje=str(row.get('TONELAJE', '')),
-                    cilindraje=str(row.get('CILINDRAJE', '')),
-                    combustible=str(row.get('COMBUSTIBLE', '')),
-                    num_pasajeros=str(row.get('# PASAJ', '')),
-                    valor_esbye=str(row.get('VALOR ESBYE', '')),
-                    valor_comercial=str(row.get('VALOR COMERCIAL', '')),
-                    division=str(row.get('DIVISION', '')),
-                    brigada=str(row.get('BRIGADA', '')),
-                    unidad=str(row.get('UNIDAD', '')),
-                    necesidad_operacional_ft=str(row.get('NECESIDAD OPERACIONAL FT', '')),
-                    condicion=str(row.get('CONDICION', '')),
-                    estado=str(row.get('ESTADO', '')),
-                    codigo_esbye=str(row.get('CODIGO ESBYE', '')),
-                    eod=str(row.get('EOD', '')),
-                    digito=str(row.get('DIGITO', '')),
-                    matricula_2025=str(row.get('MATRICULA 2025', '')),
-                    custodio=str(row.get('CUSTODIO', '')),
-                    observacion=str(row.get('OBSERVACION', ''))
-                )
-                models_db.session.add(v)
-            models_db.session.commit()
-            print('Población completada.')
+            print(f'Encontrado {EXCEL_FILE}, sincronizando la base de datos con la hoja DETALLE...')
+            # Solo inserta/actualiza/borra las filas que cambiaron (sin consultas por fila)
+            # Si el Excel no cambió desde la última importación, no se vuelve a leer
+            resultado = guardar_excel_en_db(sincronizar=True, solo_si_cambio=True)
+            print('Población completada:', resultado)
         else:
             print(f'No se encontró {EXCEL_FILE}, consideración: la base de datos queda vacía.')
 
 
 if __name__ == '__main__':
-    app = create_app()
+    app = create_app(cargar_filtros=False)
     init_db(app)
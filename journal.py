@@ -0,0 +1,113 @@
+"""
+Journal de ediciones del Excel (modo sin DB): un archivo JSON Lines de solo anexado.
+
+Editar un vehículo que solo está en el Excel agrega una línea {"ord", "campos", "ts"} en lugar
+de reescribir el libro. cargar_datos() aplica el journal sobre los datos del Excel (overlay) y
+edicion.compactar_journal() lo vuelca al libro en una sola escritura, en segundo plano.
+
+Orden de lectura/escritura que mantiene la coherencia sin bloquear a los lectores: el lector lee
+primero el journal y después el Excel; la compactación reemplaza primero el Excel y después borra
+el journal. Aplicar dos veces la misma entrada es inocuo (asigna los mismos valores).
+"""
+import json
+import os
+import time
+
+import pandas as pd
+
+# Sincronizar cada anexado con el disco (EXCEL_JOURNAL_FSYNC=0 lo desactiva)
+FSYNC = os.environ.get('EXCEL_JOURNAL_FSYNC', '1') != '0'
+
+_CACHE = {'firma': None, 'cambios': {}}
+
+
+def ruta_journal(excel_file):
+    return os.environ.get('EXCEL_JOURNAL') or f'{excel_file}.journal.jsonl'
+
+
+def firma_journal(excel_file):
+    """(tamaño, mtime_ns) del journal, o None si no existe. Sirve para versionar cachés."""
+    try:
+        st = os.stat(ruta_journal(excel_file))
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def registrar_cambios(excel_file, entradas):
+    """Anexa las entradas (ord, {COLUMNA: valor}) al journal con una sola escritura."""
+    if not entradas:
+        return
+    ahora = time.time()
+    lineas = ''.join(
+        json.dumps({'ord': ord_val, 'campos': campos, 'ts': ahora}, ensure_ascii=False) + '\n'
+        for ord_val, campos in entradas
+    )
+    fd = os.open(ruta_journal(excel_file), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, lineas.encode('utf-8'))
+        if FSYNC:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def leer_journal(excel_file):
+    """
+    Cambios pendientes del journal como dict ORD -> {COLUMNA: valor} (la última entrada gana).
+    Se reutiliza el resultado mientras el archivo no cambie. Las líneas incompletas (escritura
+    interrumpida) o sin un ORD numérico y un dict de campos se ignoran con una advertencia.
+    """
+    firma = firma_journal(excel_file)
+    if firma is None:
+        return {}
+    if _CACHE['firma'] == firma:
+        return _CACHE['cambios']
+    cambios = {}
+    invalidas = 0
+    with open(ruta_journal(excel_file), encoding='utf-8') as f:
+        for linea in f:
+            try:
+                entrada = json.loads(linea)
+                ord_val, campos = int(entrada['ord']), entrada['campos']
+                if not isinstance(campos, dict):
+                    raise TypeError('campos no es un objeto')
+            except (ValueError, KeyError, TypeError):
+                invalidas += 1
+                continue
+            cambios.setdefault(ord_val, {}).update(campos)
+    if invalidas:
+        print(f'Advertencia: {invalidas} líneas inválidas ignoradas en {ruta_journal(excel_file)}')
+    _CACHE['firma'] = firma
+    _CACHE['cambios'] = cambios
+    return cambios
+
+
+def aplicar_overlay(df, cambios):
+    """Aplica los cambios del journal sobre el DataFrame normalizado del Excel (in place)."""
+    if not cambios or df.empty or 'ORD' not in df.columns:
+        return df
+    posiciones = pd.Series(range(len(df)), index=pd.to_numeric(df['ORD'], errors='coerce'))
+    posiciones = posiciones[~posiciones.index.duplicated(keep='first')]
+    for ord_val, campos in cambios.items():
+        if ord_val not in posiciones.index:
+            continue
+        fila = posiciones[ord_val]
+        for columna, valor in campos.items():
+            if columna not in df.columns:
+                continue
+            # Columnas category (utils.categorizar): un valor nuevo se agrega a las categorías
+            if isinstance(df[columna].dtype, pd.CategoricalDtype) and valor not in df[columna].cat.categories:
+                df[columna] = df[columna].cat.add_categories([valor])
+            df.iat[fila, df.columns.get_loc(columna)] = valor
+    return df
+
+
+def descartar_journal(excel_file):
+    """Borra el journal (tras compactarlo en el libro)."""
+    try:
+        os.remove(ruta_journal(excel_file))
+    except FileNotFoundError:
+        pass
+    _CACHE['firma'] = None
+    _CACHE['cambios'] = {}
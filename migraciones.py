@@ -0,0 +1,234 @@
+"""
+Migraciones de esquema sin pérdida de datos.
+
+db.create_all() solo crea tablas que no existen: no agrega columnas ni índices a una tabla
+ya poblada. Cada migración es una función idempotente registrada con @migracion('id');
+aplicar_migraciones() ejecuta las pendientes en orden y las anota en schema_migraciones.
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+MIGRACIONES = []
+
+
+def migracion(id_migracion):
+    """Registra una función de migración. La docstring se usa como descripción."""
+    def registrar(func):
+        MIGRACIONES.append((id_migracion, func))
+        return func
+    return registrar
+
+
+def _columnas(conn, tabla):
+    return {c['name'] for c in inspect(conn).get_columns(tabla)}
+
+
+def agregar_columna(conn, tabla, nombre, ddl):
+    """ALTER TABLE ... ADD COLUMN solo si la columna aún no existe (tablas creadas antes)."""
+    if nombre not in _columnas(conn, tabla):
+        conn.execute(text(f'ALTER TABLE {tabla} ADD COLUMN {nombre} {ddl}'))
+
+
+@migracion('0001_hash_fila')
+def _hash_fila(conn):
+    """Hash del contenido de la fila de origen para la sincronización incremental."""
+    agregar_columna(conn, 'vehiculos', 'hash_fila', 'VARCHAR(16)')
+
+
+@migracion('0002_placas_norm')
+def _placas_norm(conn):
+    """Columna placas_norm (placa normalizada) con índice, rellenada desde placas."""
+    from utils import normalizar_placa
+    agregar_columna(conn, 'vehiculos', 'placas_norm', 'VARCHAR(64)')
+    filas = conn.execute(text('SELECT id, placas FROM vehiculos WHERE placas_norm IS NULL')).all()
+    if filas:
+        conn.execute(
+            text('UPDATE vehiculos SET placas_norm = :norm WHERE id = :id'),
+            [{'id': id_, 'norm': normalizar_placa(placas)} for id_, placas in filas]
+        )
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_vehiculos_placas_norm ON vehiculos (placas_norm)'))
+
+
+@migracion('0003_indice_trigramas_placas')
+def _indice_trigramas_placas(conn):
+    """Índice de trigramas sobre placas_norm: pg_trgm (GIN) en PostgreSQL, FTS5 trigram en SQLite."""
+    if conn.dialect.name == 'postgresql':
+        try:
+            with conn.begin_nested():
+                conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        except Exception as e:
+            print(f'Aviso: no se pudo habilitar pg_trgm ({e}); la búsqueda por placa usará el índice b-tree.')
+            return
+        conn.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_vehiculos_placas_norm_trgm '
+            'ON vehiculos USING gin (placas_norm gin_trgm_ops)'
+        ))
+    elif conn.dialect.name == 'sqlite':
+        # Tabla FTS5 de contenido externo sincronizada con triggers
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS vehiculos_placas_fts USING fts5("
+            "placas_norm, content='vehiculos', content_rowid='id', tokenize='trigram')"
+        ))
+        conn.execute(text(
+            'CREATE TRIGGER IF NOT EXISTS vehiculos_placas_fts_ai AFTER INSERT ON vehiculos BEGIN '
+            'INSERT INTO vehiculos_placas_fts(rowid, placas_norm) VALUES (new.id, new.placas_norm); END'
+        ))
+        conn.execute(text(
+            'CREATE TRIGGER IF NOT EXISTS vehiculos_placas_fts_ad AFTER DELETE ON vehiculos BEGIN '
+            "INSERT INTO vehiculos_placas_fts(vehiculos_placas_fts, rowid, placas_norm) "
+            "VALUES ('delete', old.id, old.placas_norm); END"
+        ))
+        conn.execute(text(
+            'CREATE TRIGGER IF NOT EXISTS vehiculos_placas_fts_au AFTER UPDATE OF placas_norm ON vehiculos BEGIN '
+            "INSERT INTO vehiculos_placas_fts(vehiculos_placas_fts, rowid, placas_norm) "
+            "VALUES ('delete', old.id, old.placas_norm); "
+            'INSERT INTO vehiculos_placas_fts(rowid, placas_norm) VALUES (new.id, new.placas_norm); END'
+        ))
+        conn.execute(text("INSERT INTO vehiculos_placas_fts(vehiculos_placas_fts) VALUES ('rebuild')"))
+
+
+@migracion('0004_busqueda_texto')
+def _busqueda_texto(conn):
+    """Columna busqueda con índice de texto completo (GIN/tsvector en PostgreSQL, FTS5 en SQLite).
+    Contiene el texto normalizado de placas, chasis, motor, código ESBYE y custodio."""
+    from texto import CAMPOS_BUSQUEDA, texto_busqueda
+    agregar_columna(conn, 'vehiculos', 'busqueda', 'TEXT')
+    columnas = ', '.join(CAMPOS_BUSQUEDA)
+    filas = conn.execute(text(f'SELECT id, {columnas} FROM vehiculos WHERE busqueda IS NULL')).mappings().all()
+    if filas:
+        conn.execute(
+            text('UPDATE vehiculos SET busqueda = :busqueda WHERE id = :id'),
+            [{'id': f['id'], 'busqueda': texto_busqueda(f)} for f in filas]
+        )
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_vehiculos_busqueda_fts "
+            "ON vehiculos USING gin (to_tsvector('simple', coalesce(busqueda, '')))"
+        ))
+    elif conn.dialect.name == 'sqlite':
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS vehiculos_fts USING fts5("
+            "busqueda, content='vehiculos', content_rowid='id', tokenize='unicode61 remove_diacritics 2', "
+            "prefix='2 3 4')"
+        ))
+        conn.execute(text(
+            'CREATE TRIGGER IF NOT EXISTS vehiculos_fts_ai AFTER INSERT ON vehiculos BEGIN '
+            'INSERT INTO vehiculos_fts(rowid, busqueda) VALUES (new.id, new.busqueda); END'
+        ))
+        conn.execute(text(
+            'CREATE TRIGGER IF NOT EXISTS vehiculos_fts_ad AFTER DELETE ON vehiculos BEGIN '
+            "INSERT INTO vehiculos_fts(vehiculos_fts, rowid, busqueda) VALUES ('delete', old.id, old.busqueda); END"
+        ))
+        conn.execute(text(
+            'CREATE TRIGGER IF NOT EXISTS vehiculos_fts_au AFTER UPDATE OF busqueda ON vehiculos BEGIN '
+            "INSERT INTO vehiculos_fts(vehiculos_fts, rowid, busqueda) VALUES ('delete', old.id, old.busqueda); "
+            'INSERT INTO vehiculos_fts(rowid, busqueda) VALUES (new.id, new.busqueda); END'
+        ))
+        conn.execute(text("INSERT INTO vehiculos_fts(vehiculos_fts) VALUES ('rebuild')"))
+
+
+@migracion('0005_version_fila')
+def _version_fila(conn):
+    """Columna version (concurrencia optimista por fila), 1 para las filas existentes."""
+    agregar_columna(conn, 'vehiculos', 'version', 'INTEGER NOT NULL DEFAULT 1')
+
+
+@migracion('0006_indices_filtros')
+def _indices_filtros(conn):
+    """Índice compuesto (division, brigada, unidad, ord) para los filtros y el orden de las páginas."""
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_vehiculos_filtros ON vehiculos (division, brigada, unidad, ord)'
+    ))
+    # Estadísticas actualizadas para que el planificador elija el índice nuevo
+    conn.execute(text('ANALYZE vehiculos'))
+
+
+@migracion('0007_resumen_flota')
+def _resumen_flota(conn):
+    """Tabla resumen_flota (conteos y sumas por unidad y dimensión), calculada desde vehiculos."""
+    from models import ResumenFlota
+    from resumen import reconstruir_resumen
+    ResumenFlota.__table__.create(conn, checkfirst=True)
+    reconstruir_resumen(conn)
+
+
+@migracion('0008_columnas_numericas')
+def _columnas_numericas(conn):
+    """Columnas numéricas (año, pasajeros, tonelaje, cilindraje, valores) rellenadas desde el texto."""
+    from utils import COLUMNAS_NUMERICAS, COLUMNAS_ENTERAS
+    from texto import valor_numerico
+    for columna in COLUMNAS_NUMERICAS.values():
+        agregar_columna(conn, 'vehiculos', columna, 'INTEGER' if columna in COLUMNAS_ENTERAS else 'FLOAT')
+    campos = list(COLUMNAS_NUMERICAS)
+    filas = conn.execute(text(f"SELECT id, {', '.join(campos)} FROM vehiculos")).mappings().all()
+    if filas:
+        asignaciones = ', '.join(f'{columna} = :{columna}' for columna in COLUMNAS_NUMERICAS.values())
+        conn.execute(
+            text(f'UPDATE vehiculos SET {asignaciones} WHERE id = :id'),
+            [dict({columna: _numero(valor_numerico(f[campo]), columna in COLUMNAS_ENTERAS)
+                   for campo, columna in COLUMNAS_NUMERICAS.items()}, id=f['id']) for f in filas]
+        )
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_vehiculos_ano_num ON vehiculos (ano_num)'))
+
+
+@migracion('0009_historial_cambios')
+def _historial_cambios(conn):
+    """Tabla vehiculo_cambios (historial de ediciones e importaciones) con sus índices."""
+    from models import VehiculoCambio
+    VehiculoCambio.__table__.create(conn, checkfirst=True)
+
+
+@migracion('0010_feed_cambios')
+def _feed_cambios(conn):
+    """Columna cambio_seq con su índice y tabla vehiculo_bajas para el feed de cambios."""
+    from models import VehiculoBaja
+    agregar_columna(conn, 'vehiculos', 'cambio_seq', 'BIGINT NOT NULL DEFAULT 0')
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_vehiculos_cambio_seq ON vehiculos (cambio_seq, ord)'))
+    VehiculoBaja.__table__.create(conn, checkfirst=True)
+
+
+@migracion('0011_historial_por_campo')
+def _historial_por_campo(conn):
+    """Índice (campo, changed_at, ord) del historial para la flota en un instante; reemplaza al de changed_at."""
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_vehiculo_cambios_campo_changed_at '
+                      'ON vehiculo_cambios (campo, changed_at, ord)'))
+    conn.execute(text('DROP INDEX IF EXISTS ix_vehiculo_cambios_changed_at'))
+
+
+def _numero(valor, entero):
+    if valor is None:
+        return None
+    return int(round(valor)) if entero else valor
+
+
+def reiniciar_migraciones(engine):
+    """Olvida las migraciones aplicadas (tras drop_all/create_all) para que se vuelvan a ejecutar.
+    Son idempotentes: recrean índices, tablas auxiliares y triggers que no están en los modelos."""
+    with engine.begin() as conn:
+        conn.execute(text('DROP TABLE IF EXISTS schema_migraciones'))
+
+
+def aplicar_migraciones(engine):
+    """Aplica las migraciones pendientes. Devuelve la lista de ids aplicados."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migraciones ('
+            'id VARCHAR(64) PRIMARY KEY, aplicada_en TIMESTAMP)'
+        ))
+        aplicadas = {r[0] for r in conn.execute(text('SELECT id FROM schema_migraciones'))}
+
+    nuevas = []
+    for id_migracion, func in MIGRACIONES:
+        if id_migracion in aplicadas:
+            continue
+        with engine.begin() as conn:
+            func(conn)
+            conn.execute(
+                text('INSERT INTO schema_migraciones (id, aplicada_en) VALUES (:id, :ts)'),
+                {'id': id_migracion, 'ts': datetime.utcnow()}
+            )
+        descripcion = (func.__doc__ or '').strip().split('\n')[0]
+        print(f'Migración aplicada: {id_migracion} - {descripcion}')
+        nuevas.append(id_migracion)
+    return nuevas
@@ -1,11 +1,21 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import validates
 from datetime import datetime
 
+from texto import CAMPOS_BUSQUEDA, normalizar_placa, texto_busqueda
+
 db = SQLAlchemy()
 
 
 class Vehiculo(db.Model):
     __tablename__ = 'vehiculos'
+    __table_args__ = (
+        # Filtros jerárquicos de /api/vehiculos (división, división+brigada, las tres) con la página
+        # ordenada por ord, los DISTINCT de opciones y el GROUP BY del índice de filtros
+        db.Index('ix_vehiculos_filtros', 'division', 'brigada', 'unidad', 'ord'),
+        # Feed de cambios (/api/cambios): filas escritas después de una posición (cambio_seq, ord)
+        db.Index('ix_vehiculos_cambio_seq', 'cambio_seq', 'ord'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     ord = db.Column('ord', db.Integer, unique=True, nullable=False)
     clase_tipo = db.Column('clase_tipo', db.String(128))
@@ -16,6 +26,8 @@ class Vehiculo(db.Model):
     ano = db.Column('ano', db.String(128))  # Cambiado de Integer a String
     registro = db.Column('registro', db.String(128))
     placas = db.Column('placas', db.String(64))
+    # Placa normalizada (mayúsculas, solo A-Z0-9) para búsqueda por subcadena con índice
+    placas_norm = db.Column('placas_norm', db.String(64), index=True)
     color = db.Column('color', db.String(64))
     tonelaje = db.Column('tonelaje', db.String(64))
     cilindraje = db.Column('cilindraje', db.String(64))
@@ -36,8 +48,35 @@ class Vehiculo(db.Model):
     custodio = db.Column('custodio', db.String(256))
     observacion = db.Column('observacion', db.String(512))
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Hash del contenido de la fila en el Excel de origen (sincronización incremental)
+    hash_fila = db.Column('hash_fila', db.String(16))
+    # Texto normalizado (sin tildes, mayúsculas) de CAMPOS_BUSQUEDA para la búsqueda de texto
+    busqueda = db.Column('busqueda', db.Text)
+    # Versión de la fila para control de concurrencia optimista: cada escritura la incrementa y
+    # una edición que indica una versión distinta de la actual se rechaza (409)
+    version = db.Column('version', db.Integer, nullable=False, default=1, server_default='1')
+    # Versiones numéricas de los campos de texto (utils.COLUMNAS_NUMERICAS) para filtros de rango;
+    # las rellena la importación y quedan en NULL si el texto no es un número
+    ano_num = db.Column('ano_num', db.Integer, index=True)
+    num_pasajeros_num = db.Column('num_pasajeros_num', db.Integer)
+    tonelaje_num = db.Column('tonelaje_num', db.Float)
+    cilindraje_num = db.Column('cilindraje_num', db.Integer)
+    valor_esbye_num = db.Column('valor_esbye_num', db.Float)
+    valor_comercial_num = db.Column('valor_comercial_num', db.Float)
+    # Secuencia de cambios: la versión de datos (datos_version) de la transacción que escribió la
+    # fila por última vez. Crece con cada escritura y ordena el feed de cambios
+    cambio_seq = db.Column('cambio_seq', db.BigInteger, nullable=False, default=0, server_default='0')
+
+    @validates(*CAMPOS_BUSQUEDA)
+    def _sincronizar_columnas_busqueda(self, key, value):
+        # Mantiene placas_norm y busqueda al día cuando se editan por ORM
+        if key == 'placas':
+            self.placas_norm = normalizar_placa(value)
+        valores = {campo: getattr(self, campo) for campo in CAMPOS_BUSQUEDA}
+        valores[key] = value
+        self.busqueda = texto_busqueda(valores)
+        return value
 
-  
     def to_dict(self):
         return {
             'ORD': self.ord,
@@ -69,3 +108,75 @@ class Vehiculo(db.Model):
             'CUSTODIO': self.custodio or '',
             'OBSERVACION': self.observacion or ''
         }
+
+
+class ImportacionExcel(db.Model):
+    """Manifiesto de importaciones: huella del Excel importado y resultado de la carga."""
+    __tablename__ = 'importaciones'
+    id = db.Column(db.Integer, primary_key=True)
+    archivo = db.Column('archivo', db.String(256), nullable=False)
+    tamano = db.Column('tamano', db.BigInteger)
+    mtime = db.Column('mtime', db.Float)
+    sha256 = db.Column('sha256', db.String(64))
+    resultado = db.Column('resultado', db.String(256))
+    importado_en = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class DatosVersion(db.Model):
+    """Contador global de versión de los datos; se incrementa con cada escritura en vehiculos.
+    Todos los workers comparan su caché contra este valor (una consulta de una fila)."""
+    __tablename__ = 'datos_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column('version', db.BigInteger, nullable=False, default=0)
+    actualizado_en = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ResumenFlota(db.Model):
+    """Resumen materializado de la flota: por unidad (division, brigada, unidad) y por cada valor
+    de las dimensiones de resumen.DIMENSIONES, cantidad de vehículos y suma de sus valores.
+    Lo mantiene resumen.py (deltas al editar, reconstrucción al importar)."""
+    __tablename__ = 'resumen_flota'
+    division = db.Column('division', db.String(128), primary_key=True)
+    brigada = db.Column('brigada', db.String(128), primary_key=True)
+    unidad = db.Column('unidad', db.String(128), primary_key=True)
+    dimension = db.Column('dimension', db.String(32), primary_key=True)
+    valor = db.Column('valor', db.String(128), primary_key=True)
+    cantidad = db.Column('cantidad', db.Integer, nullable=False, default=0)
+    suma_valor_esbye = db.Column('suma_valor_esbye', db.Float, nullable=False, default=0)
+    suma_valor_comercial = db.Column('suma_valor_comercial', db.Float, nullable=False, default=0)
+
+
+class VehiculoCambio(db.Model):
+    """Historial de solo anexado de los cambios en vehiculos: una fila por campo modificado (con
+    el valor anterior y el nuevo), por alta o por baja. Lo escribe historial.py en la misma
+    transacción que la edición o la importación."""
+    __tablename__ = 'vehiculo_cambios'
+    __table_args__ = (
+        # Historial de un vehículo y su estado en un instante
+        db.Index('ix_vehiculo_cambios_ord_changed_at', 'ord', 'changed_at'),
+        # Estado de la flota en un instante: altas, bajas y cambios de un campo posteriores a una fecha
+        db.Index('ix_vehiculo_cambios_campo_changed_at', 'campo', 'changed_at', 'ord'),
+    )
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    ord = db.Column('ord', db.Integer, nullable=False)
+    changed_at = db.Column('changed_at', db.DateTime, nullable=False, default=datetime.utcnow)
+    # edicion, importacion, alta o baja (historial.TIPOS)
+    tipo = db.Column('tipo', db.String(16), nullable=False)
+    # Campo de vehiculos; NULL en las filas de alta y en la marca de una baja
+    campo = db.Column('campo', db.String(64))
+    valor_anterior = db.Column('valor_anterior', db.Text)
+    valor_nuevo = db.Column('valor_nuevo', db.Text)
+    # Versión de la fila tras una edición
+    version = db.Column('version', db.Integer)
+
+
+class VehiculoBaja(db.Model):
+    """Marca de borrado (tombstone) de un vehículo que una importación eliminó, para que el feed
+    de cambios informe la baja. Se quita si el ORD vuelve a importarse."""
+    __tablename__ = 'vehiculo_bajas'
+    __table_args__ = (
+        db.Index('ix_vehiculo_bajas_cambio_seq', 'cambio_seq', 'ord'),
+    )
+    ord = db.Column('ord', db.Integer, primary_key=True, autoincrement=False)
+    cambio_seq = db.Column('cambio_seq', db.BigInteger, nullable=False)
+    eliminado_en = db.Column('eliminado_en', db.DateTime, default=datetime.utcnow)
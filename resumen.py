@@ -0,0 +1,197 @@
+"""
+Resumen de la flota para tableros: cantidad de vehículos y suma de VALOR ESBYE / VALOR COMERCIAL
+por condición, estado, combustible o clase/tipo, en cada división, brigada y unidad.
+
+Los datos salen de la tabla resumen_flota (models.ResumenFlota), que guarda una fila por
+(division, brigada, unidad, dimensión, valor): consultarla es O(grupos) y no O(vehículos).
+La tabla se mantiene sin recorrer vehiculos en cada cambio:
+
+- al editar, aplicar_cambios_db llama a actualizar_resumen() en la misma transacción con la fila
+  antes y después del cambio; se restan sus aportes viejos y se suman los nuevos (upsert);
+- al importar, reconstruir_resumen() la recalcula completa en la transacción de la carga.
+
+consultar_resumen() agrupa con GROUP BY ROLLUP en PostgreSQL (subtotales por nivel y total
+general en una sola consulta); SQLite no tiene ROLLUP y se usa un UNION ALL de los GROUP BY.
+"""
+import pandas as pd
+
+from utils import models_db, cargar_datos, filtrar_df, COLUMNAS_DB, sentencia
+from texto import valor_numerico, valores_numericos
+
+NIVELES = ('division', 'brigada', 'unidad')
+DIMENSIONES = ('condicion', 'estado', 'combustible', 'clase_tipo')
+VALORES = ('valor_esbye', 'valor_comercial')
+# Columnas de vehiculos que necesita el resumen (y que aplicar_cambios_db lee antes de editar)
+COLUMNAS_RESUMEN = NIVELES + DIMENSIONES + VALORES
+CLAVE_RESUMEN = NIVELES + ('dimension', 'valor')
+
+SQL_UPSERT = (
+    "INSERT INTO resumen_flota (division, brigada, unidad, dimension, valor, cantidad, "
+    "suma_valor_esbye, suma_valor_comercial) "
+    "VALUES (:division, :brigada, :unidad, :dimension, :valor, :cantidad, :suma_valor_esbye, "
+    ":suma_valor_comercial) "
+    "ON CONFLICT (division, brigada, unidad, dimension, valor) DO UPDATE SET "
+    "cantidad = resumen_flota.cantidad + excluded.cantidad, "
+    "suma_valor_esbye = resumen_flota.suma_valor_esbye + excluded.suma_valor_esbye, "
+    "suma_valor_comercial = resumen_flota.suma_valor_comercial + excluded.suma_valor_comercial"
+)
+
+
+def _aportes(fila, signo, deltas):
+    """Suma a deltas lo que un vehículo (dict con COLUMNAS_RESUMEN) aporta a cada dimensión."""
+    base = tuple(fila.get(n) or '' for n in NIVELES)
+    esbye = valor_numerico(fila.get('valor_esbye')) or 0.0
+    comercial = valor_numerico(fila.get('valor_comercial')) or 0.0
+    for dimension in DIMENSIONES:
+        clave = base + (dimension, fila.get(dimension) or '')
+        cantidad, suma_esbye, suma_comercial = deltas.get(clave, (0, 0.0, 0.0))
+        deltas[clave] = (cantidad + signo, suma_esbye + signo * esbye, suma_comercial + signo * comercial)
+
+
+def _agregar_df(df):
+    """Filas de resumen_flota (dicts) a partir de un DataFrame con las COLUMNAS_RESUMEN."""
+    df = df.reindex(columns=list(COLUMNAS_RESUMEN)).fillna('').astype(str)
+    df['valor_esbye'] = valores_numericos(df['valor_esbye']).fillna(0.0)
+    df['valor_comercial'] = valores_numericos(df['valor_comercial']).fillna(0.0)
+    partes = []
+    for dimension in DIMENSIONES:
+        grupos = df.groupby(list(NIVELES) + [dimension], sort=False).agg(
+            cantidad=('valor_esbye', 'size'),
+            suma_valor_esbye=('valor_esbye', 'sum'),
+            suma_valor_comercial=('valor_comercial', 'sum'),
+        ).reset_index().rename(columns={dimension: 'valor'})
+        grupos.insert(3, 'dimension', dimension)
+        partes.append(grupos)
+    if not partes:
+        return []
+    return pd.concat(partes, ignore_index=True).to_dict(orient='records')
+
+
+def reconstruir_resumen(conn):
+    """Recalcula resumen_flota completa desde vehiculos (en la transacción de conn)."""
+    df = pd.DataFrame(conn.execute(sentencia(f"SELECT {', '.join(COLUMNAS_RESUMEN)} FROM vehiculos")).all(),
+                      columns=list(COLUMNAS_RESUMEN))
+    filas = _agregar_df(df)
+    conn.execute(sentencia('DELETE FROM resumen_flota'))
+    if filas:
+        conn.execute(sentencia(
+            'INSERT INTO resumen_flota (division, brigada, unidad, dimension, valor, cantidad, '
+            'suma_valor_esbye, suma_valor_comercial) VALUES (:division, :brigada, :unidad, :dimension, '
+            ':valor, :cantidad, :suma_valor_esbye, :suma_valor_comercial)'
+        ), filas)
+    return len(filas)
+
+
+def actualizar_resumen(conn, antes, despues):
+    """
+    Aplica a resumen_flota la diferencia entre las filas antes y después de un lote de ediciones
+    (listas de dicts con COLUMNAS_RESUMEN, en el mismo orden). Solo se escriben los grupos cuyo
+    aporte cambió; los que quedan sin vehículos se borran.
+    """
+    deltas = {}
+    for viejo, nuevo in zip(antes, despues):
+        if any((viejo.get(c) or '') != (nuevo.get(c) or '') for c in COLUMNAS_RESUMEN):
+            _aportes(viejo, -1, deltas)
+            _aportes(nuevo, 1, deltas)
+    filas = [
+        dict(zip(CLAVE_RESUMEN, clave), cantidad=cantidad, suma_valor_esbye=esbye, suma_valor_comercial=comercial)
+        # Siempre en el mismo orden, para que dos lotes que tocan los mismos grupos no se interbloqueen
+        for clave, (cantidad, esbye, comercial) in sorted(deltas.items(), key=lambda d: tuple(map(str, d[0])))
+        if cantidad or esbye or comercial
+    ]
+    if not filas:
+        return 0
+    if conn.dialect.name in ('postgresql', 'sqlite'):
+        conn.execute(sentencia(SQL_UPSERT), filas)
+        conn.execute(sentencia('DELETE FROM resumen_flota WHERE cantidad <= 0'))
+    else:
+        reconstruir_resumen(conn)
+    return len(filas)
+
+
+def sql_resumen(dialecto, por, niveles, filtros):
+    """SQL y parámetros del resumen con subtotales: ROLLUP en PostgreSQL, UNION ALL en los demás."""
+    where = " WHERE dimension = :dimension"
+    params = {'dimension': por}
+    for nivel, valor in filtros.items():
+        where += f" AND {nivel} = :{nivel}"
+        params[nivel] = valor
+    sumas = ("SUM(cantidad) AS cantidad, SUM(suma_valor_esbye) AS valor_esbye, "
+             "SUM(suma_valor_comercial) AS valor_comercial")
+    columnas = list(niveles) + ['valor']
+    if dialecto == 'postgresql':
+        agrupadas = ', '.join(columnas)
+        return (f"SELECT {agrupadas}, {sumas} FROM resumen_flota{where} GROUP BY ROLLUP ({agrupadas})",
+                params)
+    consultas = []
+    for n in range(len(columnas), -1, -1):
+        seleccion = columnas[:n] + [f'NULL AS {c}' for c in columnas[n:]]
+        agrupar = f" GROUP BY {', '.join(columnas[:n])}" if n else ''
+        consultas.append(f"SELECT {', '.join(seleccion)}, {sumas} FROM resumen_flota{where}{agrupar}")
+    return ' UNION ALL '.join(consultas), params
+
+
+def _resumen_df(por, niveles, filtros):
+    """Mismas filas que sql_resumen, calculadas con pandas sobre cargar_datos() (sin DB)."""
+    df = filtrar_df(cargar_datos(), **{n: filtros.get(n) for n in NIVELES})
+    df = df.rename(columns={col: campo for col, campo in COLUMNAS_DB.items() if campo in COLUMNAS_RESUMEN})
+    detalle = pd.DataFrame(_agregar_df(df))
+    if detalle.empty:
+        return []
+    detalle = detalle[detalle['dimension'] == por]
+    columnas = list(niveles) + ['valor']
+    filas = []
+    for n in range(len(columnas), -1, -1):
+        sumas = detalle[['cantidad', 'suma_valor_esbye', 'suma_valor_comercial']]
+        grupos = sumas.groupby([detalle[c] for c in columnas[:n]]).sum() if n else sumas.sum().to_frame().T
+        for clave, fila in grupos.iterrows():
+            clave = clave if isinstance(clave, tuple) else (clave,)
+            valores = dict(zip(columnas, list(clave[:n]) + [None] * (len(columnas) - n)))
+            filas.append((*(valores[c] for c in columnas), fila['cantidad'], fila['suma_valor_esbye'],
+                          fila['suma_valor_comercial']))
+    return filas
+
+
+def consultar_resumen(por, nivel='division', division=None, brigada=None, unidad=None):
+    """
+    Cantidad de vehículos y suma de valores por cada valor de `por` (una de DIMENSIONES) en cada
+    grupo del nivel pedido (division, brigada o unidad), con subtotales de cada nivel superior y
+    el total general. En las filas de subtotal las columnas agregadas valen None y 'subtotal'
+    indica el nivel que totalizan ('total' para el general).
+    """
+    if por not in DIMENSIONES:
+        raise ValueError(f"'por' debe ser uno de: {', '.join(DIMENSIONES)}")
+    if nivel not in NIVELES:
+        raise ValueError(f"'nivel' debe ser uno de: {', '.join(NIVELES)}")
+    niveles = NIVELES[:NIVELES.index(nivel) + 1]
+    filtros = {n: v for n, v in zip(NIVELES, (division, brigada, unidad)) if v}
+
+    filas = None
+    if models_db is not None:
+        try:
+            dialecto = str(models_db.engine.url.get_backend_name()).lower()
+            sql, params = sql_resumen(dialecto, por, niveles, filtros)
+            with models_db.engine.connect() as conn:
+                filas = conn.execute(sentencia(sql), params).all()
+        except Exception as e:
+            print(f'Advertencia: no se pudo consultar resumen_flota ({e}); se calcula con pandas')
+    if filas is None:
+        filas = _resumen_df(por, niveles, filtros)
+
+    columnas = list(niveles) + ['valor']
+    grupos = []
+    for fila in filas:
+        claves = fila[:len(columnas)]
+        cantidad, esbye, comercial = fila[len(columnas):]
+        if not cantidad:
+            continue
+        grupo = {c if c != 'valor' else por: v for c, v in zip(columnas, claves)}
+        if claves[-1] is None:
+            agregados = [c for c, v in zip(niveles, claves) if v is not None]
+            grupo['subtotal'] = agregados[-1] if agregados else 'total'
+        grupo.update(cantidad=int(cantidad), valor_esbye=round(float(esbye or 0), 2),
+                     valor_comercial=round(float(comercial or 0), 2))
+        grupos.append(grupo)
+    # Cada grupo seguido de sus subtotales (None al final de cada nivel)
+    grupos.sort(key=lambda g: [(g.get(c) is None, g.get(c) or '') for c in list(niveles) + [por]])
+    return grupos
@@ -1,9 +1,17 @@
 from app import create_app
 from utils import guardar_excel_en_db
+import argparse
 import os
 
 def main():
-    app = create_app()
+    parser = argparse.ArgumentParser(description='Importa la hoja DETALLE del Excel a la base de datos.')
+    parser.add_argument('--completa', action='store_true',
+                        help='Elimina y recrea las tablas y recarga todo (por defecto: sincronización incremental)')
+    parser.add_argument('--forzar', action='store_true',
+                        help='Importa aunque el Excel no haya cambiado desde la última importación')
+    args = parser.parse_args()
+
+    app = create_app(cargar_filtros=False)
     
     # Verificar qué base de datos se está usando
     db_uri = app.config.get("SQLALCHEMY_DATABASE_URI")
@@ -20,17 +28,20 @@ def main():
     print('✓ Usando PostgreSQL correctamente')
     
     with app.app_context():
-        # Recrear las tablas
-        print('\nRecreando tablas con la nueva estructura...')
         from models import db, Vehiculo
+        from migraciones import aplicar_migraciones, reiniciar_migraciones
         
         try:
-            # Eliminar todas las tablas existentes y recrearlas
-            print('Eliminando tablas antiguas...')
-            db.drop_all()
-            print('Creando tablas nuevas...')
+            if args.completa:
+                # Eliminar todas las tablas existentes y recrearlas
+                print('\nRecreando tablas con la nueva estructura...')
+                print('Eliminando tablas antiguas...')
+                db.drop_all()
+                reiniciar_migraciones(db.engine)
+            print('Creando tablas (si no existen)...')
             db.create_all()
-            print('✓ Tablas creadas correctamente en PostgreSQL.')
+            aplicar_migraciones(db.engine)
+            print('✓ Tablas listas en PostgreSQL.')
         except Exception as e:
             print(f'\n❌ Error al crear tablas en PostgreSQL: {e}')
             import traceback
@@ -53,7 +64,10 @@ def main():
         
         try:
             print('\nIniciando importación desde Excel...')
-            resultado = guardar_excel_en_db(force=True)
+            if args.completa:
+                resultado = guardar_excel_en_db(force=True)
+            else:
+                resultado = guardar_excel_en_db(sincronizar=True, solo_si_cambio=not args.forzar)
             print('\n' + '='*50)
             print('Importación completada:', resultado)
             print('='*50)
@@ -1,7 +1,7 @@
 #!/bin/bash
+# Crea/migra las tablas y sincroniza con el Excel. Si el Excel no cambió desde la
+# última importación (manifiesto en la tabla importaciones) no se vuelve a leer.
 python init_db.py
-# Inicializa la base de datos leyendo el Excel
-python run_import.py
 
 # Inicia la aplicación principal
 python app.py
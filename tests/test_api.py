@@ -0,0 +1,45 @@
+"""
+Rutas de la API: /api/metricas solo con sesión iniciada; /api/filtros/* responden los conteos y,
+si el índice de filtros falla, un 500 en JSON.
+"""
+import importlib
+
+import pytest
+
+from conftest import TOTAL_FLOTA
+
+RUTAS_FILTROS = ['/api/filtros/divisiones', '/api/filtros/brigadas?division=D1',
+                 '/api/filtros/unidades?division=D1&brigada=B1']
+
+
+def test_metricas_requiere_sesion(cliente):
+    respuesta = cliente.get('/api/metricas')
+    assert respuesta.status_code == 401
+    assert 'pid' not in respuesta.get_json()
+
+
+def test_metricas_con_sesion(cliente):
+    with cliente.session_transaction() as sesion:
+        sesion['logged_in'] = True
+    respuesta = cliente.get('/api/metricas')
+    assert respuesta.status_code == 200
+    assert {'pid', 'cache', 'exportaciones'} <= set(respuesta.get_json())
+
+
+def test_filtros_en_cascada(cliente):
+    divisiones = cliente.get('/api/filtros/divisiones').get_json()
+    assert divisiones['total'] == TOTAL_FLOTA
+    assert sum(o['cantidad'] for o in divisiones['opciones']) == TOTAL_FLOTA
+    brigadas = cliente.get('/api/filtros/brigadas?division=D1').get_json()
+    assert sum(o['cantidad'] for o in brigadas['opciones']) == brigadas['total'] == TOTAL_FLOTA // 3
+
+
+@pytest.mark.parametrize('ruta', RUTAS_FILTROS)
+def test_filtros_con_error_devuelven_500(cliente, monkeypatch, ruta):
+    def fallar():
+        raise RuntimeError('índice no disponible')
+
+    monkeypatch.setattr(importlib.import_module('app'), 'obtener_indice_filtros', fallar)
+    respuesta = cliente.get(ruta)
+    assert respuesta.status_code == 500
+    assert respuesta.get_json() == {'error': 'error interno'}
@@ -0,0 +1,112 @@
+"""
+Edición concurrente (edicion.aplicar_cambios): lotes de ORD distintos confirman los dos, una
+versión vieja da 'conflicto' (409 en /editar_vehiculo) y, en PostgreSQL, una edición en curso
+no bloquea la de otro ORD.
+"""
+import threading
+
+import pytest
+from sqlalchemy import text
+
+import edicion
+from edicion import aplicar_cambios
+
+
+def version_de(ord_val):
+    from models import db
+    with db.engine.connect() as conn:
+        return conn.execute(text('SELECT version FROM vehiculos WHERE ord = :o'), {'o': ord_val}).scalar()
+
+
+def en_hilos(app, *funciones):
+    """Ejecuta las funciones a la vez (cada una en su hilo y su contexto) y devuelve sus resultados."""
+    resultados = [None] * len(funciones)
+    errores = []
+    salida = threading.Barrier(len(funciones))
+
+    def correr(i, funcion):
+        try:
+            with app.app_context():
+                salida.wait()
+                resultados[i] = funcion()
+        except Exception as e:
+            errores.append(e)
+
+    hilos = [threading.Thread(target=correr, args=(i, f)) for i, f in enumerate(funciones)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join(timeout=30)
+    assert not errores, errores
+    return resultados
+
+
+def test_lotes_concurrentes_de_ord_distintos_confirman(app, cliente):
+    primero, segundo = [11, 12, 13], [21, 22, 23]
+    versiones = {o: version_de(o) for o in primero + segundo}
+
+    def lote(ords, estado):
+        return cliente.post('/api/vehiculos/batch', json=[
+            {'ord': o, 'estado': estado, 'version': versiones[o]} for o in ords])
+
+    respuestas = en_hilos(app, lambda: lote(primero, 'REVISADO A'), lambda: lote(segundo, 'REVISADO B'))
+    for respuesta in respuestas:
+        assert respuesta.status_code == 200
+        assert [r['resultado'] for r in respuesta.get_json()['resultados']] == ['actualizado'] * 3
+    for o in primero + segundo:
+        assert version_de(o) == versiones[o] + 1
+
+
+def test_version_vieja_en_lote_da_conflicto(app, cliente):
+    actual = version_de(31)
+    assert cliente.post('/api/vehiculos/batch', json=[{'ord': 31, 'estado': 'X', 'version': actual}]).status_code == 200
+    respuesta = cliente.post('/api/vehiculos/batch', json=[{'ord': 31, 'estado': 'Y', 'version': actual}])
+    resultado = respuesta.get_json()['resultados'][0]
+    assert resultado['resultado'] == 'conflicto'
+    assert resultado['version_actual'] == actual + 1
+    assert version_de(31) == actual + 1
+
+
+def test_version_vieja_en_formulario_da_409(app, cliente):
+    actual = version_de(32)
+    datos = {'ord': '32', 'estado': 'X', 'condicion': 'OPERABLE', 'version': str(actual)}
+    assert cliente.post('/editar_vehiculo', data=datos).status_code == 302
+    assert cliente.post('/editar_vehiculo', data=dict(datos, estado='Y')).status_code == 409
+    assert version_de(32) == actual + 1
+
+
+def test_edicion_en_curso_no_bloquea_otro_ord(app, monkeypatch):
+    from models import db
+    if db.engine.dialect.name != 'postgresql':
+        pytest.skip('en SQLite las transacciones de escritura son exclusivas')
+    pausada = threading.Event()
+    continuar = threading.Event()
+    registrar = edicion.registrar_ediciones
+
+    def registrar_y_esperar(conn, antes, despues, versiones, ahora):
+        # El lote del ORD 41 queda a mitad de su transacción, con su fila bloqueada
+        if 41 in versiones:
+            pausada.set()
+            continuar.wait(30)
+        return registrar(conn, antes, despues, versiones, ahora)
+
+    monkeypatch.setattr(edicion, 'registrar_ediciones', registrar_y_esperar)
+    resultados = {}
+
+    def editar(ord_val):
+        with app.app_context():
+            resultados[ord_val] = aplicar_cambios([{'ord': ord_val, 'estado': 'EN CURSO'}])[0]['resultado']
+
+    primero = threading.Thread(target=editar, args=(41,))
+    primero.start()
+    try:
+        assert pausada.wait(30)
+        segundo = threading.Thread(target=editar, args=(42,))
+        segundo.start()
+        segundo.join(timeout=10)
+        assert not segundo.is_alive(), 'la edición del ORD 42 esperó a la del 41'
+        assert resultados[42] == 'actualizado'
+    finally:
+        continuar.set()
+        primero.join(timeout=30)
+    assert resultados[41] == 'actualizado'
@@ -0,0 +1,55 @@
+"""
+Planes de las consultas calientes (EXPLAIN, con los helpers de verificar_indices.py): las páginas y
+conteos por división / brigada / unidad, el índice de filtros y el feed de cambios deben usar
+ix_vehiculos_filtros e ix_vehiculos_cambio_seq, nunca un recorrido de la tabla vehiculos.
+"""
+import pytest
+
+from utils import sql_vehiculos, SQL_SELECT_API
+from filtros import SQL_INDICE
+from cambios import SQL_FEED_VEHICULOS
+from verificar_indices import consultas_api, plan_sqlite, plan_postgresql
+
+
+def plan(conn, sql, params):
+    explicar = plan_postgresql if conn.dialect.name == 'postgresql' else plan_sqlite
+    return explicar(conn, sql, params)
+
+
+@pytest.fixture
+def conn(app):
+    from models import db
+    with db.engine.connect() as conexion:
+        yield conexion
+
+
+@pytest.mark.parametrize('filtros', [
+    {'division': 'D1'},
+    {'division': 'D1', 'brigada': 'B2'},
+    {'division': 'D1', 'brigada': 'B2', 'unidad': 'U3'},
+])
+def test_pagina_por_filtros_usa_ix_vehiculos_filtros(conn, filtros):
+    sql, params = sql_vehiculos(SQL_SELECT_API, conn.dialect.name, limit=51, **filtros)
+    lineas, secuencial = plan(conn, sql, params)
+    assert not secuencial, lineas
+    assert any('ix_vehiculos_filtros' in l for l in lineas), lineas
+
+
+def test_indice_de_filtros_usa_ix_vehiculos_filtros(conn):
+    lineas, secuencial = plan(conn, SQL_INDICE, {})
+    assert not secuencial, lineas
+    assert any('ix_vehiculos_filtros' in l for l in lineas), lineas
+
+
+def test_feed_de_cambios_usa_ix_vehiculos_cambio_seq(conn):
+    params = {'seq': 1, 'ord': 0, 'hasta': 2 ** 40, 'limit': 501}
+    lineas, secuencial = plan(conn, SQL_FEED_VEHICULOS, params)
+    assert not secuencial, lineas
+    assert any('ix_vehiculos_cambio_seq' in l for l in lineas), lineas
+
+
+def test_ninguna_consulta_de_la_api_recorre_la_tabla(conn):
+    consultas = consultas_api(conn)
+    assert consultas
+    secuenciales = [nombre for nombre, sql, params in consultas if plan(conn, sql, params)[1]]
+    assert secuenciales == []
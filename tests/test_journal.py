@@ -0,0 +1,25 @@
+"""
+Journal de ediciones del Excel (journal.leer_journal): las líneas truncadas o mal formadas se
+ignoran sin perder las válidas.
+"""
+import json
+
+from journal import leer_journal, ruta_journal
+
+
+def test_lineas_invalidas_se_ignoran(tmp_path, capsys):
+    excel = str(tmp_path / 'flota.xlsx')
+    lineas = [
+        json.dumps({'ord': 1, 'campos': {'ESTADO': 'BUENO'}}),
+        json.dumps({'campos': {'ESTADO': 'SIN ORD'}}),
+        json.dumps({'ord': 'abc', 'campos': {'ESTADO': 'ORD NO NUMÉRICO'}}),
+        json.dumps({'ord': 2, 'campos': ['ESTADO']}),
+        json.dumps({'ord': 3}),
+        json.dumps([4, {'ESTADO': 'LISTA'}]),
+        json.dumps({'ord': '1', 'campos': {'CUSTODIO': 'PÉREZ'}}),
+        '{"ord": 5, "campos": {"EST',
+    ]
+    with open(ruta_journal(excel), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lineas))
+    assert leer_journal(excel) == {1: {'ESTADO': 'BUENO', 'CUSTODIO': 'PÉREZ'}}
+    assert '6 líneas inválidas' in capsys.readouterr().out
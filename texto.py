@@ -0,0 +1,117 @@
+"""
+Normalización de texto compartida por models.py, utils.py y la importación.
+
+Vive aparte porque utils importa models: aquí no se importa ninguno de los dos.
+"""
+import re
+import unicodedata
+
+# Caracteres que se eliminan al normalizar una placa (" abc-123 " -> "ABC123")
+PLACA_NO_ALFANUM = r'[^A-Z0-9]'
+
+# Campos de Vehiculo indexados para la búsqueda de texto (parámetro q de /api/vehiculos)
+CAMPOS_BUSQUEDA = ['placas', 'chasis', 'motor', 'codigo_esbye', 'custodio']
+
+
+def quitar_tildes(texto):
+    """Quita tildes y diacríticos (NFD sin marcas combinantes), como normalizar_columna."""
+    return ''.join(
+        c for c in unicodedata.normalize('NFD', texto)
+        if unicodedata.category(c) != 'Mn'
+    )
+
+
+def normalizar_placa(placa):
+    """Normaliza una placa (o texto de búsqueda) igual que limpiar_nans normaliza PLACAS."""
+    return re.sub(PLACA_NO_ALFANUM, '', str(placa or '').upper())
+
+
+def normalizar_placas(serie):
+    """Versión vectorizada de normalizar_placa para una Serie de pandas."""
+    return serie.fillna('').astype(str).str.upper().str.replace(PLACA_NO_ALFANUM, '', regex=True)
+
+
+def terminos_busqueda(texto):
+    """Divide un texto en términos sin tildes, en mayúsculas y solo alfanuméricos."""
+    return [t for t in re.split(r'[^A-Z0-9]+', quitar_tildes(str(texto or '')).upper()) if t]
+
+
+def patron_termino(termino):
+    """
+    Expresión regular que busca un término como prefijo de alguna palabra del texto indexado,
+    igual que la búsqueda de la DB ("TERM"* en FTS5, TERM:* en PostgreSQL).
+    """
+    return r'(?:^| )' + re.escape(termino)
+
+
+def texto_busqueda(valores):
+    """
+    Texto indexado de un vehículo a partir de un dict campo -> valor de CAMPOS_BUSQUEDA.
+    Incluye cada término por separado y, si un valor tiene varios, también la forma compacta
+    ("PEI-1382" -> "PEI 1382 PEI1382") para que coincidan las búsquedas con y sin guiones.
+    """
+    partes = []
+    for campo in CAMPOS_BUSQUEDA:
+        terminos = terminos_busqueda(valores.get(campo))
+        partes.extend(terminos)
+        if len(terminos) > 1 and campo != 'custodio':
+            partes.append(''.join(terminos))
+    return ' '.join(partes)
+
+
+def texto_busqueda_serie(df):
+    """Versión vectorizada de texto_busqueda para un DataFrame con las columnas de CAMPOS_BUSQUEDA."""
+    partes = []
+    for campo in CAMPOS_BUSQUEDA:
+        valor = df[campo].fillna('').astype(str) if campo in df.columns else None
+        if valor is None:
+            continue
+        valor = (valor.str.normalize('NFD').str.replace('[\u0300-\u036f]', '', regex=True)
+                 .str.upper())
+        palabras = valor.str.replace(r'[^A-Z0-9]+', ' ', regex=True).str.strip()
+        partes.append(palabras)
+        if campo != 'custodio':
+            compacto = valor.str.replace(r'[^A-Z0-9]', '', regex=True)
+            # Solo si el valor tenía varios términos (si no, repetiría la misma palabra)
+            partes.append(compacto.where(palabras.str.contains(' ', regex=False), ''))
+    if not partes:
+        return ''
+    resultado = partes[0]
+    for p in partes[1:]:
+        resultado = resultado + ' ' + p
+    return resultado.str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+def valor_numerico(texto):
+    """
+    Convierte un valor monetario del Excel en número: '10014.4', '12,345.67', '$ 12.345,67' o
+    '1.234.567'. Con coma y punto, el último es el decimal; una coma sola es de miles solo si
+    separa grupos de 3 dígitos.
+    Devuelve None si el texto no contiene un número.
+    """
+    limpio = re.sub(r'[^0-9,.\-]', '', str(texto or ''))
+    if not re.search(r'\d', limpio):
+        return None
+    if ',' in limpio and '.' in limpio:
+        if limpio.rfind(',') > limpio.rfind('.'):
+            limpio = limpio.replace('.', '').replace(',', '.')
+        else:
+            limpio = limpio.replace(',', '')
+    elif ',' in limpio:
+        # 12,345 (miles) frente a 12,5 (decimal)
+        if re.fullmatch(r'-?\d{1,3}(,\d{3})+', limpio):
+            limpio = limpio.replace(',', '')
+        else:
+            limpio = limpio.replace(',', '.')
+    elif limpio.count('.') > 1:
+        limpio = limpio.replace('.', '')
+    try:
+        return float(limpio)
+    except ValueError:
+        return None
+
+
+def valores_numericos(serie):
+    """valor_numerico sobre una Serie de pandas (se convierte cada valor distinto una sola vez)."""
+    serie = serie.fillna('').astype(str)
+    return serie.map({v: valor_numerico(v) for v in serie.unique()}).astype(float)
@@ -1,9 +1,32 @@
 import pandas as pd
-import unicodedata
 import re
 from flask import current_app
 import os
 import time
+import threading
+import hashlib
+import glob
+import pickle
+import json
+import base64
+from collections import OrderedDict
+from functools import lru_cache
+
+from texto import (quitar_tildes, normalizar_placa, normalizar_placas, terminos_busqueda, patron_termino,
+                   texto_busqueda_serie, valores_numericos)
+from journal import leer_journal, aplicar_overlay
+
+# pyarrow es opcional: si está instalado, los snapshots se guardan en Feather (memory-mapped)
+try:
+    import pyarrow.feather as feather
+except Exception:
+    feather = None
+
+# text() va fuera del bloque de models: si models falla, el modo sin DB sigue importando utils
+try:
+    from sqlalchemy import text
+except Exception:
+    text = None
 
 try:
     from models import Vehiculo, db as models_db
@@ -15,11 +38,22 @@ except Exception:
         Vehiculo = None
         models_db = None
 
-# Caché simple en memoria para lecturas desde DB
-_DB_CACHE = {'df': None, 'ts': 0}
-_DEFAULT_TTL = 10  # segundos; configurable desde current_app.config['DB_CACHE_TTL']
+# Caché en memoria de lecturas desde DB, validada contra la versión global de datos
+# (tabla datos_version). Cada worker guarda su copia del DataFrame y solo la recarga
+# cuando otra escritura (de cualquier worker o de una importación) incrementó la versión.
+_DB_CACHE = {'df': None, 'version_df': None, 'version': None, 'verificado': 0}
+_CACHE_STATS = {'hits': 0, 'misses': 0, 'reloads': 0, 'revalidaciones': 0, 'totales_hits': 0, 'totales_misses': 0}
+# LRU de totales por filtro: (filtros normalizados, versión de datos) -> total
+_TOTALES = OrderedDict()
+_TOTALES_MAX = 256
+# Los hilos de un worker comparten el LRU: lecturas, reordenamientos y expulsiones bajo este candado
+_TOTALES_GUARDA = threading.Lock()
+# Segundos entre consultas de versión; configurable desde current_app.config['DB_VERSION_CHECK_INTERVAL']
+_DEFAULT_VERSION_CHECK_INTERVAL = 1.0
 
 EXCEL_FILE = 'transportes2025.xlsx'
+# Directorio de snapshots binarios del Excel normalizado (derivados, se regeneran solos)
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', '.cache')
 COLUMNAS = [
     'ORD', 'CLASE / TIPO', 'MARCA', 'MODELO', 'CHASIS', 'MOTOR', 'ANO', 'REGISTRO',
     'PLACAS', 'COLOR', 'TONELAJE', 'CILINDRAJE', 'COMBUSTIBLE', '# PASAJ',
@@ -28,12 +62,49 @@ COLUMNAS = [
     'EOD', 'DIGITO', 'MATRICULA 2025', 'CUSTODIO', 'OBSERVACION'
 ]
 
+# Columna normalizada del Excel -> columna de la tabla vehiculos (mismo orden que COLUMNAS)
+COLUMNAS_DB = {
+    'ORD': 'ord', 'CLASE / TIPO': 'clase_tipo', 'MARCA': 'marca', 'MODELO': 'modelo',
+    'CHASIS': 'chasis', 'MOTOR': 'motor', 'ANO': 'ano', 'REGISTRO': 'registro',
+    'PLACAS': 'placas', 'COLOR': 'color', 'TONELAJE': 'tonelaje', 'CILINDRAJE': 'cilindraje',
+    'COMBUSTIBLE': 'combustible', '# PASAJ': 'num_pasajeros', 'VALOR ESBYE': 'valor_esbye',
+    'VALOR COMERCIAL': 'valor_comercial', 'DIVISION': 'division', 'BRIGADA': 'brigada',
+    'UNIDAD': 'unidad', 'NECESIDAD OPERACIONAL FT': 'necesidad_operacional_ft',
+    'CONDICION': 'condicion', 'ESTADO': 'estado', 'CODIGO ESBYE': 'codigo_esbye',
+    'EOD': 'eod', 'DIGITO': 'digito', 'MATRICULA 2025': 'matricula_2025',
+    'CUSTODIO': 'custodio', 'OBSERVACION': 'observacion'
+}
+
+# Columnas tipadas (sombra) de los campos numéricos que se guardan como texto: el texto original
+# se conserva y la importación rellena la versión numérica (None si no se puede interpretar)
+COLUMNAS_NUMERICAS = {
+    'ano': 'ano_num', 'num_pasajeros': 'num_pasajeros_num', 'tonelaje': 'tonelaje_num',
+    'cilindraje': 'cilindraje_num', 'valor_esbye': 'valor_esbye_num', 'valor_comercial': 'valor_comercial_num',
+}
+COLUMNAS_ENTERAS = {'ano_num', 'num_pasajeros_num', 'cilindraje_num'}
+# Filtros de rango de /api/vehiculos (<nombre>_min / <nombre>_max) -> campo de COLUMNAS_NUMERICAS
+RANGOS = {
+    'ano': 'ano', 'pasajeros': 'num_pasajeros', 'tonelaje': 'tonelaje', 'cilindraje': 'cilindraje',
+    'valor_esbye': 'valor_esbye', 'valor_comercial': 'valor_comercial',
+}
+# Columnas de pocos valores distintos que los DataFrames en memoria guardan como category
+COLUMNAS_CATEGORICAS = ['DIVISION', 'CONDICION', 'ESTADO', 'COMBUSTIBLE', 'COLOR']
+
+def huella_archivo(path, con_hash=True):
+    """Huella de un archivo: tamaño, mtime y (opcional) SHA-256 del contenido."""
+    st = os.stat(path)
+    huella = {'archivo': os.path.basename(path), 'tamano': st.st_size, 'mtime': st.st_mtime, 'sha256': None}
+    if con_hash:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for bloque in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(bloque)
+        huella['sha256'] = sha.hexdigest()
+    return huella
+
 def normalizar_columna(col):
     # Quita tildes, pasa a mayúsculas, elimina espacios extra y caracteres especiales
-    col = ''.join(
-        c for c in unicodedata.normalize('NFD', col)
-        if unicodedata.category(c) != 'Mn'
-    )
+    col = quitar_tildes(col)
     col = col.upper().strip()
     col = re.sub(r'\s+', ' ', col)  # Reemplaza múltiples espacios por uno
     col = col.replace('Á', 'A').replace('É', 'E').replace('Í', 'I').replace('Ó', 'O').replace('Ú', 'U')
@@ -48,20 +119,72 @@ def cargar_datos():
     # Si hay una app y modelos disponibles, intentar leer desde la DB (rápido)
     try:
         if Vehiculo is not None and current_app and current_app.config.get('SQLALCHEMY_DATABASE_URI'):
-            # Usar caché para lecturas repetidas
-            ttl = current_app.config.get('DB_CACHE_TTL', _DEFAULT_TTL)
-            now = time.time()
-            if _DB_CACHE['df'] is not None and (now - _DB_CACHE['ts'] < ttl):
+            # Usar caché mientras la versión de datos no cambie
+            version = version_datos_vigente()
+            if _DB_CACHE['df'] is not None and _DB_CACHE['version_df'] == version:
+                _CACHE_STATS['hits'] += 1
                 return _DB_CACHE['df']
-            df = df_from_db()
+            _CACHE_STATS['misses' if _DB_CACHE['df'] is None else 'reloads'] += 1
+            df = categorizar(df_from_db())
             _DB_CACHE['df'] = df
-            _DB_CACHE['ts'] = now
+            _DB_CACHE['version_df'] = version
             return df
     except Exception:
         pass
 
-    # Fallback: leer Excel - usar específicamente la hoja "DETALLE"
-    df = pd.read_excel(EXCEL_FILE, sheet_name='DETALLE', header=0, dtype={'MATRICULA 2025': str})
+    # Fallback: snapshot binario del Excel; solo se parsea el .xlsx si el archivo cambió.
+    # Las ediciones aún no compactadas del journal se aplican encima. El journal se lee antes
+    # que el Excel para no perder entradas si justo se está compactando (ver journal.py).
+    excel_file = os.environ.get('EXCEL_FILE', EXCEL_FILE)
+    cambios = leer_journal(excel_file)
+    return aplicar_overlay(categorizar(leer_excel_con_snapshot(excel_file)), cambios)
+
+
+def categorizar(df):
+    """
+    Convierte COLUMNAS_CATEGORICAS a dtype category (un código por fila y cada texto distinto una
+    sola vez). La categoría '' siempre existe para que fillna('') siga funcionando.
+    """
+    for col in COLUMNAS_CATEGORICAS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str).astype('category')
+        if col in df.columns and '' not in df[col].cat.categories:
+            df[col] = df[col].cat.add_categories([''])
+    return df
+
+
+# Ruta del Excel -> ((tamaño, mtime_ns), huella con SHA-256) de la última lectura en este proceso
+_HUELLAS_EXCEL = {}
+
+
+def huella_excel(excel_file):
+    """
+    huella_archivo con SHA-256, recalculando el hash solo si cambiaron el tamaño o el mtime
+    (os.stat es barato; hashear el libro completo en cada lectura no).
+    """
+    st = os.stat(excel_file)
+    firma = (st.st_size, st.st_mtime_ns)
+    guardada = _HUELLAS_EXCEL.get(excel_file)
+    if guardada is not None and guardada[0] == firma:
+        return guardada[1]
+    huella = huella_archivo(excel_file)
+    _HUELLAS_EXCEL[excel_file] = (firma, huella)
+    return huella
+
+
+def leer_excel_con_snapshot(excel_file):
+    """DataFrame normalizado del Excel tal como está en disco (sin journal), vía snapshot."""
+    huella = huella_excel(excel_file)
+    df = cargar_snapshot_excel(huella)
+    if df is None:
+        df = leer_excel_normalizado(excel_file)
+        guardar_snapshot_excel(huella, df)
+    return df
+
+
+def leer_excel_normalizado(excel_file):
+    """Lee la hoja DETALLE del Excel y devuelve el DataFrame normalizado y ordenado por ORD."""
+    df = pd.read_excel(excel_file, sheet_name='DETALLE', header=0, dtype={'MATRICULA 2025': str})
     df.columns = [normalizar_columna(c) for c in df.columns]
     df = limpiar_nans(df)
     # Asegurar orden por ORD cuando se lee desde Excel
@@ -75,6 +198,53 @@ def cargar_datos():
     return df
 
 
+def _rutas_snapshot(huella):
+    base = os.path.join(SNAPSHOT_DIR, f"{huella['archivo']}.{huella['sha256'][:16]}")
+    return base + '.feather', base + '.pkl'
+
+
+def cargar_snapshot_excel(huella):
+    """Devuelve el DataFrame del snapshot que corresponde a la huella del Excel, o None."""
+    ruta_feather, ruta_pkl = _rutas_snapshot(huella)
+    try:
+        if feather is not None and os.path.exists(ruta_feather):
+            return feather.read_table(ruta_feather, memory_map=True).to_pandas()
+        if os.path.exists(ruta_pkl):
+            with open(ruta_pkl, 'rb') as f:
+                return pickle.load(f)
+    except Exception as e:
+        print(f'Advertencia al leer snapshot del Excel: {e}')
+    return None
+
+
+def guardar_snapshot_excel(huella, df):
+    """
+    Guarda el DataFrame normalizado como snapshot de la huella dada (Feather si pyarrow está
+    disponible y las columnas lo permiten, si no pickle) y borra los snapshots anteriores.
+    """
+    ruta_feather, ruta_pkl = _rutas_snapshot(huella)
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        ruta = None
+        if feather is not None:
+            try:
+                feather.write_feather(df.reset_index(drop=True), ruta_feather + '.tmp')
+                ruta = ruta_feather
+            except Exception:
+                # Columnas con tipos mezclados (p. ej. ORD numérico y '') no caben en Arrow
+                ruta = None
+        if ruta is None:
+            with open(ruta_pkl + '.tmp', 'wb') as f:
+                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+            ruta = ruta_pkl
+        os.replace(ruta + '.tmp', ruta)
+        for viejo in glob.glob(os.path.join(SNAPSHOT_DIR, f"{huella['archivo']}.*")):
+            if viejo != ruta:
+                os.remove(viejo)
+    except Exception as e:
+        print(f'Advertencia al guardar snapshot del Excel: {e}')
+
+
 def df_from_db():
     """Convierte los registros de la tabla Vehiculo a un DataFrame con las columnas normalizadas esperadas.
     Implementación rápida usando SQL directo si models_db está disponible.
@@ -154,56 +324,12 @@ def df_from_db():
     return df
 
 
-# Funciones rápidas para obtener divisiones / brigadas / unidades desde la BD sin leer todo el Excel
-def get_divisiones_db():
-    """Devuelve lista ordenada de divisiones usando la BD si está disponible, sino usa cargar_datos()."""
-    if models_db is not None:
-        try:
-            sql = "SELECT DISTINCT division FROM vehiculos WHERE division IS NOT NULL AND division <> '' ORDER BY division"
-            df = pd.read_sql_query(sql, models_db.engine)
-            return sorted(df['division'].dropna().unique().tolist())
-        except Exception as e:
-            print(f'Advertencia al obtener divisiones desde DB: {e}')
-    # Fallback
-    df = cargar_datos()
-    return sorted(df['DIVISION'].dropna().unique().tolist()) if 'DIVISION' in df.columns else []
-
-
-def get_brigadas_db(division):
-    if models_db is not None:
-        try:
-            sql = "SELECT DISTINCT brigada FROM vehiculos WHERE division = %s AND brigada IS NOT NULL AND brigada <> '' ORDER BY brigada"
-            # usar read_sql_query con params
-            df = pd.read_sql_query(sql, models_db.engine, params=(division,))
-            return sorted(df['brigada'].dropna().unique().tolist())
-        except Exception as e:
-            print(f'Advertencia al obtener brigadas desde DB: {e}')
-    df = cargar_datos()
-    if 'DIVISION' in df.columns and 'BRIGADA' in df.columns:
-        return sorted(df[df['DIVISION'] == division]['BRIGADA'].dropna().unique().tolist())
-    return []
-
-
-def get_unidades_db(division, brigada):
-    if models_db is not None:
-        try:
-            sql = "SELECT DISTINCT unidad FROM vehiculos WHERE division = %s AND brigada = %s AND unidad IS NOT NULL AND unidad <> '' ORDER BY unidad"
-            df = pd.read_sql_query(sql, models_db.engine, params=(division, brigada))
-            return sorted(df['unidad'].dropna().unique().tolist())
-        except Exception as e:
-            print(f'Advertencia al obtener unidades desde DB: {e}')
-    df = cargar_datos()
-    if 'DIVISION' in df.columns and 'BRIGADA' in df.columns and 'UNIDAD' in df.columns:
-        return sorted(df[(df['DIVISION'] == division) & (df['BRIGADA'] == brigada)]['UNIDAD'].dropna().unique().tolist())
-    return []
-
-
 def limpiar_nans(df):
     df = df.fillna('')  # Rellenar valores NaN con cadenas vacías
     if 'PLACAS' in df.columns:
         # Normalizar: convertir a str, pasar a mayúsculas y eliminar cualquier carácter no alfanumérico
         # Ejemplo: " abc-123 " -> "ABC123"
-        df['PLACAS'] = df['PLACAS'].astype(str).str.upper().str.replace(r'[^A-Z0-9]', '', regex=True)
+        df['PLACAS'] = normalizar_placas(df['PLACAS'])
     return df
 
 def obtener_opciones(df, division=None, brigada=None):
@@ -230,23 +356,98 @@ def filtrar_vehiculos(df, division=None, brigada=None, unidad=None):
         df = df[df['UNIDAD'] == unidad]
     return df
 
+def version_datos():
+    """Versión global de los datos (tabla datos_version). 0 si aún no hubo escrituras."""
+    if models_db is None:
+        return 0
+    with models_db.engine.connect() as conn:
+        version = conn.execute(sentencia('SELECT version FROM datos_version WHERE id = 1')).scalar()
+    return int(version or 0)
+
+
+def version_datos_vigente():
+    """
+    Versión de datos con la que validar las cachés de este proceso. Consulta la DB como mucho
+    una vez cada DB_VERSION_CHECK_INTERVAL segundos; entre consultas usa el último valor leído.
+    """
+    try:
+        intervalo = current_app.config.get('DB_VERSION_CHECK_INTERVAL', _DEFAULT_VERSION_CHECK_INTERVAL)
+    except Exception:
+        intervalo = _DEFAULT_VERSION_CHECK_INTERVAL
+    now = time.time()
+    if _DB_CACHE['version'] is None or now - _DB_CACHE['verificado'] >= intervalo:
+        _DB_CACHE['version'] = version_datos()
+        _DB_CACHE['verificado'] = now
+        _CACHE_STATS['revalidaciones'] += 1
+    return _DB_CACHE['version']
+
+
+def incrementar_version_datos(conn=None):
+    """
+    Incrementa la versión global de datos. Si se pasa conn, se ejecuta en esa transacción
+    (junto con la escritura); si no, en una transacción propia. Devuelve la nueva versión.
+    """
+    if conn is None:
+        with models_db.engine.begin() as conn:
+            return incrementar_version_datos(conn)
+    actualizadas = conn.execute(text(
+        'UPDATE datos_version SET version = version + 1, actualizado_en = CURRENT_TIMESTAMP WHERE id = 1'
+    )).rowcount
+    if not actualizadas:
+        conn.execute(text(
+            'INSERT INTO datos_version (id, version, actualizado_en) VALUES (1, 1, CURRENT_TIMESTAMP)'
+        ))
+    return int(conn.execute(text('SELECT version FROM datos_version WHERE id = 1')).scalar())
+
+
+def estadisticas_cache():
+    """Contadores de la caché de este proceso (hits, misses, recargas, revalidaciones)."""
+    return dict(_CACHE_STATS, version=_DB_CACHE['version'], version_df=_DB_CACHE['version_df'])
+
+
 # Nueva función para invalidar caché desde la app cuando se hagan cambios (commit/guardar)
-def invalidate_db_cache():
-    """Invalidar la caché de datos leídos desde la base de datos."""
+def invalidate_db_cache(version=None):
+    """
+    Invalidar la caché de datos leídos desde la base de datos en todos los workers:
+    incrementa la versión global (los demás procesos la verán en su próxima revalidación)
+    y descarta la copia local. Si la escritura ya incrementó la versión en su transacción,
+    se pasa esa versión y no se vuelve a incrementar.
+    """
     global _DB_CACHE
+    try:
+        if version is not None:
+            _DB_CACHE['version'] = version
+            _DB_CACHE['verificado'] = time.time()
+        elif models_db is not None:
+            _DB_CACHE['version'] = incrementar_version_datos()
+            _DB_CACHE['verificado'] = time.time()
+    except Exception as e:
+        print(f'Advertencia al incrementar la versión de datos: {e}')
+        _DB_CACHE['version'] = None
     _DB_CACHE['df'] = None
-    _DB_CACHE['ts'] = 0
+    _DB_CACHE['version_df'] = None
 
 
 # --- FUNCION PARA IMPORTAR EXCEL A LA DB ---
-def guardar_excel_en_db(force=False):
+def guardar_excel_en_db(force=False, sincronizar=False, solo_si_cambio=False):
     """
-    Lee el Excel y lo inserta en la base de datos usando el modelo Vehiculo.
+    Lee el Excel y lo inserta en la base de datos usando la carga masiva de importacion.py.
     Si force=True, borra todos los registros antes de importar.
+    Si sincronizar=True, aplica solo las diferencias (INSERT/UPDATE/DELETE) por ORD.
+    Si solo_si_cambio=True, no lee el Excel cuando su huella coincide con la última importación.
     """
-    from models import Vehiculo, db
+    from importacion import importar_dataframe, sincronizar_dataframe, excel_sin_cambios, registrar_importacion
     excel_file = os.environ.get('EXCEL_FILE', EXCEL_FILE)
-    
+
+    if solo_si_cambio:
+        try:
+            if excel_sin_cambios(excel_file):
+                print(f'{excel_file} no cambió desde la última importación; se omite.')
+                return 'Sin cambios: importación omitida'
+        except Exception as e:
+            print(f'Advertencia al consultar el manifiesto de importaciones: {e}')
+
+    huella = huella_archivo(excel_file)
     print(f'Leyendo archivo: {excel_file}')
     
     # Verificar que existe la hoja DETALLE
@@ -261,7 +462,7 @@ def guardar_excel_en_db(force=False):
     print(f'Leyendo hoja: DETALLE')
     
     # Leer la hoja DETALLE con header=0 (primera fila son los encabezados)
-    df = pd.read_excel(excel_file, sheet_name='DETALLE', header=0, dtype=str)  # dtype=str para leer todo como texto
+    df = pd.read_excel(xls, sheet_name='DETALLE', header=0, dtype=str)  # dtype=str para leer todo como texto
     
     print(f'\nColumnas originales: {list(df.columns)}')
     
@@ -280,231 +481,374 @@ def guardar_excel_en_db(force=False):
         print(f'Columnas disponibles: {list(df.columns)}')
         return "Error: Columna ORD no encontrada en la hoja DETALLE"
     
-    df = df.fillna('')
-    
-    if force:
-        deleted = Vehiculo.query.delete()
-        db.session.commit()
-        print(f'\nRegistros eliminados: {deleted}')
-    
-    count = 0
-    errores = 0
-    
-    print(f'\nIniciando importación...')
-    for idx, row in df.iterrows():
-        # Convertir ORD a entero (es el único campo numérico requerido)
-        try:
-            ord_val = int(row.get('ORD')) if row.get('ORD') not in (None, '') else None
-        except Exception as e:
-            ord_val = None
-        
-        if ord_val is None:
-            errores += 1
+    # Carga masiva vectorizada (COPY en PostgreSQL, executemany por lotes en otros motores)
+    if sincronizar:
+        print(f'\nIniciando sincronización incremental...')
+        reporte = sincronizar_dataframe(df)
+    else:
+        print(f'\nIniciando importación...')
+        reporte = importar_dataframe(df, force=force)
+    print(f'\nImportación completada: {reporte}')
+    for err in reporte.errores[:20]:
+        print(f"Fila {err['fila']} (ORD={err['ord']}): {err['motivo']}")
+    if len(reporte.errores) > 20:
+        print(f'... y {len(reporte.errores) - 20} errores más')
+    registrar_importacion(huella, reporte)
+    return str(reporte)
+
+# Longitud mínima de búsqueda que puede resolver un índice de trigramas (pg_trgm / FTS5 trigram)
+MIN_TRIGRAMA = 3
+
+
+# Vector de texto indexado en PostgreSQL (debe coincidir con la expresión del índice GIN)
+TSVECTOR_BUSQUEDA = "to_tsvector('simple', coalesce(busqueda, ''))"
+
+
+def consulta_texto(q, dialecto=None):
+    """
+    Traduce el texto libre q a la sintaxis del motor: todos los términos deben aparecer, cada uno
+    como prefijo ("perez 4jh1" -> PEREZ:* & 4JH1:* en PostgreSQL, "PEREZ"* "4JH1"* en FTS5).
+    Devuelve None si q no tiene términos.
+    """
+    terminos = terminos_busqueda(q)
+    if not terminos:
+        return None
+    if dialecto == 'postgresql':
+        return ' & '.join(f'{t}:*' for t in terminos)
+    if dialecto == 'sqlite':
+        return ' '.join(f'"{t}"*' for t in terminos)
+    return terminos
+
+
+def rangos_de_argumentos(args):
+    """
+    Lee los filtros de rango (<nombre>_min / <nombre>_max de RANGOS) de los argumentos de la
+    petición. Devuelve una tupla ordenada de (nombre, mínimo, máximo), o None si no hay ninguno.
+    Lanza ValueError si un límite no es numérico.
+    """
+    rangos = []
+    for nombre in sorted(RANGOS):
+        limites = []
+        for sufijo in ('min', 'max'):
+            valor = args.get(f'{nombre}_{sufijo}')
+            try:
+                limites.append(float(valor) if valor not in (None, '') else None)
+            except ValueError:
+                raise ValueError(f'{nombre}_{sufijo} debe ser numérico')
+        if limites != [None, None]:
+            rangos.append((nombre, *limites))
+    return tuple(rangos) or None
+
+
+def filtros_sql(division=None, brigada=None, unidad=None, placa=None, dialecto=None, q=None, rangos=None):
+    """
+    Construye las condiciones WHERE (con parámetros nombrados) comunes a query_vehiculos y
+    count_vehiculos. La placa se busca como subcadena sobre la columna placas_norm, que usa
+    el índice de trigramas en PostgreSQL y la tabla FTS5 vehiculos_placas_fts en SQLite.
+    q es una búsqueda de texto sobre placas, chasis, motor, código ESBYE y custodio
+    (índice GIN/tsvector en PostgreSQL, tabla FTS5 vehiculos_fts en SQLite).
+    rangos (ver rangos_de_argumentos) filtra por las columnas numéricas de COLUMNAS_NUMERICAS.
+    """
+    sql = " WHERE 1=1"
+    params = {}
+    if division:
+        sql += " AND division = :division"
+        params['division'] = division
+    if brigada:
+        sql += " AND brigada = :brigada"
+        params['brigada'] = brigada
+    if unidad:
+        sql += " AND unidad = :unidad"
+        params['unidad'] = unidad
+    if placa:
+        placa_norm = normalizar_placa(placa.strip())
+        if dialecto == 'sqlite' and len(placa_norm) >= MIN_TRIGRAMA:
+            # El tokenizador trigram de FTS5 resuelve LIKE '%x%' con el índice
+            sql += " AND id IN (SELECT rowid FROM vehiculos_placas_fts WHERE placas_norm LIKE :placa)"
+        else:
+            sql += " AND placas_norm LIKE :placa"
+        params['placa'] = f"%{placa_norm}%"
+    consulta = consulta_texto(q, dialecto) if q else None
+    if consulta:
+        if dialecto == 'postgresql':
+            sql += f" AND {TSVECTOR_BUSQUEDA} @@ to_tsquery('simple', :q)"
+            params['q'] = consulta
+        elif dialecto == 'sqlite':
+            # El filtro lo aplica el JOIN con vehiculos_fts de desde_sql()
+            params['q'] = consulta
+        else:
+            for i, termino in enumerate(consulta):
+                sql += f" AND busqueda LIKE :q{i}"
+                params[f'q{i}'] = f"%{termino}%"
+    for nombre, minimo, maximo in rangos or ():
+        columna = COLUMNAS_NUMERICAS[RANGOS[nombre]]
+        if minimo is not None:
+            sql += f" AND {columna} >= :{nombre}_min"
+            params[f'{nombre}_min'] = minimo
+        if maximo is not None:
+            sql += f" AND {columna} <= :{nombre}_max"
+            params[f'{nombre}_max'] = maximo
+    return sql, params
+
+
+def desde_sql(q=None, dialecto=None):
+    """
+    FROM de query_vehiculos/count_vehiculos. En SQLite, con búsqueda de texto, se une una sola
+    vez con el resultado del MATCH en vehiculos_fts (que filtra y aporta el rank bm25).
+    """
+    if q and dialecto == 'sqlite' and consulta_texto(q, dialecto):
+        return (" FROM vehiculos JOIN (SELECT rowid AS fts_id, rank AS fts_rank FROM vehiculos_fts"
+                " WHERE vehiculos_fts MATCH :q) fts ON fts.fts_id = vehiculos.id")
+    return " FROM vehiculos"
+
+
+def orden_sql(q=None, dialecto=None):
+    """ORDER BY de query_vehiculos: por relevancia si hay búsqueda de texto, luego por ORD."""
+    if q and consulta_texto(q, dialecto):
+        if dialecto == 'postgresql':
+            return f" ORDER BY ts_rank({TSVECTOR_BUSQUEDA}, to_tsquery('simple', :q)) DESC, ord"
+        if dialecto == 'sqlite':
+            # rank de FTS5 (bm25): menor es más relevante
+            return " ORDER BY fts.fts_rank, ord"
+    return " ORDER BY ord"
+
+
+def filtrar_df(df, division=None, brigada=None, unidad=None, placa=None, q=None, rangos=None):
+    """Aplica sobre un DataFrame (fallback sin DB) los mismos filtros que filtros_sql."""
+    if division:
+        df = df[df['DIVISION'] == division] if 'DIVISION' in df.columns else df
+    if brigada:
+        df = df[df['BRIGADA'] == brigada] if 'BRIGADA' in df.columns else df
+    if unidad:
+        df = df[df['UNIDAD'] == unidad] if 'UNIDAD' in df.columns else df
+    if placa and 'PLACAS' in df.columns:
+        placa_norm = normalizar_placa(placa.strip())
+        df = df[df['PLACAS'].astype(str).str.contains(placa_norm, na=False)]
+    terminos = terminos_busqueda(q) if q else []
+    if terminos and not df.empty:
+        campos = {col: campo for col, campo in COLUMNAS_DB.items() if col in df.columns}
+        texto = texto_busqueda_serie(df[list(campos)].rename(columns=campos))
+        for termino in terminos:
+            df = df[texto.loc[df.index].str.contains(patron_termino(termino), regex=True)]
+    columnas_excel = {campo: col for col, campo in COLUMNAS_DB.items()}
+    for nombre, minimo, maximo in rangos or ():
+        col = columnas_excel[RANGOS[nombre]]
+        if col not in df.columns:
             continue
-        
-        try:
-            # Todos los demás campos se guardan como string tal cual vienen
-            v = Vehiculo(
-                ord=ord_val,
-                clase_tipo=str(row.get('CLASE / TIPO', '')),
-                marca=str(row.get('MARCA', '')),
-                modelo=str(row.get('MODELO', '')),
-                chasis=str(row.get('CHASIS', '')),
-                motor=str(row.get('MOTOR', '')),
-                ano=str(row.get('ANO', '')),  # Guardar como string
-                registro=str(row.get('REGISTRO', '')),
-                placas=str(row.get('PLACAS', '')),
-                color=str(row.get('COLOR', '')),
-                tonelaje=str(row.get('TONELAJE', '')),
-                cilindraje=str(row.get('CILINDRAJE', '')),
-                combustible=str(row.get('COMBUSTIBLE', '')),
-                num_pasajeros=str(row.get('# PASAJ', '')),  # Guardar como string
-                valor_esbye=str(row.get('VALOR ESBYE', '')),
-                valor_comercial=str(row.get('VALOR COMERCIAL', '')),
-                division=str(row.get('DIVISION', '')),
-                brigada=str(row.get('BRIGADA', '')),
-                unidad=str(row.get('UNIDAD', '')),
-                necesidad_operacional_ft=str(row.get('NECESIDAD OPERACIONAL FT', '')),
-                condicion=str(row.get('CONDICION', '')),
-                estado=str(row.get('ESTADO', '')),
-                codigo_esbye=str(row.get('CODIGO ESBYE', '')),
-                eod=str(row.get('EOD', '')),
-                digito=str(row.get('DIGITO', '')),
-                matricula_2025=str(row.get('MATRICULA 2025', '')),
-                custodio=str(row.get('CUSTODIO', '')),
-                observacion=str(row.get('OBSERVACION', ''))
-            )
-            db.session.add(v)
-            count += 1
-            
-            # Commit cada 100 registros para evitar problemas de memoria
-            if count % 100 == 0:
-                db.session.commit()
-                print(f'Procesados {count} registros...')
-        except Exception as e:
-            print(f'Fila {idx+2} (ORD={ord_val}): Error al crear vehículo: {e}')
-            db.session.rollback()  # Hacer rollback en caso de error
-            errores += 1
-    
-    # Commit final
-    try:
-        db.session.commit()
-        invalidate_db_cache()
-    except Exception as e:
-        print(f'Error en commit final: {e}')
-        db.session.rollback()
-    
-    print(f'\nImportación completada: {count} registros importados, {errores} errores')
-    return f"{count} registros importados, {errores} errores"
+        numeros = valores_numericos(df[col])
+        if minimo is not None:
+            df, numeros = df[numeros >= minimo], numeros[numeros >= minimo]
+        if maximo is not None:
+            df = df[numeros <= maximo]
+    return df
+
+
+# SELECT de query_vehiculos: columnas de la tabla con alias a las claves de COLUMNAS
+SQL_SELECT_VEHICULOS = "SELECT " + ", ".join(f'{campo} AS "{col}"' for col, campo in COLUMNAS_DB.items())
+
+# Camino sin pandas (filas_vehiculos): tabla de alias precalculada clave -> columna.
+# PLACAS se lee ya normalizada de placas_norm, como la deja limpiar_nans.
+_COLUMNAS_FILA = [(col, 'placas_norm' if campo == 'placas' else campo) for col, campo in COLUMNAS_DB.items()]
+SQL_SELECT_FILAS = "SELECT " + ", ".join(campo for _, campo in _COLUMNAS_FILA)
+CLAVES_FILA = tuple(col for col, _ in _COLUMNAS_FILA)
+# /api/vehiculos agrega la versión de la fila, que el cliente reenvía al editar (concurrencia optimista)
+SQL_SELECT_API = SQL_SELECT_FILAS + ", version"
+CLAVES_API = CLAVES_FILA + ('VERSION',)
+
+
+@lru_cache(maxsize=512)
+def sentencia(sql):
+    """
+    text() de una consulta, construido una vez por SQL distinto. Los filtros solo cambian los
+    parámetros, así que las combinaciones posibles son pocas: reutilizar el mismo objeto evita
+    volver a analizar los parámetros del texto y aprovecha la caché de compilación del engine.
+    """
+    return text(sql)
+
+
+def sql_vehiculos(select, dialecto, division=None, brigada=None, unidad=None, placa=None, limit=None,
+                  offset=None, q=None, despues_de=None, antes_de=None, con_total=False, rangos=None):
+    """SQL y parámetros de una página de vehículos (común a query_vehiculos y filas_vehiculos)."""
+    sql = select
+    if con_total:
+        sql += ', COUNT(*) OVER () AS "_TOTAL"'
+    where, params = filtros_sql(division, brigada, unidad, placa, dialecto=dialecto, q=q, rangos=rangos)
+    if despues_de is not None:
+        where += " AND ord > :despues_de"
+        params['despues_de'] = int(despues_de)
+    if antes_de is not None:
+        where += " AND ord < :antes_de"
+        params['antes_de'] = int(antes_de)
+    sql += desde_sql(q, dialecto=dialecto) + where
+    # Hacia atrás se leen las filas más cercanas a antes_de (DESC) y luego se invierten
+    sql += " ORDER BY ord DESC" if antes_de is not None else orden_sql(q, dialecto=dialecto)
+    if limit is not None:
+        sql += " LIMIT :limit"
+        params['limit'] = int(limit)
+    if offset is not None:
+        sql += " OFFSET :offset"
+        params['offset'] = int(offset)
+    return sql, params
 
-def query_vehiculos(division=None, brigada=None, unidad=None, placa=None, limit=None, offset=None):
+
+def query_vehiculos(division=None, brigada=None, unidad=None, placa=None, limit=None, offset=None, q=None,
+                    despues_de=None, antes_de=None, con_total=False, rangos=None):
     """
     Consulta rápida desde la BD con soporte de offset (paginación).
-    El filtro por placa se hace en SQL si posible, normalizando la búsqueda.
+    El filtro por placa se hace en SQL sobre la columna indexada placas_norm.
+    Con q (búsqueda de texto) los resultados se ordenan por relevancia.
+    despues_de / antes_de paginan por clave (keyset) sobre ORD: devuelven las filas con ORD
+    mayor / menor que el valor dado, siempre en orden ascendente, sin recorrer las anteriores.
+    Con con_total=True devuelve (df, total): el total de filas que cumplen los filtros se calcula
+    en la misma consulta con COUNT(*) OVER (). Es None si la página sale vacía, y no se admite
+    junto con despues_de/antes_de (el total contaría solo las filas posteriores al cursor).
     """
+    if con_total and (despues_de is not None or antes_de is not None):
+        raise ValueError('con_total no se puede combinar con paginación por cursor')
     if models_db is not None:
         try:
             # Detectar motor (Postgres o SQLite)
             engine_name = str(models_db.engine.url.get_backend_name()).lower()
-            sql = """
-                SELECT
-                    ord AS ORD,
-                    clase_tipo AS "CLASE / TIPO",
-                    marca AS MARCA,
-                    modelo AS MODELO,
-                    chasis AS CHASIS,
-                    motor AS MOTOR,
-                    ano AS ANO,
-                    registro AS REGISTRO,
-                    placas AS PLACAS,
-                    color AS COLOR,
-                    tonelaje AS TONELAJE,
-                    cilindraje AS CILINDRAJE,
-                    combustible AS COMBUSTIBLE,
-                    num_pasajeros AS "# PASAJ",
-                    valor_esbye AS "VALOR ESBYE",
-                    valor_comercial AS "VALOR COMERCIAL",
-                    division AS DIVISION,
-                    brigada AS BRIGADA,
-                    unidad AS UNIDAD,
-                    necesidad_operacional_ft AS "NECESIDAD OPERACIONAL FT",
-                    condicion AS CONDICION,
-                    estado AS ESTADO,
-                    codigo_esbye AS "CODIGO ESBYE",
-                    eod AS EOD,
-                    digito AS DIGITO,
-                    matricula_2025 AS "MATRICULA 2025",
-                    custodio AS CUSTODIO,
-                    observacion AS OBSERVACION
-                FROM vehiculos
-                WHERE 1=1
-            """
-            params = {}
-            if division:
-                sql += " AND division = :division"
-                params['division'] = division
-            if brigada:
-                sql += " AND brigada = :brigada"
-                params['brigada'] = brigada
-            if unidad:
-                sql += " AND unidad = :unidad"
-                params['unidad'] = unidad
-            # Filtro por placa en SQL si posible
-            if placa:
-                placa_norm = re.sub(r'[^A-Z0-9]', '', placa.strip().upper())
-                if engine_name == "postgresql":
-                    # Usar ILIKE y regexp_replace para normalizar en SQL
-                    sql += " AND regexp_replace(upper(placas), '[^A-Z0-9]', '', 'g') ILIKE :placa"
-                    params['placa'] = f"%{placa_norm}%"
-                elif engine_name == "sqlite":
-                    # Usar LIKE y upper() para SQLite
-                    sql += " AND replace(replace(replace(replace(replace(replace(replace(replace(replace(replace(upper(placas),' ',''),'-',''),'.',''),'/',''),',',''),';',''),':',''),'_',''),'#',''),'Ñ','N') LIKE :placa"
-                    params['placa'] = f"%{placa_norm}%"
-                else:
-                    # Otros motores: filtrar en pandas después
-                    pass
-            sql += " ORDER BY ord"
-            if limit is not None:
-                sql += " LIMIT :limit"
-                params['limit'] = int(limit)
-            if offset is not None:
-                sql += " OFFSET :offset"
-                params['offset'] = int(offset)
-
-            df = pd.read_sql_query(sql, models_db.engine, params=params)
+            sql, params = sql_vehiculos(SQL_SELECT_VEHICULOS, engine_name, division, brigada, unidad, placa,
+                                        limit, offset, q, despues_de, antes_de, con_total, rangos)
+            df = pd.read_sql_query(sentencia(sql), models_db.engine, params=params)
             df.columns = [normalizar_columna(c) for c in df.columns]
             df = limpiar_nans(df)
-
-            # Si el motor no soporta filtro SQL por placa, filtrar en pandas
-            if placa and engine_name not in ("postgresql", "sqlite") and 'PLACAS' in df.columns:
-                placa_norm = re.sub(r'[^A-Z0-9]', '', placa.strip().upper())
-                df = df[df['PLACAS'].astype(str).str.contains(placa_norm, na=False)]
-
+            if antes_de is not None:
+                df = df.iloc[::-1].reset_index(drop=True)
+            if con_total:
+                total = int(df['_TOTAL'].iloc[0]) if not df.empty else None
+                return df.drop(columns=['_TOTAL']), total
             return df
         except Exception as e:
             print(f'Advertencia: error en query_vehiculos (SQL rápido): {e}')
             # caer al fallback
 
-    # Fallback: usar cargar_datos y filtrar en pandas (más lento)
-    df = cargar_datos()
-    if division:
-        df = df[df['DIVISION'] == division] if 'DIVISION' in df.columns else df
-    if brigada:
-        df = df[df['BRIGADA'] == brigada] if 'BRIGADA' in df.columns else df
-    if unidad:
-        df = df[df['UNIDAD'] == unidad] if 'UNIDAD' in df.columns else df
-    if placa and 'PLACAS' in df.columns:
-        placa_norm = re.sub(r'[^A-Z0-9]', '', placa.strip().upper())
-        df = df[df['PLACAS'].astype(str).str.contains(placa_norm, na=False)]
-    if offset is not None and limit is not None:
-        df = df.iloc[offset: offset + limit]
-    elif limit is not None:
-        df = df.head(limit)
+    # Fallback: almacén en memoria (almacen.py), construido una vez por versión de datos:
+    # filtrar y paginar son cortes de arreglos de posiciones ya ordenadas por ORD
+    from almacen import obtener_almacen
+    df, total = obtener_almacen().pagina(limit=limit, offset=offset, despues_de=despues_de, antes_de=antes_de,
+                                         division=division, brigada=brigada, unidad=unidad, placa=placa, q=q,
+                                         rangos=rangos)
+    if con_total:
+        return df, total
+    return df
+
+
+def filas_vehiculos(division=None, brigada=None, unidad=None, placa=None, limit=None, offset=None, q=None,
+                    despues_de=None, antes_de=None, con_total=False, rangos=None):
+    """
+    Igual que query_vehiculos pero devuelve una lista de dicts (clave de COLUMNAS -> valor) sin
+    pasar por pandas: las tuplas se leen de una conexión del pool y se mapean con CLAVES_API
+    (las columnas de COLUMNAS más VERSION, la versión de la fila).
+    Es el camino de /api/vehiculos, donde construir un DataFrame por página domina la latencia.
+    Sin DB (o si la consulta falla) recurre a query_vehiculos.
+    """
+    if con_total and (despues_de is not None or antes_de is not None):
+        raise ValueError('con_total no se puede combinar con paginación por cursor')
+    if models_db is not None:
+        try:
+            engine_name = str(models_db.engine.url.get_backend_name()).lower()
+            sql, params = sql_vehiculos(SQL_SELECT_API, engine_name, division, brigada, unidad, placa,
+                                        limit, offset, q, despues_de, antes_de, con_total, rangos)
+            with models_db.engine.connect() as conn:
+                filas = conn.execute(sentencia(sql), params).all()
+            if antes_de is not None:
+                filas.reverse()
+            claves = CLAVES_API
+            registros = [
+                {k: ('' if v is None else v) for k, v in zip(claves, fila)}
+                for fila in filas
+            ]
+            if con_total:
+                return registros, (int(filas[0][-1]) if filas else None)
+            return registros
+        except Exception as e:
+            print(f'Advertencia: error en filas_vehiculos (SQL directo): {e}')
+
+    resultado = query_vehiculos(division, brigada, unidad, placa, limit, offset, q, despues_de, antes_de, con_total,
+                                rangos)
+    if con_total:
+        df, total = resultado
+        return df.to_dict(orient='records'), total
+    return resultado.to_dict(orient='records')
+
+
+def _clave_total(division, brigada, unidad, placa, q, rangos=None):
     try:
-        if 'ORD' in df.columns:
-            df['ORD_SORT'] = pd.to_numeric(df['ORD'], errors='coerce')
-            df = df.sort_values(by=['ORD_SORT']).drop(columns=['ORD_SORT'])
+        version = version_datos_vigente() if models_db is not None else None
     except Exception:
-        pass
-    return df
+        version = None
+    if version is None:
+        return None
+    return (division or '', brigada or '', unidad or '', normalizar_placa(placa),
+            tuple(terminos_busqueda(q)), tuple(rangos or ()), version)
+
 
+def guardar_total(total, division=None, brigada=None, unidad=None, placa=None, q=None, rangos=None):
+    """Guarda en el LRU el total de un filtro para la versión de datos vigente."""
+    clave = _clave_total(division, brigada, unidad, placa, q, rangos)
+    if clave is None or total is None:
+        return
+    with _TOTALES_GUARDA:
+        _TOTALES[clave] = int(total)
+        _TOTALES.move_to_end(clave)
+        while len(_TOTALES) > _TOTALES_MAX:
+            _TOTALES.popitem(last=False)
 
-def count_vehiculos(division=None, brigada=None, unidad=None, placa=None):
+
+def total_vehiculos(division=None, brigada=None, unidad=None, placa=None, q=None, rangos=None):
     """
-    Devuelve el total de registros que cumplen filtros (rápido usando COUNT en DB si es posible).
+    count_vehiculos con caché LRU por (filtros, versión de datos): al paginar un mismo filtro
+    no se vuelve a contar hasta que una escritura cambie la versión.
+    """
+    clave = _clave_total(division, brigada, unidad, placa, q, rangos)
+    if clave is not None:
+        with _TOTALES_GUARDA:
+            total = _TOTALES.get(clave)
+            if total is not None:
+                _TOTALES.move_to_end(clave)
+        if total is not None:
+            _CACHE_STATS['totales_hits'] += 1
+            return total
+    _CACHE_STATS['totales_misses'] += 1
+    total = count_vehiculos(division=division, brigada=brigada, unidad=unidad, placa=placa, q=q, rangos=rangos)
+    guardar_total(total, division, brigada, unidad, placa, q, rangos)
+    return total
+
+
+def codificar_cursor(posicion):
+    """Cursor opaco de paginación (JSON en base64 url-safe) a partir de un dict de posición."""
+    crudo = json.dumps(posicion, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(crudo).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Inverso de codificar_cursor. Lanza ValueError si el cursor no es válido."""
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        posicion = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+    except Exception:
+        raise ValueError('cursor inválido')
+    if not isinstance(posicion, dict):
+        raise ValueError('cursor inválido')
+    return posicion
+
+
+def count_vehiculos(division=None, brigada=None, unidad=None, placa=None, q=None, rangos=None):
+    """
+    Devuelve el total de registros que cumplen filtros (COUNT(*) en la DB, también con placa).
     """
     if models_db is not None:
         try:
-            sql = "SELECT COUNT(*) AS cnt FROM vehiculos WHERE 1=1"
-            params = {}
-            if division:
-                sql += " AND division = :division"
-                params['division'] = division
-            if brigada:
-                sql += " AND brigada = :brigada"
-                params['brigada'] = brigada
-            if unidad:
-                sql += " AND unidad = :unidad"
-                params['unidad'] = unidad
-            # Si se incluye placa, realizar conteo conservador (sin normalizar en SQL)
-            # Para placas, mejor fallback: leer matching parcial en pandas si es necesario
-            if placa:
-                # usar fallback lento: obtener df y contar
-                df = query_vehiculos(division=division, brigada=brigada, unidad=unidad, placa=placa)
-                return int(len(df))
-            df = pd.read_sql_query(sql, models_db.engine, params=params)
-            return int(df['cnt'].iloc[0]) if not df.empty else 0
+            engine_name = str(models_db.engine.url.get_backend_name()).lower()
+            where, params = filtros_sql(division, brigada, unidad, placa, dialecto=engine_name, q=q, rangos=rangos)
+            sql = "SELECT COUNT(*) AS cnt" + desde_sql(q, dialecto=engine_name) + where
+            with models_db.engine.connect() as conn:
+                return int(conn.execute(sentencia(sql), params).scalar() or 0)
         except Exception as e:
             print(f'Advertencia al contar vehiculos en DB: {e}')
-    # Fallback: contar desde cargar_datos()
-    df = cargar_datos()
-    if division:
-        df = df[df['DIVISION'] == division] if 'DIVISION' in df.columns else df
-    if brigada:
-        df = df[df['BRIGADA'] == brigada] if 'BRIGADA' in df.columns else df
-    if unidad:
-        df = df[df['UNIDAD'] == unidad] if 'UNIDAD' in df.columns else df
-    if placa and 'PLACAS' in df.columns:
-        placa_norm = re.sub(r'[^A-Z0-9]', '', placa.strip().upper())
-        df = df[df['PLACAS'].astype(str).str.contains(placa_norm, na=False)]
-    return int(len(df))
\ No newline at end of file
+    # Fallback: contar en el almacén en memoria
+    from almacen import obtener_almacen
+    return obtener_almacen().contar(division=division, brigada=brigada, unidad=unidad, placa=placa, q=q,
+                                    rangos=rangos)
\ No newline at end of file
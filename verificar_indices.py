@@ -0,0 +1,121 @@
+"""
+Comprueba con EXPLAIN que las consultas de la API usan índices (y no recorren la tabla vehiculos).
+
+    python verificar_indices.py            # contra DATABASE_URL (o transportes.db)
+    python verificar_indices.py --planes   # imprime además el plan de cada consulta
+
+Los valores de los filtros se toman de una fila real de la tabla. Termina con código 1 si
+alguna consulta hace un recorrido secuencial, para poder usarlo en CI tras aplicar migraciones.
+En PostgreSQL se desactiva enable_seqscan durante el EXPLAIN: con una tabla pequeña el
+planificador prefiere el recorrido secuencial aunque el índice exista, y lo que se comprueba
+es que el índice sirve a la consulta.
+"""
+from app import create_app
+import argparse
+import json
+import sys
+
+from sqlalchemy import text
+
+
+def consultas_api(conn):
+    """(nombre, sql, params) de las consultas calientes de /api/vehiculos y de los filtros."""
+    from utils import sql_vehiculos, filtros_sql, desde_sql, SQL_SELECT_API
+    from filtros import SQL_INDICE
+    from cambios import SQL_FEED_VEHICULOS
+
+    dialecto = conn.dialect.name
+    fila = conn.execute(text(
+        "SELECT division, brigada, unidad, placas_norm, ord FROM vehiculos "
+        "WHERE division <> '' AND brigada <> '' AND unidad <> '' ORDER BY ord LIMIT 1"
+    )).first()
+    if fila is None:
+        return []
+    division, brigada, unidad, placa, ord_val = fila
+    placa = (placa or 'ABC')[:4]
+
+    def pagina(**filtros):
+        return sql_vehiculos(SQL_SELECT_API, dialecto, limit=51, **filtros)
+
+    def conteo(**filtros):
+        where, params = filtros_sql(dialecto=dialecto, **filtros)
+        return "SELECT COUNT(*) AS cnt" + desde_sql(filtros.get('q'), dialecto=dialecto) + where, params
+
+    return [
+        ('página por cursor', *pagina(despues_de=ord_val)),
+        ('página división', *pagina(division=division)),
+        ('página división+brigada', *pagina(division=division, brigada=brigada)),
+        ('página división+brigada+unidad', *pagina(division=division, brigada=brigada, unidad=unidad)),
+        ('página placa', *pagina(placa=placa)),
+        ('conteo división', *conteo(division=division)),
+        ('conteo división+brigada+unidad', *conteo(division=division, brigada=brigada, unidad=unidad)),
+        ('opciones de brigada', "SELECT DISTINCT brigada FROM vehiculos WHERE division = :division "
+                                "AND brigada IS NOT NULL AND brigada <> '' ORDER BY brigada", {'division': division}),
+        ('índice de filtros', SQL_INDICE, {}),
+        ('feed de cambios', SQL_FEED_VEHICULOS, {'seq': 1, 'ord': ord_val, 'hasta': 2 ** 40, 'limit': 501}),
+    ]
+
+
+def plan_sqlite(conn, sql, params):
+    """
+    Líneas de EXPLAIN QUERY PLAN. 'SCAN vehiculos' recorre toda la tabla (también 'USING INDEX':
+    la recorre en el orden del índice); solo se admite el recorrido de un índice que cubre la consulta.
+    Las tablas virtuales FTS (vehiculos_placas_fts, ...) siempre figuran como SCAN y no cuentan.
+    """
+    lineas = [r[-1] for r in conn.execute(text('EXPLAIN QUERY PLAN ' + sql), params)]
+    secuencial = any(l.split()[:2] == ['SCAN', 'vehiculos'] and 'COVERING INDEX' not in l for l in lineas)
+    return lineas, secuencial
+
+
+def plan_postgresql(conn, sql, params):
+    """Nodos del plan JSON; un 'Seq Scan' sobre vehiculos es un recorrido completo."""
+    # La conexión ya está en una transacción (se revierte al cerrarla): SET LOCAL no sale de ella
+    conn.execute(text('SET LOCAL enable_seqscan = off'))
+    plan = conn.execute(text('EXPLAIN (FORMAT JSON) ' + sql), params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    lineas, secuencial = [], False
+    pendientes = [(plan[0]['Plan'], 0)]
+    while pendientes:
+        nodo, nivel = pendientes.pop()
+        lineas.append('  ' * nivel + ' '.join(filter(None, [nodo['Node Type'], nodo.get('Index Name'),
+                                                           nodo.get('Relation Name')])))
+        if nodo['Node Type'] == 'Seq Scan' and nodo.get('Relation Name') == 'vehiculos':
+            secuencial = True
+        pendientes.extend((hijo, nivel + 1) for hijo in reversed(nodo.get('Plans', [])))
+    return lineas, secuencial
+
+
+def verificar_indices(engine, mostrar_planes=False):
+    """Imprime el resultado por consulta y devuelve los nombres de las que recorren la tabla."""
+    fallidas = []
+    with engine.connect() as conn:
+        explicar = plan_postgresql if conn.dialect.name == 'postgresql' else plan_sqlite
+        for nombre, sql, params in consultas_api(conn):
+            lineas, secuencial = explicar(conn, sql, params)
+            print(f"{'✗' if secuencial else '✓'} {nombre}")
+            if mostrar_planes or secuencial:
+                for linea in lineas:
+                    print(f'      {linea}')
+            if secuencial:
+                fallidas.append(nombre)
+    return fallidas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verifica con EXPLAIN que las consultas de la API usan índices.')
+    parser.add_argument('--planes', action='store_true', help='Imprime el plan de cada consulta')
+    args = parser.parse_args()
+
+    app = create_app(cargar_filtros=False)
+    with app.app_context():
+        from models import db
+        fallidas = verificar_indices(db.engine, mostrar_planes=args.planes)
+    if fallidas:
+        print(f'\n{len(fallidas)} consultas sin índice: {", ".join(fallidas)}')
+        sys.exit(1)
+    print('\nTodas las consultas usan índices.')
+
+
+if __name__ == '__main__':
+    main()